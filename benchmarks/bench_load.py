@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark loading parsed ISPD records into PostgreSQL with the multi-row
+INSERT path (PgDBI.pgmadd) against COPY FROM STDIN.
+
+Requires a PostgreSQL database reachable through PgDBI, for example a local
+server.  Records are loaded into temporary tables created from the column
+definitions in ispddb_config, so nothing is kept in the database.
+"""
+
+import json
+import sys
+import time
+
+import PgDBI
+
+from rda_ispd_python.ispd_common import *
+from rda_ispd_python.ispd_copy import copy_records_to_table
+
+#=========================================================================================
+def read_day_buffers(files):
+   """ Parse the input files into one DayBuffer per date """
+
+   buffers = []
+   for fname in files:
+      with open(fname, 'r', encoding = 'latin_1') as fh:
+         for cdate, lines in get_ispd_blocks(fh):
+            records = initialize_ispd_records()
+            for line in lines:
+               records = get_ispd_records(line, cdate, records)
+            buffers.append((cdate, records))
+
+   return buffers
+
+#=========================================================================================
+def create_scratch_tables():
+   """ Create empty temporary tables for all ISPD tables """
+
+   for aname in ISPD_NAMES:
+      PgDBI.pgexec("CREATE TEMPORARY TABLE IF NOT EXISTS {}_bench ({})".format(aname, get_table_columns_sql(aname)))
+      PgDBI.pgexec("TRUNCATE {}_bench".format(aname))
+
+#=========================================================================================
+def run_load(method, buffers):
+   """ Load all day buffers with the given method; return rows loaded and seconds taken """
+
+   create_scratch_tables()
+   rows = 0
+   start = time.perf_counter()
+   for cdate, records in buffers:
+      PgDBI.starttran()
+      for aname in ISPD_NAMES:
+         table = "{}_bench".format(aname)
+         if method == 'copy':
+            rows += copy_records_to_table(table, records[aname])
+         else:
+            rows += PgDBI.pgmadd(table, records[aname].to_records())
+      PgDBI.endtran()
+
+   return rows, time.perf_counter() - start
+
+#=========================================================================================
+def main(args):
+
+   PgDBI.default_scinfo(args.dbname, args.scname, args.host)
+   buffers = read_day_buffers(args.files)
+
+   results = []
+   for i in range(args.repeat):
+      for method in LOADMETHODS:
+         rows, secs = run_load(method, buffers)
+         results.append({'method': method, 'run': i, 'rows': rows, 'seconds': secs,
+                         'rows_per_sec': (rows/secs if secs else 0)})
+         print("{:>6} run {}: {} rows in {:.3f}s, {:.0f} rows/s".format(method, i, rows, secs, results[-1]['rows_per_sec']))
+
+   if args.output:
+      with open(args.output, 'w') as fh:
+         json.dump({'benchmark': 'load', 'files': args.files, 'results': results}, fh, indent = 2)
+
+   PgDBI.pgdisconnect()
+
+#=========================================================================================
+def parse_opts():
+   """ Parse command line arguments """
+   import argparse
+
+   parser = argparse.ArgumentParser(description = "Benchmark PgDBI.pgmadd against COPY for loading ISPD records.")
+   parser.add_argument('files', nargs="+", help="Input ISPD file names (ASCII format).")
+   parser.add_argument('-d', '--dbname', default="ispddb", help='Database name.  Default = ispddb.')
+   parser.add_argument('-c', '--scname', default="ispddb", help='Schema name.  Default = ispddb.')
+   parser.add_argument('-H', '--host', default="localhost", help='Database host.  Default = localhost.')
+   parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each method.  Default = 3.')
+   parser.add_argument('-o', '--output', help='Write the results as JSON to this file.')
+
+   return parser.parse_args(sys.argv[1:])
+
+#=========================================================================================
+
+if __name__ == "__main__":
+   main(parse_opts())
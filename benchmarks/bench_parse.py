@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark parsing ISPD ASCII files: splitting them into dates, parsing lines
+one at a time and by blocks, and the whole fill through FillISPD.
+
+The fill writes to an in-memory sink (null, which only counts the rows, or an
+SQLite database in memory), so no database server is needed.  Without input
+files, a synthetic file is generated with gen_ispd.  Runs can be compared
+with the JSON results of an earlier run.
+"""
+
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+from rda_ispd_python.ispd_common import *
+from rda_ispd_python.ispd_io import open_ispd_file
+from rda_ispd_python.ispddb import FillISPD
+
+BENCHMARKS = ['read', 'dates', 'dates_mmap', 'parse_line', 'parse_lines', 'parse_block', 'fill', 'fill_vectorize']
+
+#=========================================================================================
+def read_lines(files):
+   """ Read the input files into a list of lines per date """
+
+   blocks = []
+   for fname in files:
+      with open_ispd_file(fname) as fh:
+         for cdate, lines in get_ispd_blocks(fh):
+            blocks.append((cdate, list(lines)))
+
+   return blocks
+
+#=========================================================================================
+def bench_read(files, blocks):
+   lines = 0
+   for fname in files:
+      with open_ispd_file(fname) as fh:
+         for line in fh: lines += 1
+
+   return lines, 0
+
+#=========================================================================================
+def bench_dates(files, blocks, mapped = False):
+   lines = 0
+   for fname in files:
+      with open_ispd_file(fname, mapped = mapped) as fh:
+         for cdate, dlines in get_ispd_blocks(fh):
+            lines += len(dlines)
+
+   return lines, 0
+
+#=========================================================================================
+def bench_parse_line(files, blocks):
+   lines = 0
+   for cdate, dlines in blocks:
+      for line in dlines: parse_ispd_line(line)
+      lines += len(dlines)
+
+   return lines, 0
+
+#=========================================================================================
+def bench_parse_lines(files, blocks, vectorize = 0):
+   lines = rows = 0
+   for cdate, dlines in blocks:
+      records = parse_ispd_lines(dlines, cdate, vectorize)
+      lines += len(dlines)
+      rows += sum(len(records[aname]) for aname in ISPD_NAMES)
+
+   return lines, rows
+
+#=========================================================================================
+def bench_fill(files, blocks, sink = 'null', vectorize = 0):
+   """ Fill the files through FillISPD into an in-memory sink """
+
+   filler = FillISPD(add_inventory = True, lead_uid = False, check_existing = False, vectorize = vectorize,
+                     sink = sink, sink_path = ':memory:')
+   filler.initialize_db()
+   filler.get_input_files(files)
+   filler.initialize_indices()
+   rows = 0
+   for fname in files:
+      rows += sum(filler.process_ispd_file(fname))
+   filler.close_db()
+
+   return sum(len(dlines) for cdate, dlines in blocks), rows
+
+#=========================================================================================
+def run_benchmark(name, files, blocks, sink):
+
+   if name == 'read': return bench_read(files, blocks)
+   if name == 'dates': return bench_dates(files, blocks)
+   if name == 'dates_mmap': return bench_dates(files, blocks, True)
+   if name == 'parse_line': return bench_parse_line(files, blocks)
+   if name == 'parse_lines': return bench_parse_lines(files, blocks)
+   if name == 'parse_block': return bench_parse_lines(files, blocks, 1)
+   if name == 'fill': return bench_fill(files, blocks, sink)
+   if name == 'fill_vectorize': return bench_fill(files, blocks, sink, 1)
+
+#=========================================================================================
+def have_numpy():
+   return importlib.util.find_spec('numpy') is not None
+
+#=========================================================================================
+def compare_results(results, fname):
+   """ Print the speed of the best runs relative to those of an earlier results file """
+
+   with open(fname, 'r') as fh:
+      base = {res['name']: res for res in json.load(fh)['best']}
+   for res in results:
+      old = base.get(res['name'])
+      if old and old['lines_per_sec']:
+         print("{:>14}: {:.2f}x of {}".format(res['name'], res['lines_per_sec']/old['lines_per_sec'], fname))
+
+#=========================================================================================
+def main(args):
+
+   tmpdir = None
+   files = args.files
+   if not files:
+      from gen_ispd import generate_ispd_file
+      tmpdir = tempfile.TemporaryDirectory()
+      files = [os.path.join(tmpdir.name, 'synthetic.txt')]
+      generate_ispd_file(files[0], args.days, args.rows, seed = args.seed, missing_rate = args.missing,
+                         nan_rate = args.nan)
+
+   names = args.bench or BENCHMARKS
+   if 'parse_block' in names and not have_numpy() or 'fill_vectorize' in names and not have_numpy():
+      print("numpy is not installed, parse_block and fill_vectorize skipped")
+      names = [name for name in names if name not in ('parse_block', 'fill_vectorize')]
+
+   blocks = read_lines(files)
+   results = []
+   best = []
+   for name in names:
+      runs = []
+      for i in range(args.repeat):
+         start = time.perf_counter()
+         lines, rows = run_benchmark(name, files, blocks, args.sink)
+         secs = time.perf_counter() - start
+         runs.append({'name': name, 'run': i, 'lines': lines, 'rows': rows, 'seconds': secs,
+                      'lines_per_sec': (lines/secs if secs else 0), 'rows_per_sec': (rows/secs if secs else 0)})
+      results.extend(runs)
+      best.append(min(runs, key = lambda run: run['seconds']))
+      print("{:>14}: {} lines in {:.3f}s, {:.0f} lines/s, {:.0f} rows/s".format(
+            name, lines, best[-1]['seconds'], best[-1]['lines_per_sec'], best[-1]['rows_per_sec']))
+
+   if args.compare: compare_results(best, args.compare)
+   if args.output:
+      with open(args.output, 'w') as fh:
+         json.dump({'benchmark': 'parse', 'files': args.files, 'python': platform.python_version(),
+                    'sink': args.sink, 'days': len(blocks), 'repeat': args.repeat, 'best': best,
+                    'results': results}, fh, indent = 2)
+
+   if tmpdir: tmpdir.cleanup()
+
+#=========================================================================================
+def parse_opts():
+   """ Parse command line arguments """
+   import argparse
+
+   parser = argparse.ArgumentParser(description = "Benchmark parsing and filling ISPD records without a database.")
+   parser.add_argument('files', nargs="*", help="Input ISPD file names; a synthetic file is generated if none.")
+   parser.add_argument('-b', '--bench', action='append', choices=BENCHMARKS,
+                       help='Benchmark to run, may be repeated.  Default = all.')
+   parser.add_argument('-s', '--sink', default="null", choices=['null', 'sqlite'],
+                       help='In-memory sink of the fill benchmarks.  Default = null.')
+   parser.add_argument('-d', '--days', type=int, default=10, help='Dates of the synthetic file.  Default = 10.')
+   parser.add_argument('-R', '--rows', type=int, default=2000, help='Records per date of the synthetic file.  Default = 2000.')
+   parser.add_argument('-S', '--seed', type=int, default=0, help='Random seed of the synthetic file.  Default = 0.')
+   parser.add_argument('-m', '--missing', type=float, default=0.05, help='Rate of missing values.  Default = 0.05.')
+   parser.add_argument('-n', '--nan', type=float, default=0.02, help='Rate of NaN values.  Default = 0.02.')
+   parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of each benchmark.  Default = 3.')
+   parser.add_argument('-c', '--compare', help='Compare with the JSON results of an earlier run.')
+   parser.add_argument('-o', '--output', help='Write the results as JSON to this file.')
+
+   return parser.parse_args(sys.argv[1:])
+
+#=========================================================================================
+
+if __name__ == "__main__":
+   main(parse_opts())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+"""
+Generate synthetic ISPD ASCII files of 41 '<:>' delimited fields for the
+benchmarks.  The field sizes, types and missing values are taken from
+ispddb_config; the values are random but plausible, with station ids and
+names repeated across records as in the real files, and configurable rates
+of missing values, NaN fields and empty fields.
+"""
+
+import random
+import sys
+
+from rda_ispd_python.ispddb_config import *
+
+# realistic value ranges (low, high, decimals) of some fields; others are sized to fit the field
+FIELD_RANGES = {'lon': (0, 360, 2), 'lat': (-90, 90, 2), 'elev': (-50, 4000, 0), 'obp': (950, 1050, 2),
+                'slp': (950, 1050, 2), 'sfp': (600, 1050, 2), 'sfsfp': (600, 1050, 2), 'slpe': (0, 5, 2),
+                'sfpe': (0, 5, 2), 'ncep_type': (180, 199, 0), 'id_type': (1, 9, 0), 'icoads_sid': (1, 200, 0),
+                'icoads_dck': (100, 999, 0), 'icoads_pt': (0, 20, 0)}
+STATIONS = 500        # distinct stations (id, name, source) in a file
+ALNUM = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+
+#=========================================================================================
+def get_field_specs():
+   """ Return the (name, type, size, missing) of the 41 fields, in file order """
+
+   specs = [None]*FIELD_COUNT
+   for aname in ISPDS:
+      attm = ISPDS[aname]['attm']
+      for var in attm:
+         field = attm[var]
+         if field['position'] is None and specs[field['field_index']] is None:
+            specs[field['field_index']] = (var, field['type'], field['size'], str(field['missing']))
+
+   return specs
+
+#=========================================================================================
+def random_value(rng, name, ftype, size, missing):
+   """ Return a random value of a field as its text, within the field size """
+
+   if ftype is str:
+      if name in ('ispdbcid', 'slib', 'sflsd', 'rtc', 'qcislp', 'qcisfp'):
+         return ''.join(rng.choice('0123456789') for i in range(size))
+      return ''.join(rng.choice(ALNUM) for i in range(rng.randint(1, size)))
+
+   if name in FIELD_RANGES:
+      low, high, decimals = FIELD_RANGES[name]
+   else:
+      decimals = len(missing.split('.')[1]) if '.' in missing else 0
+      high = 10**max(0, size - decimals - 2) - 1 if decimals else 10**size - 2
+      low = -high if decimals else 0
+   if ftype is int: return str(rng.randint(int(low), int(high)))
+
+   return "{:.{}f}".format(rng.uniform(low, high), decimals)
+
+#=========================================================================================
+def generate_day_lines(rng, cdate, rows, start, stations, missing_rate = 0.05, nan_rate = 0.02, empty_rate = 0.05):
+   """ Return the lines of one date; start is the unique observation number of its first record """
+
+   specs = get_field_specs()
+   last = specs[-1][0]    # never empty: the line would end with a delimiter, which the parser strips
+   ymd = cdate.replace('-', '')
+   lines = []
+   for i in range(rows):
+      station = rng.choice(stations)
+      fields = []
+      for name, ftype, size, missing in specs:
+         if name == 'uid':
+            fields.append("{}{:02d}{:02d}{:07d}".format(ymd, rng.randint(0, 23), rng.randint(0, 59), (start + i) % 10**7))
+         elif name in station:
+            fields.append(station[name])
+         elif rng.random() < missing_rate:
+            fields.append(missing)
+         elif ftype is float and rng.random() < nan_rate:
+            fields.append('nan'.rjust(rng.randint(3, 5)))
+         elif rng.random() < empty_rate and name != last:
+            fields.append('')
+         else:
+            fields.append(random_value(rng, name, ftype, size, missing))
+      lines.append(ISPD_DELIM.join(fields) + '\n')
+
+   return lines
+
+#=========================================================================================
+def make_stations(rng, count = STATIONS):
+   """ Return the fields shared by the records of each station """
+
+   specs = {spec[0]: spec for spec in get_field_specs()}
+   return [{name: random_value(rng, *specs[name]) for name in ('id', 'sname', 'ispdbcid', 'slib')}
+           for i in range(count)]
+
+#=========================================================================================
+def generate_ispd_file(fname, days = 31, rows_per_day = 1000, start_date = '1950-01-01', seed = 0,
+                       missing_rate = 0.05, nan_rate = 0.02, empty_rate = 0.05, jitter = 0.2):
+   """
+   Write a synthetic ISPD file of consecutive dates from start_date; each date has
+   rows_per_day records, varied by up to jitter of it; return the number of lines written
+   """
+
+   import datetime
+
+   rng = random.Random(seed)
+   stations = make_stations(rng)
+   day = datetime.date.fromisoformat(start_date)
+   count = 0
+   with open(fname, 'w', encoding = 'latin_1') as fh:
+      for i in range(days):
+         rows = max(1, int(rows_per_day*(1 + rng.uniform(-jitter, jitter))))
+         fh.writelines(generate_day_lines(rng, day.isoformat(), rows, count + 1, stations,
+                                          missing_rate, nan_rate, empty_rate))
+         count += rows
+         day += datetime.timedelta(days = 1)
+
+   return count
+
+#=========================================================================================
+def main(args):
+
+   count = generate_ispd_file(args.output, args.days, args.rows, args.start, args.seed,
+                              args.missing, args.nan, args.empty)
+   print("{}: {} records of {} dates written".format(args.output, count, args.days))
+
+#=========================================================================================
+def parse_opts():
+   """ Parse command line arguments """
+   import argparse
+
+   parser = argparse.ArgumentParser(description = "Generate a synthetic ISPD ASCII file for benchmarking.")
+   parser.add_argument('output', help="Output file name.")
+   parser.add_argument('-d', '--days', type=int, default=31, help='Number of dates.  Default = 31.')
+   parser.add_argument('-r', '--rows', type=int, default=1000, help='Records per date.  Default = 1000.')
+   parser.add_argument('-s', '--start', default="1950-01-01", help='First date.  Default = 1950-01-01.')
+   parser.add_argument('-S', '--seed', type=int, default=0, help='Random seed.  Default = 0.')
+   parser.add_argument('-m', '--missing', type=float, default=0.05, help='Rate of missing values.  Default = 0.05.')
+   parser.add_argument('-n', '--nan', type=float, default=0.02, help='Rate of NaN values of float fields.  Default = 0.02.')
+   parser.add_argument('-e', '--empty', type=float, default=0.05, help='Rate of empty fields.  Default = 0.05.')
+
+   return parser.parse_args(sys.argv[1:])
+
+#=========================================================================================
+
+if __name__ == "__main__":
+   main(parse_opts())
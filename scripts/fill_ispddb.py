@@ -17,8 +17,41 @@ def main(args):
    add_inventory = args.addinventory
    lead_uid = args.leaduid
    check_existing = args.checkexisting
-
-   fill_ispd = FillISPD(add_inventory=add_inventory, lead_uid=lead_uid, check_existing=check_existing)
+   vectorize = args.vectorize
+   load_method = args.loader
+   update_control = args.controltables
+   jobs = args.jobs
+   pipeline = args.pipeline
+   writers = args.writers
+   two_phase = args.twophase
+   batch_rows = args.batchrows
+   batch_bytes = args.batchmb*(1 << 20) if args.batchmb is not None else None
+   memory_budget = args.memorymb*(1 << 20) if args.memorymb is not None else None
+   journal = args.journal
+   resume = args.resume
+   read_thread = args.readthread
+   mmap = args.mmap
+   parse_cache = args.parsecache
+   cache_size = args.cachemb*(1 << 20) if args.cachemb is not None else None
+   sink = args.sink
+   sink_path = args.sinkpath
+   bloom_rows = args.bloomrows
+   parse_jobs = args.parsejobs
+   dates = args.dates.split(',') if args.dates else None
+   date_range = args.date_range
+   manifest = args.manifest
+   stats = args.stats
+   stats_prom = args.promstats
+
+   fill_ispd = FillISPD(add_inventory=add_inventory, lead_uid=lead_uid, check_existing=check_existing,
+                        vectorize=vectorize, load_method=load_method, update_control=update_control,
+                        jobs=jobs, pipeline=pipeline, writers=writers, two_phase=two_phase,
+                        batch_rows=batch_rows, batch_bytes=batch_bytes, memory_budget=memory_budget,
+                        journal=journal, resume=resume, read_thread=read_thread,
+                        mmap=mmap, parse_cache=parse_cache, cache_size=cache_size,
+                        sink=sink, sink_path=sink_path, stats=stats, stats_prom=stats_prom,
+                        bloom_rows=bloom_rows, parse_jobs=parse_jobs, dates=dates, date_range=date_range,
+                        manifest=manifest)
    fill_ispd.initialize_db()
    fill_ispd.get_input_files(args.files)
    fill_ispd.initialize_indices()
@@ -54,13 +87,42 @@ def parse_opts():
    Example:
       - Read the ISPD records from ispd_v4_1950-01.txt and store the information in ISPDDB:
          fill_ispddb.py -i -e ispd_v4_1950-01.txt
+      - Reload the records of two dates, read from the day index built by index_ispd_days.py:
+         fill_ispddb.py -i -e --dates 1950-01-03,1950-01-17 ispd_v4_1950-01.txt
+      - Fill the files of a directory that are new or changed since the last run:
+         fill_ispddb.py -i --manifest ispd_v4.manifest ispd_v4_*.txt
    ''')
 
    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, description=desc, epilog=textwrap.dedent(epilog))
-   parser.add_argument('files', nargs="+", help="Input ISPD file names (ASCII format).  A minimum of one file name is required.")
+   parser.add_argument('files', nargs="+", help="Input ISPD file names (ASCII format, plain or gzip/bzip2/xz/zstd compressed, or HDF5 with one dataset per field).  A minimum of one file name is required.")
    parser.add_argument('-i', '--addinventory', action="store_true", default="False", help='Add daily counting records into inventory table.')
    parser.add_argument('-u', '--leaduid', action="store_true", default="False", help='Standalone attachment records with leading 6-character UID.')
-   parser.add_argument('-e', '--checkexisting', action="store_true", default="False", help='Check for existing record before adding record to DB.')
+   parser.add_argument('-e', '--checkexisting', action="store_true", help='Skip the records whose uid is already in ISPDDB, checked against the uids of the partitions of each date loaded once per file.')
+   parser.add_argument('--bloomrows', type=int, help='Check partitions of over this many rows with a Bloom filter instead of a set of their uids, 0 for never.  Default = 2000000.')
+   parser.add_argument('-v', '--vectorize', action="store_true", help='Parse each day of records in bulk with NumPy (requires numpy).')
+   parser.add_argument('-L', '--loader', default="insert", choices=['insert', 'copy'], help='Load records with multi-row INSERT (PgDBI.pgmadd) or with COPY FROM STDIN.  Default = insert.')
+   parser.add_argument('-c', '--controltables', action="store_true", help='Maintain the itidx and iattm control tables, written once per file.')
+   parser.add_argument('-j', '--jobs', type=int, default=1, help='Number of worker processes filling files in parallel.  Default = 1.')
+   parser.add_argument('-P', '--parsejobs', type=int, default=1, help='Number of worker processes parsing each plain input file, split into ranges of whole dates.  Default = 1.')
+   parser.add_argument('--dates', help='Fill only these comma separated dates (YYYY-MM-DD), read from the day index of each plain file if it has a current one.')
+   parser.add_argument('--date-range', nargs=2, metavar=('START', 'END'), help='Fill only the dates from START to END (YYYY-MM-DD), inclusive, read like --dates.')
+   parser.add_argument('--manifest', help='Record the files and dates loaded in this SQLite load manifest; skip the files unchanged since they were loaded and reload only the changed dates of the others, replacing their records loaded before.  Dates with records skipped by -e are not recorded, and are reloaded by the next fill.')
+   parser.add_argument('-p', '--pipeline', action="store_true", help='Read, parse and write records in concurrent pipeline stages.')
+   parser.add_argument('-w', '--writers', type=int, default=0, help='Load the tables of each date concurrently over this many database connections, at least 4 (one per table).  Default = 0 (one connection).')
+   parser.add_argument('--twophase', action="store_true", help='Commit the tables of each date loaded by -w writers together with two-phase commit, so a failed date is loaded into none of them (requires max_prepared_transactions > 0 on the server).')
+   parser.add_argument('-b', '--batchrows', type=int, help='Rows per table load; small consecutive dates are merged into one load and commit, and large dates split to it.  Default = 0 (each date is loaded and committed on its own).')
+   parser.add_argument('-m', '--batchmb', type=int, help='Megabytes of parsed dates held before they are loaded and committed together.  Default = 0 (each date is loaded and committed on its own).')
+   parser.add_argument('-M', '--memorymb', type=int, help='Megabytes of parsed records of a date held in memory before they spill to a temporary file.  Default = no limit.')
+   parser.add_argument('-J', '--journal', help='Record each committed batch of dates in this checkpoint journal file.')
+   parser.add_argument('-r', '--resume', action="store_true", help='Resume the input files after their last committed date in the journal (default journal fill_ispddb.journal).')
+   parser.add_argument('-t', '--readthread', action="store_true", help='Read and decompress the input files on a separate thread.')
+   parser.add_argument('-x', '--mmap', action="store_true", help='Memory-map plain input files and split them into dates by their date prefixes.')
+   parser.add_argument('-C', '--parsecache', help='Cache the parsed records of the input files in this directory and load unchanged files from it without parsing.')
+   parser.add_argument('--cachemb', type=int, help='Megabytes of parse cache entries kept before the least recently used are evicted.  Default = 8192.')
+   parser.add_argument('-S', '--sink', default="postgres", choices=['postgres', 'sqlite', 'null', 'file'], help='Write the records to ISPDDB (postgres), a SQLite database, nowhere but counting them (null), or COPY files per table partition with a load.sql script (file).  Default = postgres.')
+   parser.add_argument('-o', '--sinkpath', help='SQLite database file of the sqlite sink, or output directory of the file sink, which must not hold the load.sql of an earlier fill.')
+   parser.add_argument('--stats', help='Write the lines, rows, database round trips and time per stage of the fill, by table and by file, as JSON to this file.')
+   parser.add_argument('--promstats', help='Write the lines/s, rows/s, database round trips and time per stage of the fill to this Prometheus textfile.')
    parser.add_argument('-l', '--loglevel', default="info", choices=['debug', 'info', 'warning', 'error', 'critical'], help='Set the logging level.  Default = info.')
 
    if len(sys.argv)==1:
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+"""
+Script to build the day index of ISPD ASCII files, stored alongside each file,
+for fill_ispddb.py --dates/--date-range, and to show the records per date of
+indexed files without parsing them.
+"""
+
+import logging
+import sys
+
+from rda_ispd_python.ispd_dayindex import DateSelection, build_day_index, load_day_index
+
+#=========================================================================================
+def main(args):
+
+   selection = DateSelection(args.dates.split(',') if args.dates else None, args.date_range)
+   status = 0
+   for fname in args.files:
+      index = None if args.force else load_day_index(fname)
+      if index is None:
+         index = build_day_index(fname)
+         if index is None:
+            status = 1
+            continue
+      elif not args.show and not args.check:
+         logging.info("{}: day index is current".format(fname))
+
+      if args.check:
+         bad = index.check()
+         if bad:
+            print("{}: checksums of {} do not match, rebuild its index with -f".format(fname, ', '.join(bad)))
+            status = 1
+         else:
+            print("{}: {} date runs match their checksums".format(fname, len(index.days)))
+      if args.show:
+         counts = index.counts(selection)
+         for cdate, lines in counts:
+            print("{}  {}  {:>10}".format(fname, cdate, lines))
+         print("{}  {} dates  {:>10}".format(fname, len(counts), sum(lines for cdate, lines in counts)))
+
+   return status
+
+#=========================================================================================
+def parse_opts():
+   """ Parse command line arguments """
+   import argparse
+
+   desc = "Build the day index of ISPD ASCII files: the byte offset, length, record count and checksum of each date, stored as <file>.days.json."
+   parser = argparse.ArgumentParser(description=desc)
+   parser.add_argument('files', nargs="+", help="Input ISPD file names (ASCII format, plain or gzip/bzip2/xz/zstd compressed).")
+   parser.add_argument('-f', '--force', action="store_true", help='Rebuild the index even if it is current.')
+   parser.add_argument('-s', '--show', action="store_true", help='Print the records per date of each file from its index.')
+   parser.add_argument('-c', '--check', action="store_true", help='Check the dates of each file against their index checksums.')
+   parser.add_argument('--dates', help='Show only these comma separated dates (YYYY-MM-DD).')
+   parser.add_argument('--date-range', nargs=2, metavar=('START', 'END'), help='Show only the dates from START to END (YYYY-MM-DD), inclusive.')
+   parser.add_argument('-l', '--loglevel', default="info", choices=['debug', 'info', 'warning', 'error', 'critical'], help='Set the logging level.  Default = info.')
+
+   return parser.parse_args(sys.argv[1:])
+
+#=========================================================================================
+
+if __name__ == "__main__":
+   args = parse_opts()
+   logging.basicConfig(level=getattr(logging, args.loglevel.upper()), format='%(levelname)s - %(message)s')
+   sys.exit(main(args))
@@ -0,0 +1,103 @@
+"""
+Vectorized parsing of ISPD records with NumPy, one block of lines (all the
+records of one date) at a time.  The decoded values are identical to those
+of the scalar line parser in ispd_common.
+"""
+
+import numpy
+from collections import namedtuple
+
+from . import ispd_common
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+# decoded column of a block: values, mask of missing sentinels and mask of empty (None) values
+BlockColumn = namedtuple('BlockColumn', ['values', 'missing', 'null'])
+
+NUMPY_TYPES = {int: numpy.int64, float: numpy.float64}
+
+def split_ispd_block(lines):
+   """ Split a block of ISPD lines into a list of per-field string arrays """
+
+   rows = []
+   for line in lines:
+      fields = line.rstrip('\n').rstrip(ISPD_DELIM).split(ISPD_DELIM)
+      if len(fields) != FIELD_COUNT:
+         logger.error("Incorrect number of fields in record: {}".format(line.rstrip('\n')))
+         fields = (fields + ['']*FIELD_COUNT)[0:FIELD_COUNT]
+      rows.append(fields)
+
+   return [numpy.array(column, dtype=str) for column in zip(*rows)]
+
+def substr_column(column, position, size):
+   """ Vectorized column[position:position+size] on a fixed-width unicode array """
+
+   cnt = len(column)
+   width = column.dtype.itemsize//4
+   if cnt == 0 or position >= width:
+      return numpy.full(cnt, '', dtype='U1')
+   codes = column.view(numpy.uint32).reshape(cnt, width)[:, position:position+size]
+   return numpy.ascontiguousarray(codes).view('U{}'.format(codes.shape[1])).reshape(cnt)
+
+def decode_column(column, position, size, field_type, missing):
+   """ Decode one field of a block, applying the same rules as parse_ispd_line """
+
+   if position is not None:
+      column = substr_column(column, position, size)
+   else:
+      column = numpy.where(numpy.char.str_len(column) > size, missing, column)
+   if field_type is not str:
+      column = numpy.where(numpy.char.find(column, 'nan') >= 0, missing, column)
+   column = numpy.char.rstrip(column)
+   null = numpy.char.str_len(column) == 0
+
+   missing = missing.rstrip()
+   if field_type is str:
+      values = column
+      ismissing = (column == missing) if missing else numpy.zeros(len(column), dtype=bool)
+   else:
+      values = numpy.where(null, '0', column).astype(NUMPY_TYPES[field_type])
+      ismissing = (values == field_type(missing)) & ~null
+
+   return BlockColumn(values, ismissing, null)
+
+def parse_ispd_block(lines):
+   """
+   Decode all the distinct fields of a block of ISPD lines; return a list of
+   BlockColumn in the order of ispd_common.ISPD_FIELDS
+   """
+
+   fields = split_ispd_block(lines)
+   if not fields: return []
+
+   return decode_ispd_fields(fields)
+
+def decode_ispd_fields(fields):
+   """
+   Decode all the distinct fields from the per-field string arrays of a block;
+   return a list of BlockColumn in the order of ispd_common.ISPD_FIELDS
+   """
+
+   return [decode_column(fields[field_index], position, size, field_type, missing)
+           for field_index, position, size, field_type, missing in ispd_common.ISPD_FIELDS]
+
+def get_block_columns(lines):
+   """ Return the decoded columns of a block of lines as {table: {var: BlockColumn}} """
+
+   columns = parse_ispd_block(lines)
+   if not columns: return {}
+
+   return {aname: {var: columns[i] for var, i in ispd_common.ISPD_COLUMNS[aname]}
+           for aname in ispd_common.ISPD_COLUMNS}
+
+def column_to_list(column):
+   """ Convert a BlockColumn to the list of Python values the scalar parser produces """
+
+   vals = column.values.tolist()
+   if column.null.any():
+      for i in numpy.flatnonzero(column.null).tolist():
+         vals[i] = None
+
+   return vals
@@ -0,0 +1,295 @@
+"""
+Compact columnar buffers for the parsed ISPD records of one date.  Numeric
+columns are kept in typed arrays with a null bitmap; repeated strings are
+dictionary-encoded and other strings are packed into a single byte buffer.
+"""
+
+from array import array
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+TYPECODES = {int: 'q', float: 'd'}
+
+class ColumnBuffer:
+   """ Typed column of field values with a null bitmap """
+
+   def __init__(self, field_type, encode=False):
+      self.field_type = field_type
+      self.encode = (field_type is str and bool(encode))
+      self.count = 0
+      self.nulls = bytearray()    # bit set for a null (None) value
+      if self.encode:
+         self.data = array('i')   # codes into self.dictionary
+         self.dictionary = []
+         self.dcodes = {}
+      elif field_type is str:
+         self.data = bytearray()  # utf-8 encoded values, sliced by self.offsets
+         self.offsets = array('q', [0])
+      else:
+         self.data = array(TYPECODES[field_type])
+
+   @classmethod
+   def from_buffers(cls, field_type, encode, count, nulls, data, offsets=None, dictionary=None):
+      """ Column over existing buffers, e.g. memoryviews of a parse cache file; it is read-only """
+
+      column = cls.__new__(cls)
+      column.field_type = field_type
+      column.encode = encode
+      column.count = count
+      column.nulls = nulls
+      column.data = data
+      if encode:
+         column.dictionary = dictionary
+      elif field_type is str:
+         column.offsets = offsets
+
+      return column
+
+   def __len__(self):
+      return self.count
+
+   def append(self, val):
+      """ Append one value, None for null """
+
+      cnt = self.count
+      if not cnt & 7: self.nulls.append(0)
+      if val is None:
+         self.nulls[cnt >> 3] |= 1 << (cnt & 7)
+      if self.encode:
+         if val is None:
+            code = 0
+         else:
+            code = self.dcodes.get(val)
+            if code is None:
+               code = self.dcodes[val] = len(self.dictionary)
+               self.dictionary.append(val)
+         self.data.append(code)
+      elif self.field_type is str:
+         if val is not None: self.data += val.encode()
+         self.offsets.append(len(self.data))
+      else:
+         self.data.append(0 if val is None else val)
+      self.count = cnt + 1
+
+   def extend(self, vals):
+      """ Append a list of values """
+
+      for val in vals:
+         self.append(val)
+
+   def extend_array(self, values, null):
+      """ Append a NumPy array of values with its boolean null mask """
+
+      import numpy
+
+      cnt = len(values)
+      if not cnt: return
+      if self.count & 7:
+         nulls = null.tolist()
+         for i in range(cnt):
+            if not (self.count + i) & 7: self.nulls.append(0)
+            if nulls[i]: self.nulls[(self.count + i) >> 3] |= 1 << ((self.count + i) & 7)
+      else:
+         self.nulls += numpy.packbits(null, bitorder='little').tobytes()
+
+      if self.encode:
+         uniques, inverse = numpy.unique(values, return_inverse=True)
+         codes = numpy.empty(len(uniques), dtype=numpy.int32)
+         for i, val in enumerate(uniques.tolist()):
+            code = self.dcodes.get(val)
+            if code is None:
+               code = self.dcodes[val] = len(self.dictionary)
+               self.dictionary.append(val)
+            codes[i] = code
+         self.data.frombytes(codes[inverse.reshape(-1)].astype(self.data.typecode).tobytes())
+      elif self.field_type is str:
+         for val in values.tolist():
+            self.data += val.encode()
+            self.offsets.append(len(self.data))
+      else:
+         self.data.frombytes(values.astype(self.data.typecode).tobytes())
+      self.count += cnt
+
+   def take(self, rows):
+      """ Return a new column of the values at the row indices rows """
+
+      column = ColumnBuffer(self.field_type, self.encode)
+      vals = self.tolist()
+      column.extend([vals[i] for i in rows])
+
+      return column
+
+   def isnull(self, idx):
+      return bool(self.nulls[idx >> 3] >> (idx & 7) & 1)
+
+   def null_indices(self, start=0, stop=None):
+      """ Yield the row indices of null values in range(start, stop) """
+
+      if stop is None: stop = self.count
+      for byte in range(start >> 3, (stop + 7) >> 3):
+         bits = self.nulls[byte]
+         if not bits: continue
+         for bit in range(8):
+            if bits >> bit & 1:
+               idx = (byte << 3) + bit
+               if start <= idx < stop: yield idx
+
+   def tolist(self, start=0, stop=None):
+      """ Return the column, or rows start to stop of it, as a list of Python values, None for nulls """
+
+      if stop is None or stop > self.count: stop = self.count
+      if self.encode:
+         dictionary = self.dictionary    # empty if all the values are null
+         vals = [dictionary[code] for code in self.data[start:stop]] if dictionary else [None]*(stop - start)
+      elif self.field_type is str:
+         data = self.data
+         offsets = self.offsets
+         vals = [str(data[offsets[i]:offsets[i+1]], 'utf-8') for i in range(start, stop)]
+      else:
+         vals = self.data[start:stop].tolist()
+      for idx in self.null_indices(start, stop):
+         vals[idx - start] = None
+
+      return vals
+
+   @property
+   def nbytes(self):
+      """ Approximate memory size of the buffered values """
+
+      size = len(self.nulls) + len(self.data)*(1 if isinstance(self.data, bytearray) else self.data.itemsize)
+      if self.encode:
+         size += sum(len(val) for val in self.dictionary)
+      elif self.field_type is str:
+         size += len(self.offsets)*self.offsets.itemsize
+
+      return size
+
+class TableBuffer:
+   """ Columns of one ISPD table; columns shared with other tables are not duplicated """
+
+   def __init__(self, aname, columns):
+      self.aname = aname
+      self.columns = columns    # var: ColumnBuffer
+
+   def __getitem__(self, var):
+      return self.columns[var]
+
+   def __contains__(self, var):
+      return var in self.columns
+
+   def __iter__(self):
+      return iter(self.columns)
+
+   def __len__(self):
+      """ number of rows in the table """
+      return len(next(iter(self.columns.values()))) if self.columns else 0
+
+   def to_records(self, start=0, stop=None):
+      """ Return the rows as a dict of value lists keyed by field name, as PgDBI.pgmadd takes """
+
+      return {var: self.columns[var].tolist(start, stop) for var in self.columns}
+
+   @property
+   def nbytes(self):
+      return sum(column.nbytes for column in self.columns.values())
+
+class DayBuffer:
+   """
+   Columnar buffer of the ISPD records of one date for all tables, keyed by
+   table name like the dict records it replaces
+   """
+
+   def __init__(self, fields, columns):
+      encoded = set()
+      for aname in columns:
+         for var, i in columns[aname]:
+            if var in ENCODED_VARS: encoded.add(i)
+      self.fields = [ColumnBuffer(fields[i][3], i in encoded) for i in range(len(fields))]
+      self.dates = ColumnBuffer(str, True)
+      self.link_tables(columns)
+
+   @classmethod
+   def from_columns(cls, columns, fields, dates):
+      """ Day buffer over existing ColumnBuffers of the distinct fields and of the dates """
+
+      day = cls.__new__(cls)
+      day.fields = fields
+      day.dates = dates
+      day.link_tables(columns)
+
+      return day
+
+   def link_tables(self, columns):
+      self.columns = columns
+      self.tables = {}
+      for aname in columns:
+         tcolumns = {var: self.fields[i] for var, i in columns[aname]}
+         if 'year' in ISPDS[aname]['attm']: tcolumns['date'] = self.dates
+         self.tables[aname] = TableBuffer(aname, tcolumns)
+
+   def __getitem__(self, aname):
+      return self.tables[aname]
+
+   def __contains__(self, aname):
+      return aname in self.tables
+
+   def __iter__(self):
+      return iter(self.tables)
+
+   def append_values(self, vals, cdate=None):
+      """ Append the decoded field values of one line, in the order of the field specs """
+
+      for column, val in zip(self.fields, vals):
+         column.append(val)
+      if cdate: self.dates.append(cdate)
+
+   def extend_block(self, columns, cdate=None):
+      """ Append the NumPy BlockColumns of a block of lines """
+
+      for column, bcolumn in zip(self.fields, columns):
+         column.extend_array(bcolumn.values, bcolumn.null)
+      if cdate and columns:
+         for i in range(len(columns[0].values)): self.dates.append(cdate)
+
+   def take(self, rows):
+      """ Return a new day buffer of the records at the row indices rows """
+
+      dates = self.dates.take(rows) if len(self.dates) else ColumnBuffer(str, True)
+      return DayBuffer.from_columns(self.columns, [column.take(rows) for column in self.fields], dates)
+
+   def counts(self):
+      """ Return the row counts of the tables, in the order of ISPD_NAMES """
+
+      return [len(self.tables[aname]) if aname in self.tables else 0 for aname in ISPD_NAMES]
+
+   @property
+   def nbytes(self):
+      return sum(column.nbytes for column in self.fields) + self.dates.nbytes
+
+def iter_record_batches(tables, maxrows=0):
+   """
+   Yield the rows of a sequence of TableBuffers of the same table as dicts of value
+   lists of at most maxrows rows each, merging small tables and splitting large ones
+   """
+
+   batch = None
+   bcnt = 0
+   for table in tables:
+      start = 0
+      count = len(table)
+      while start < count:
+         stop = min(count, start + maxrows - bcnt) if maxrows else count
+         records = table.to_records(start, stop)
+         if batch is None:
+            batch = records
+         else:
+            for var in batch: batch[var].extend(records[var])
+         bcnt += stop - start
+         start = stop
+         if maxrows and bcnt >= maxrows:
+            yield batch
+            batch = None
+            bcnt = 0
+   if batch: yield batch
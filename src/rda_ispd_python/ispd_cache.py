@@ -0,0 +1,281 @@
+"""
+Cache of parsed ISPD files.  The day buffers of a file are written to a data
+file as the raw bytes of their column buffers, with a JSON index of the dates;
+a later fill of the same file memory-maps the data file and hands the loader
+column buffers over the map without parsing the file again.  Entries are keyed
+by the hashes of the file path, the file size and modification time and the
+parsed field layout, so an entry is stale once the file or the field
+configuration changes; stale entries and the least recently used ones over the
+size cap are evicted.  The index also holds the SHA-1 of the file contents,
+computed while the file is parsed on a miss and checked on a hit, so a file
+rewritten with the same size and modification time is parsed again.
+"""
+
+import glob
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import threading
+import time
+
+from .ispd_buffer import ColumnBuffer, DayBuffer, TYPECODES
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+ALIGN = 8          # byte alignment of the buffers in a data file
+TMPAGE = 86400     # seconds before a temporary file of an interrupted write is removed
+
+def file_hash(fname, stop=None):
+   """ Return the SHA-1 hex digest of the contents of a file; None if the threading.Event stop is set first """
+
+   digest = hashlib.sha1()
+   with open(fname, 'rb') as fh:
+      for block in iter(lambda: fh.read(READSIZE), b''):
+         if stop and stop.is_set(): return None
+         digest.update(block)
+
+   return digest.hexdigest()
+
+def file_signature(fname):
+   """ Return a short hash of the size and modification time of a file """
+
+   stat = os.stat(fname)
+
+   return hashlib.sha1("{}:{}".format(stat.st_size, stat.st_mtime_ns).encode()).hexdigest()[0:16]
+
+def schema_hash(fields, columns):
+   """ Return a short hash of the cache version and of the parsed field layout """
+
+   layout = (CACHEVERSION, [(spec[0], spec[1], spec[2], spec[3].__name__, spec[4]) for spec in fields],
+             sorted(columns.items()), sorted(ENCODED_VARS))
+
+   return hashlib.sha1(repr(layout).encode()).hexdigest()[0:16]
+
+class ParseCache:
+   """ Directory of parse cache entries, each a <key>.data file and its <key>.json index """
+
+   def __init__(self, cachedir, maxbytes, fields, columns):
+      self.cachedir = cachedir
+      self.maxbytes = maxbytes
+      self.fields = fields
+      self.columns = columns
+      self.schema = schema_hash(fields, columns)
+      os.makedirs(cachedir, exist_ok=True)
+
+   def path(self, key, ext):
+      return os.path.join(self.cachedir, "{}.{}".format(key, ext))
+
+   def key(self, fname):
+      phash = hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()[0:16]
+      return "{}-{}-{}".format(phash, file_signature(fname), self.schema)
+
+   def open(self, fname):
+      """
+      Return the CachedFile of a file on a hit, or a CacheWriter to cache it on a miss;
+      the contents of the file are hashed only on a hit, to check them against the entry
+      """
+
+      key = self.key(fname)
+      ipath = self.path(key, 'json')
+      if os.path.exists(ipath):
+         try:
+            with open(ipath, 'r') as fh:
+               index = json.load(fh)
+            if index.get('checksum') == file_hash(fname):
+               os.utime(ipath)    # most recently used
+               logger.info("{}: read {} parsed dates from the parse cache".format(fname, len(index['blocks'])))
+               return CachedFile(self, index, self.path(key, 'data'))
+            logger.info("{}: contents changed since cached, parse again".format(fname))
+            self.remove(key)
+         except (OSError, ValueError) as e:
+            logger.warning("{}: unreadable parse cache entry {}, parse again: {}".format(fname, key, e))
+
+      return CacheWriter(self, fname, key)
+
+   def evict(self, key=None):
+      """
+      Remove the entries of other contents of the file of key and of other field layouts,
+      then the least recently used entries until the cache holds at most maxbytes
+      """
+
+      prefix = key[0:key.index('-') + 1] if key else None
+      entries = []
+      for ipath in glob.glob(os.path.join(self.cachedir, '*.json')):
+         ekey = os.path.basename(ipath)[0:-5]
+         if ekey == key: continue
+         if not ekey.endswith('-' + self.schema) or prefix and ekey.startswith(prefix):
+            self.remove(ekey)
+            logger.debug("{}: stale parse cache entry removed".format(ekey))
+            continue
+         entries.append((os.path.getmtime(ipath), ekey))
+      for tpath in glob.glob(os.path.join(self.cachedir, '*.tmp')):
+         if os.path.getmtime(tpath) < time.time() - TMPAGE: os.remove(tpath)
+
+      size = self.size(key) if key else 0
+      entries.sort(reverse=True)
+      for mtime, ekey in entries:
+         esize = self.size(ekey)
+         if size + esize > self.maxbytes:
+            self.remove(ekey)
+            logger.debug("{}: least recently used parse cache entry removed".format(ekey))
+         else:
+            size += esize
+
+   def size(self, key):
+      return sum(os.path.getsize(self.path(key, ext)) for ext in ('json', 'data') if os.path.exists(self.path(key, ext)))
+
+   def remove(self, key):
+      for ext in ('json', 'data'):
+         if os.path.exists(self.path(key, ext)): os.remove(self.path(key, ext))
+
+class CacheWriter:
+   """ Cache entry being written from the day buffers of a file, in file order """
+
+   def __init__(self, cache, fname, key):
+      self.cache = cache
+      self.fname = fname
+      self.key = key
+      self.fh = tempfile.NamedTemporaryFile(dir=cache.cachedir, prefix=key + '.', suffix='.tmp', delete=False)
+      self.blocks = []
+      # the contents are hashed on a separate thread while the file is parsed
+      self.checksum = None
+      self.stop = threading.Event()
+      self.hasher = threading.Thread(target=self.hash_file, name='ispd-cache-hash', daemon=True)
+      self.hasher.start()
+
+   def hash_file(self):
+      try:
+         self.checksum = file_hash(self.fname, self.stop)
+      except OSError as e:
+         logger.warning("{}: cannot hash for the parse cache: {}".format(self.fname, e))
+
+   def write(self, buf):
+      """ Write the bytes of a buffer at the next aligned offset; return its [offset, length] """
+
+      offset = self.fh.tell()
+      length = memoryview(buf).nbytes
+      self.fh.write(buf)
+      if length % ALIGN: self.fh.write(b'\0'*(ALIGN - length % ALIGN))
+
+      return [offset, length]
+
+   def write_column(self, column):
+      entry = {'count': column.count, 'nulls': self.write(column.nulls), 'data': self.write(column.data)}
+      if column.encode:
+         entry['dictionary'] = column.dictionary
+      elif column.field_type is str:
+         entry['offsets'] = self.write(column.offsets)
+
+      return entry
+
+   def add(self, cdate, records, end):
+      """ Add the records of the next date, which ends at offset end of the file """
+
+      if not self.fh: return
+      if not isinstance(records, DayBuffer):
+         logger.info("{}: {} spilled to disk, the file is not cached".format(self.fname, cdate))
+         return self.abort()
+      self.blocks.append({'date': cdate, 'end': end, 'dates': self.write_column(records.dates),
+                          'columns': [self.write_column(column) for column in records.fields]})
+
+   def commit(self):
+      """ Move the data file into place, then write its index, which makes the entry visible """
+
+      if not self.fh: return
+      self.hasher.join()
+      if not self.checksum or self.cache.key(self.fname) != self.key:
+         logger.info("{}: changed while parsed, or not hashed, so not cached".format(self.fname))
+         return self.abort()
+      self.fh.close()
+      os.replace(self.fh.name, self.cache.path(self.key, 'data'))
+      ipath = self.cache.path(self.key, 'json')
+      with open(ipath + '.tmp', 'w') as fh:
+         json.dump({'file': os.path.abspath(self.fname), 'checksum': self.checksum, 'blocks': self.blocks}, fh)
+      os.replace(ipath + '.tmp', ipath)
+      self.fh = None
+      logger.info("{}: {} parsed dates written to the parse cache".format(self.fname, len(self.blocks)))
+      self.cache.evict(self.key)
+
+   def abort(self):
+      self.stop.set()
+      if not self.fh: return
+      self.hasher.join()
+      self.fh.close()
+      os.remove(self.fh.name)
+      self.fh = None
+
+class CachedFile:
+   """ Cache entry of a file, read as day buffers over a memory map of its data file; positions are file offsets """
+
+   def __init__(self, cache, index, dpath):
+      self.fields = cache.fields
+      self.columns = cache.columns
+      self.blocks = index['blocks']
+      self.mm = None
+      if os.path.getsize(dpath):
+         with open(dpath, 'rb') as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      self.bidx = 0    # index of the next date block
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def seek(self, offset):
+      """ Position at the first date ending after offset """
+
+      self.bidx = len(self.blocks)
+      for i, block in enumerate(self.blocks):
+         if block['end'] > offset:
+            self.bidx = i
+            break
+
+      return offset
+
+   def tell(self):
+      return self.blocks[self.bidx-1]['end'] if self.bidx else 0
+
+   def column(self, view, entry, field_type):
+      """ ColumnBuffer over the buffers of one column in the map """
+
+      def buffer(span, typecode):
+         return view[span[0]:span[0]+span[1]].cast(typecode)
+
+      encode = 'dictionary' in entry
+      if encode:
+         data = buffer(entry['data'], 'i')
+      elif field_type is str:
+         data = buffer(entry['data'], 'B')
+      else:
+         data = buffer(entry['data'], TYPECODES[field_type])
+
+      return ColumnBuffer.from_buffers(field_type, encode, entry['count'], buffer(entry['nulls'], 'B'), data,
+                                       buffer(entry['offsets'], 'q') if 'offsets' in entry else None,
+                                       entry.get('dictionary'))
+
+   def get_blocks(self, offset=None):
+      """
+      Yield (date, DayBuffer) for each cached date from the current position; given
+      the file offset, yield (date, DayBuffer, offset at the end of the date)
+      """
+
+      view = memoryview(self.mm) if self.mm is not None else None
+      while self.bidx < len(self.blocks):
+         block = self.blocks[self.bidx]
+         self.bidx += 1
+         fields = [self.column(view, entry, spec[3]) for entry, spec in zip(block['columns'], self.fields)]
+         records = DayBuffer.from_columns(self.columns, fields, self.column(view, block['dates'], str))
+         yield (block['date'], records) if offset is None else (block['date'], records, block['end'])
+
+   def close(self):
+      if self.mm is None: return
+      try:
+         self.mm.close()
+      except BufferError:
+         pass    # dates not loaded yet still refer to the map; it is closed when they are freed
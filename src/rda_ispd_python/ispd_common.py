@@ -2,157 +2,524 @@
 Common library with ISPD dataset and database utilities
 """
 
+import contextlib
+import functools
+import itertools
+import os
 import re
-import PgLOG
+import time
 import PgUtil
-import PgDBI
 
 from .ispddb_config import *
+from .ispd_buffer import DayBuffer, iter_record_batches
+from .ispd_inventory import InventoryCache
+from .ispd_pool import PoolWriter
+from .ispd_spill import SpilledDay
+from .ispd_journal import CheckpointJournal
+from .ispd_io import MappedFile, MappedLines
+from .ispd_cache import ParseCache
+from .ispd_sink import PgSink, open_sink, partition_statement, sql_value
+from .ispd_stats import CountingSink, IngestStats
+from .ispd_dedup import DuplicateFilter
 
 import logging
 logger = logging.getLogger(__name__)
 
+NOTIMER = contextlib.nullcontext()
+
+def stage_timer(stage):
+   """ Return the context manager timing a stage of the fill, a no-op without stats """
+
+   return STATS.timer(stage) if STATS else NOTIMER
+
+def timed(stage):
+   """ Decorator timing the calls of a function as a stage of the fill """
+
+   def decorate(func):
+      @functools.wraps(func)
+      def call(*args, **kwargs):
+         if not STATS: return func(*args, **kwargs)
+         with STATS.timer(stage):
+            return func(*args, **kwargs)
+      return call
+
+   return decorate
+
 #
 #  initialize the database table information
 #
 def init_table_info():
 
-   global ISPD_COUNTS, UIDATTI
+   global UIDATTI
 
-   ISPD_COUNTS = [0]*TABLECOUNT
    UIDATTI = ISPDS['ispdmeta']['attm']
+   compile_line_parser()
 
    return 1
 
+#
+#  compile the field definitions of all ISPD tables into a single line parser;
+#  fields shared by several tables (uid, timestamp, unoc) are decoded only once
+#
+def compile_line_parser():
+
+   global ISPD_FIELDS, ISPD_COLUMNS
+
+   ISPD_FIELDS = []     # distinct (field_index, position, size, type, missing) specs
+   ISPD_COLUMNS = {}    # table name: list of (var, index into ISPD_FIELDS)
+   fidxs = {}
+   for aname in ISPDS:
+      attm = ISPDS[aname]['attm']
+      columns = []
+      for var in attm:
+         field = attm[var]
+         spec = (field['field_index'], field['position'], field['size'], field['type'], str(field['missing']))
+         if spec not in fidxs:
+            fidxs[spec] = len(ISPD_FIELDS)
+            ISPD_FIELDS.append(spec)
+         columns.append((var, fidxs[spec]))
+      ISPD_COLUMNS[aname] = columns
+
+def parse_ispd_line(line):
+   """
+   Split one ISPD line a single time and return the decoded values of all
+   distinct fields, in the order of ISPD_FIELDS
+   """
+
+   fields = line.rstrip('\n').rstrip(ISPD_DELIM).split(ISPD_DELIM)
+   if len(fields) != FIELD_COUNT:
+      logger.error("Incorrect number of fields in record: {}".format(line.rstrip('\n')))
+
+   vals = []
+   for field_index, position, size, field_type, missing in ISPD_FIELDS:
+      if position is not None:
+         val = fields[field_index][position:position+size]
+      else:
+         val = fields[field_index]
+         if len(val) > size: val = missing
+      if field_type is not str and "nan" in val:
+         val = missing
+      val = val.rstrip()
+      vals.append(field_type(val) if val else None)
+
+   return vals
+
 def get_ispd_records(line, cdate, records):
    """ 
    Append the individual fields and return ispd records for one line of input
    """
 
-   global CURIIDX, CURIUID, ISPD_COUNTS
-   llen = len(line)
-   if llen == 0:
+   global CURIIDX
+   if len(line) == 0:
       return records
+   if not records:
+      records = initialize_ispd_records()
    
    if not CURIUID:
       CURIIDX += 1
-      pgrecs = {}
-
-   for aname in ISPDS:
-      ispd = ISPDS[aname]
-      pgrec = get_one_attm(ispd['attm'], line)
-      if aname not in records:
-         records[aname] = initialize_attm_records(ispd['attm'])
-      if CURIUID:
-         # append attm to records
-         for var in ispd['attm']:
-            val = pgrec[var]
-            records[aname][var].append(val)
-            ISPD_COUNTS[ispd['tindex']] += 1  # row index for individual table
-      else:
-         pgrecs[aname] = pgrec
 
-   if CURIUID:
-      return records
+   records.append_values(parse_ispd_line(line), (None if CURIUID else cdate))
+   
+   return records
 
-   if 'uid' not in pgrecs['ispdmeta']:
-      logger.error("Missing 'uid' in the ispdmeta table: {}".format(line))
+def parse_ispd_lines(lines, cdate, vectorize = 0):
+   """
+   Parse a block of lines of one date into a new DayBuffer; unlike get_ispd_records,
+   this does not advance the current indices, so it can run apart from the loading
+   """
 
-   records['ispdmeta']['date'].append(cdate)
+   records = initialize_ispd_records()
+   append_ispd_lines(records, lines, cdate, vectorize)
 
-   for aname in pgrecs:
-      ispd = ISPDS[aname]
-      # append each attm to records
-      for var in ispd['attm']:
-         val = pgrecs[aname][var]
-         records[aname][var].append(val)
-         ISPD_COUNTS[ispd['tindex']] += 1  # row index for individual table
-   
    return records
 
-def get_one_attm(attm, line):
-   """ Gets all field values for a single table in an observation record """
+def append_ispd_lines(records, lines, cdate, vectorize = 0):
+   """ Parse a block of lines of one date into an existing DayBuffer """
 
-   # strip newline character from line
-   line = line.rstrip('\n')
+   if vectorize:
+      from .ispd_block import parse_ispd_block
+      records.extend_block(parse_ispd_block(lines), cdate)
+   else:
+      for line in lines:
+         if line: records.append_values(parse_ispd_line(line), cdate)
 
-   # strip trailing delimiter if present and split ASCII record into fields
-   fields = line.rstrip(ISPD_DELIM).split(ISPD_DELIM)
+def parse_ispd_day(lines, cdate, vectorize = 0):
+   """
+   Parse the lines of one date like parse_ispd_lines; with MEMBUDGET, they are parsed
+   SPILLLINES at a time by parse_ispd_chunks, which may return a SpilledDay instead;
+   the records of a date read from an HDF5 file or parsed as they are read are returned as they are
+   """
 
-   # check number of fields
-   if len(fields) != FIELD_COUNT:
-      logger.error("Incorrect number of fields in record: {}".format(line))
+   if isinstance(lines, (DayBuffer, SpilledDay)):
+      if isinstance(lines, DayBuffer): note_buffer_bytes(lines.nbytes)
+      return lines
+   if not MEMBUDGET: return parse_ispd_lines(lines, cdate, vectorize)
 
-   pgrec = {}
+   if isinstance(lines, MappedLines):
+      chunks = lines.chunks(SPILLLINES)    # not decoded all at once
+   else:
+      chunks = (lines[start:start+SPILLLINES] for start in range(0, len(lines), SPILLLINES))
 
-   for var in attm:
-      field = attm[var]
-      field_type = field['type']
-      field_index = field['field_index']
-      size = field['size']
-      missing = str(field['missing'])
+   return parse_ispd_chunks(chunks, cdate, vectorize)
 
-      if field['position'] is not None:
-         position = field['position']
-         val = fields[field_index][position:position+size]
-      else:
-         if len(fields[field_index]) > size:
-            val = missing
-         else:
-            val = fields[field_index]
-      
-      logger.debug("var: {}, val: {}".format(var, val))
-      if re.search("nan", val) and field_type != str:
-         val = missing
-      val = val.rstrip()
+def parse_ispd_chunks(chunks, cdate, vectorize = 0):
+   """
+   Parse the lines of one date, given as an iterator of lists of lines; once the parsed
+   records would grow over MEMBUDGET bytes with the next list they are spilled to disk,
+   and a SpilledDay is returned instead of a DayBuffer
+   """
 
-      # convert val from string to correct type
-      if len(val) > 0:
-         pgrec[var] = field_type(val)
-      else:
-         pgrec[var] = None
+   records = initialize_ispd_records()
+   spilled = None
+   growth = 0
+   for lines in chunks:
+      if growth and records.nbytes + growth > MEMBUDGET:   # the next lines would not fit
+         spilled = spill_day_records(spilled, records)
+         records = initialize_ispd_records()
+      pbytes = records.nbytes
+      append_ispd_lines(records, lines, cdate, vectorize)
+      growth = records.nbytes - pbytes
+      note_buffer_bytes(records.nbytes)
 
-   return pgrec
+   return end_day_records(cdate, records, spilled)
+
+def spill_day_records(spilled, records):
+   """ Write the records of part of a date to its SpilledDay, created for the first part; return the SpilledDay """
+
+   with stage_timer('buffer'):
+      if spilled is None: spilled = SpilledDay(SPILLDIR)
+      spilled.add(records)
+
+   return spilled
+
+def end_day_records(cdate, records, spilled):
+   """ Return the records of a date: records if no part of it was spilled, else the SpilledDay with records added """
+
+   if spilled is None: return records
+   if max(records.counts()): spilled = spill_day_records(spilled, records)
+   MEMSTATS['spilled'] += 1
+   MEMSTATS['spillbytes'] += spilled.nbytes
+   logger.debug("{}: {} records spilled to disk in {} segments".format(cdate, spilled.counts()[UIDIDX], len(spilled.offsets)))
+
+   return spilled
+
+def block_bytes(lines):
+   """ Return the approximate bytes held in memory by the lines, or the parsed records, of a date block """
+
+   if isinstance(lines, DayBuffer): return lines.nbytes
+   if isinstance(lines, list): return sum(len(line) for line in lines)
+
+   return 0    # lines of a memory-mapped file, or records spilled to disk
 
 #
-# Initialize dict records for specified attm table
+# advance the current record index past count records
 #
-def initialize_attm_records(attm):
+def advance_indices(count):
 
-   pgrecs = {}
-   for var in attm:
-      pgrecs[var] = []
-   if 'year' in attm: 
-      pgrecs['date'] = []
+   global CURIIDX
+   CURIIDX += count
+
+#
+# Initialize an empty columnar buffer for the records of all tables
+#
+def initialize_ispd_records():
 
-   return pgrecs
+   return DayBuffer(ISPD_FIELDS, ISPD_COLUMNS)
 
 def add_ispd_records(cdate, records):
    """ Add multiple ispd records into their respective tables in RDADB """
 
    global INVENTORY, CURTIDX
 
-   if INVENTORY and ISPD_NAMES[0] in records:   # add counting record into inventory table
-      ulen = len(records[ISPD_NAMES[0]]['uid'])
+   if INVENTORY:   # add counting record into inventory table
+      ulen = records.counts()[0]
       if ulen > 0:
          INVENTORY = add_inventory_record(INVENTORY['fname'], cdate, ulen, INVENTORY)
+         precreate_partitions(INVENTORY)
       if CURTIDX < INVENTORY['tidx']:
          CURTIDX = INVENTORY['tidx']
       tidx = CURTIDX
    else:
       tidx = date2tidx(cdate)
-   
+
+   return load_ispd_records(cdate, records, tidx)
+
+def load_ispd_records(cdate, records, tidx, miniidx = None, partiidx = None):
+   """
+   Load the records of one date into the table partitions of tidx; miniidx is the
+   record index of the first record, by default the records end at CURIIDX; partiidx
+   is the record index of the last record of a part of a spilled date but its last one
+   """
+
    acnts = [0]*TABLECOUNT
+   if not records:
+      return acnts
+   rcnts = records.counts()
+   if miniidx is None: miniidx = CURIIDX - rcnts[UIDIDX] + 1
+
+   if isinstance(records, SpilledDay):
+      for pidx, part in enumerate(records.parts()):
+         pcnt = part.counts()[UIDIDX]
+         pcnts = load_ispd_records(cdate, part, tidx, miniidx, (miniidx + pcnt - 1 if pidx < len(records.offsets) - 1 else None))
+         miniidx += pcnt
+         for i in range(TABLECOUNT): acnts[i] += pcnts[i]
+      records.close()
+      return acnts
+
+   if batching():
+      queue_ispd_records(cdate, records, tidx, partiidx)
+      acnts = list(rcnts)   # a failed load exits, so all rows count as added
+   else:
+      for i in range(TABLECOUNT):
+         if not rcnts[i]:
+            continue
+         aname = ISPD_NAMES[i]
+         acnts[i] = add_records_to_table(aname, str(tidx), records[aname], cdate)
 
-   for i in range(TABLECOUNT):
-      if not ISPD_COUNTS[i]:
-         continue
-      aname = ISPD_NAMES[i]
-      acnts[i] = add_records_to_table(aname, str(tidx), records[aname], cdate)
-      ISPD_COUNTS[i] = 0
+   if CNTLUPDATE and rcnts[UIDIDX]:
+      ucnt = rcnts[UIDIDX]
+      iuida = {'uid': records[ISPD_NAMES[UIDIDX]]['uid'].tolist(), 'iidx': list(range(miniidx, miniidx + ucnt))}
+      update_control_tables(cdate, acnts, iuida, tidx)
 
    return acnts
 
+#
+# set the pending rows and bytes that trigger a load of the queued dates
+#
+def set_batch_size(rows = None, nbytes = None):
+
+   global BATCHROWS, BATCHBYTES
+   if rows is not None: BATCHROWS = rows
+   if nbytes is not None: BATCHBYTES = nbytes
+
+#
+# set the bytes of parsed records of a date held in memory before they spill to disk;
+# pending batches, if any, are kept within the same budget
+#
+def set_memory_budget(nbytes = None, spilldir = None):
+
+   global MEMBUDGET, SPILLDIR, BATCHBYTES
+   if nbytes is not None: MEMBUDGET = nbytes
+   if spilldir is not None: SPILLDIR = spilldir
+   if MEMBUDGET and BATCHBYTES > MEMBUDGET:
+      BATCHBYTES = MEMBUDGET
+
+def note_buffer_bytes(nbytes):
+
+   if nbytes > MEMSTATS['peak']: MEMSTATS['peak'] = nbytes
+
+def reset_memory_stats():
+
+   for key in MEMSTATS: MEMSTATS[key] = 0
+
+#
+# report the peak of the buffered records of a file against the memory budget
+#
+def log_memory_stats(fname):
+
+   import resource
+   maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >> 10
+   msg = "{}: peak buffered records {:.1f} MB".format(fname, MEMSTATS['peak']/(1 << 20))
+   if MEMBUDGET:
+      msg += " of {:.1f} MB budget ({})".format(MEMBUDGET/(1 << 20), 'held' if MEMSTATS['peak'] <= MEMBUDGET else 'exceeded')
+   if MEMSTATS['spilled']:
+      msg += ", {} dates spilled to disk ({:.1f} MB)".format(MEMSTATS['spilled'], MEMSTATS['spillbytes']/(1 << 20))
+   logger.info(msg + ", process max RSS {} MB".format(maxrss))
+
+def batching():
+   """
+   Return True if the dates are queued and loaded in batches, each committed in one transaction
+   with its inventory records; so are the dates of a journaled fill and of the pool writer
+   """
+
+   return bool(BATCHROWS or BATCHBYTES or JOURNAL or POOLWRITER)
+
+#
+# open the transaction of a new batch, before the inventory record of the date of records is added;
+# the pending dates are loaded first if the date would not fit with them in BATCHBYTES, or if it
+# was spilled, so that its inventory record is committed with its rows
+#
+def start_batch(records = None):
+
+   if not batching(): return
+   sink = get_sink()
+   if BATCHRECORDS and (isinstance(records, SpilledDay) or
+                        BATCHBYTES and records is not None and batch_bytes() + records.nbytes > BATCHBYTES):
+      flush_ispd_records()
+   if not sink.in_transaction: sink.start_transaction()
+
+def queue_ispd_records(cdate, records, tidx, partiidx = None):
+   """
+   Queue the records of one date, or of a part of a spilled date up to record index partiidx;
+   load the queued dates once they reach BATCHROWS rows or BATCHBYTES bytes, or right away if
+   neither is set
+   """
+
+   if BATCHBYTES and BATCHRECORDS and batch_bytes() + records.nbytes > BATCHBYTES:
+      flush_ispd_records()   # keep the pending bytes within BATCHBYTES
+   with stage_timer('buffer'):
+      BATCHRECORDS.append((cdate, records, tidx, checkpoint_state(cdate, partiidx)))
+      rows = sum(max(precords.counts()) for pdate, precords, ptidx, pstate in BATCHRECORDS)
+      nbytes = batch_bytes()
+      note_buffer_bytes(nbytes)
+   if (BATCHROWS and rows >= BATCHROWS) or (BATCHBYTES and nbytes >= BATCHBYTES) or not (BATCHROWS or BATCHBYTES):
+      flush_ispd_records()
+
+def batch_bytes():
+   return sum(precords.nbytes for pdate, precords, ptidx, pstate in BATCHRECORDS)
+
+def batch_rows(tables):
+   """ Return the rows per load of a table, bounded by BATCHROWS and by BATCHBYTES """
+
+   rows = sum(len(table) for table in tables)
+   nbytes = sum(table.nbytes for table in tables)
+   maxrows = BATCHROWS
+   if BATCHBYTES and nbytes > BATCHBYTES:
+      brows = max(1, int(rows*BATCHBYTES/nbytes))
+      if not maxrows or brows < maxrows: maxrows = brows
+
+   return maxrows
+
+def flush_ispd_records():
+   """
+   Load the queued dates with one series of loads per table partition, and commit
+   them together with their inventory records; the rows loaded by the pool writer
+   are committed on its connections first, then the inventory records
+   """
+
+   if BATCHRECORDS and not get_sink().in_transaction:
+      get_sink().start_transaction()    # parts of a spilled date queued after the last commit
+   groups = {}
+   state = None
+   for cdate, records, tidx, pstate in BATCHRECORDS:
+      groups.setdefault(tidx, []).append((cdate, records))
+      if pstate: state = pstate
+
+   for tidx, days in groups.items():
+      dates = days[0][0] if len(days) == 1 else "{}~{}".format(days[0][0], days[-1][0])
+      tables = []
+      for aname in ISPD_NAMES:
+         buffers = [records[aname] for cdate, records in days if aname in records and len(records[aname])]
+         if not buffers: continue
+         batches = iter_record_batches(buffers, batch_rows(buffers))
+         if POOLWRITER:
+            tables.append((aname, check_partition(aname, str(tidx)), batches))
+         else:
+            for batch in batches: add_records_to_table(aname, str(tidx), batch, dates)
+      if tables: POOLWRITER.submit_day(dates, tables)
+
+   BATCHRECORDS.clear()
+   if CNTLUPDATE: flush_control_tables()
+   wait_pool_writer()    # no inventory record is committed before the rows it counts
+   if get_sink().in_transaction:
+      with stage_timer('commit'): get_sink().end_transaction()
+   if JOURNAL and state: JOURNAL.record(state['file'], state)
+
+#
+# open the checkpoint journal; dates are then committed one batch at a time
+# and each commit is recorded in the journal
+#
+def set_journal(path = None):
+
+   global JOURNAL
+   close_journal()
+   if path: JOURNAL = CheckpointJournal(path)
+
+def close_journal():
+
+   global JOURNAL
+   if JOURNAL:
+      JOURNAL.close()
+      JOURNAL = None
+
+#
+# set the file position of the date being loaded: bidx date blocks of the file
+# end at character offset when the date is loaded, and the date starts at start
+#
+def set_checkpoint(fname = None, bidx = 0, offset = 0, start = 0):
+
+   global CHECKPOINT
+   CHECKPOINT = {'file': fname, 'bidx': bidx, 'offset': offset, 'start': start} if fname else None
+
+def checkpoint_state(cdate, partiidx = None):
+   """
+   Return the journal state after the date being loaded, None if it has no file position;
+   after a part of a spilled date up to record index partiidx, the state resumes the date
+   from its start and skips the records up to partiidx
+   """
+
+   if not (JOURNAL and CHECKPOINT): return None
+   state = {'file': CHECKPOINT['file'], 'bidx': CHECKPOINT['bidx'], 'offset': CHECKPOINT['offset']}
+   if partiidx is not None:
+      state.update({'bidx': CHECKPOINT['bidx'] - 1, 'offset': CHECKPOINT['start'], 'partiidx': partiidx})
+   state.update({'date': cdate, 'curiidx': CURIIDX, 'curtidx': CURTIDX,
+                 'inventory': (dict(INVENTORY) if INVENTORY else None)})
+
+   return state
+
+def get_checkpoint_entry(fname):
+   """ Return the latest journal entry of a file, None if there is none or no journal """
+
+   return JOURNAL.last(fname) if JOURNAL else None
+
+def reserve_checkpoint(fname):
+
+   if JOURNAL: JOURNAL.reserve(fname)
+
+def finish_checkpoint(fname):
+
+   if JOURNAL: JOURNAL.finish(fname)
+
+#
+# restore the record indices and inventory state of a journal entry
+#
+def resume_checkpoint(entry):
+
+   global CURIIDX, CURTIDX, INVENTORY, RESUMEPART
+   CURIIDX = entry['curiidx']
+   CURTIDX = entry['curtidx']
+   if entry.get('inventory'): INVENTORY = dict(entry['inventory'])
+   RESUMEPART = (entry['date'], entry['partiidx']) if 'partiidx' in entry else None
+
+def load_resumed_records(cdate, records):
+   """
+   Load the rest of the spilled date whose first parts were committed before the fill being
+   resumed stopped, with the record indices and partitions assigned to it then; return None
+   for any other date
+   """
+
+   global RESUMEPART
+   if not (RESUMEPART and RESUMEPART[0] == cdate): return None
+   partiidx = RESUMEPART[1]
+   RESUMEPART = None
+   if DUPFILTER:   # the records were filtered before their indices were assigned
+      records = filter_existing_records(cdate, records)
+   else:
+      records = skip_day_records(records, partiidx - CURIIDX + records.counts()[UIDIDX])
+   logger.info("{}: resume after record index {}, {} records left".format(cdate, partiidx, records.counts()[UIDIDX]))
+
+   return load_ispd_records(cdate, records, (CURTIDX if INVENTORY else date2tidx(cdate)))
+
+def skip_day_records(records, skip):
+   """ Return the records of a date without its first skip records """
+
+   if skip <= 0: return records
+   if not isinstance(records, SpilledDay):
+      return records.take(range(skip, records.counts()[UIDIDX]))
+
+   spilled = SpilledDay(SPILLDIR)
+   for part in records.parts():
+      pcnt = part.counts()[UIDIDX]
+      if skip >= pcnt:
+         skip -= pcnt
+         continue
+      spilled.add(part.take(range(skip, pcnt)) if skip else part)
+      skip = 0
+   records.close()
+
+   return spilled
+
+@timed('inventory')
 def add_inventory_record(fname, cdate, count, inventory, cntopt = 0):
    """ add inventory information into control db """
 
@@ -161,7 +528,7 @@ def add_inventory_record(fname, cdate, count, inventory, cntopt = 0):
 
    if cntopt == 2:
       cnd = "date = '{}'".format(cdate)
-      pgrec = PgDBI.pgget(table, "didx, count", cnd, PgLOG.LGEREX)
+      pgrec = get_inventory_cache().get_date_record(cdate)
       if not pgrec:
          logger.error("{}: error get record for {}".format(table, cnd))
       count = pgrec['count']
@@ -175,21 +542,22 @@ def add_inventory_record(fname, cdate, count, inventory, cntopt = 0):
       record['tcount'] = inventory['tcount'] + count
       record['miniidx'] = inventory['maxiidx'] + 1
       record['maxiidx'] = inventory['maxiidx'] + count
-      if record['tcount'] > PgDBI.PGDBI['MAXICNT']:
+      if record['tcount'] > get_sink().max_records:
          record['tidx'] += 1
          record['tcount'] = count
 
    if didx:
       cnd = "didx = {}".format(didx)
-      if not PgDBI.pgupdt(table, record, cnd, PgLOG.LGEREX):
+      if not get_sink().update_record(table, record, cnd):
          logger.error("{}: error updating table for {}".format(table, cnd))
    else:
-      didx = PgDBI.pgadd(table, record, PgLOG.LGEREX|PgLOG.AUTOID)
+      didx = get_sink().add_record(table, record)
 
    record['didx'] = didx
    if cntopt == 2:
       record['count'] = count
       record['date'] = cdate
+   get_inventory_cache().add(record)
 
    return record
 
@@ -198,29 +566,173 @@ def get_ispd_date(line):
 
    return get_record_date(line[0:4], line[4:6], line[6:8])
 
+def get_prefix_date(prefix):
+   """ Return the date of a line's YYYYMMDD prefix, normalized once per distinct prefix """
+
+   cdate = DATEPREFIXES.get(prefix)
+   if cdate is None:
+      cdate = DATEPREFIXES[prefix] = get_ispd_date(prefix.decode('latin_1') if isinstance(prefix, bytes) else prefix)
+
+   return cdate
+
+def get_ispd_blocks(fh, offset = None):
+   """
+   Read ISPD lines from an open file and yield (date, lines) for each run of lines with the same date;
+   given the character offset fh is read from, yield (date, lines, offset at the end of the run)
+   """
+
+   if isinstance(fh, MappedFile): return get_mapped_blocks(fh, offset)
+   if hasattr(fh, 'get_blocks'): return fh.get_blocks(offset)    # HDF5 rows, already parsed into DayBuffers
+
+   return read_ispd_blocks(fh, offset)
+
+def get_day_blocks(fh, offset = None, vectorize = 0):
+   """
+   Return the date blocks of an open file for a fill, like get_ispd_blocks; with MEMBUDGET, the
+   dates of a stream are parsed as they are read, and its blocks hold their records in place of their lines
+   """
+
+   if MEMBUDGET and not isinstance(fh, MappedFile) and not hasattr(fh, 'get_blocks'):
+      return parse_ispd_blocks(fh, offset, vectorize)
+
+   return get_ispd_blocks(fh, offset)
+
+def parse_ispd_blocks(fh, offset = None, vectorize = 0):
+   """
+   Yield the date blocks of a stream like read_ispd_blocks, each date parsed by parse_ispd_chunks
+   SPILLLINES lines at a time as they are read, so the lines of a date are never held all together
+   """
+
+   for cdate, chunks in itertools.groupby(read_ispd_chunks(fh, offset or 0), lambda chunk: chunk[0]):
+      ends = []
+      def chunk_lines():
+         for chunk in chunks:
+            ends.append(chunk[2])
+            yield chunk[1]
+      with stage_timer('parse'):
+         records = parse_ispd_chunks(chunk_lines(), cdate, vectorize)
+      yield (cdate, records) if offset is None else (cdate, records, ends[-1])
+
+def read_ispd_chunks(fh, offset = 0):
+   """
+   Read ISPD lines from an open file like read_ispd_blocks, and yield (date, lines, offset at the
+   end of the lines) for runs of up to SPILLLINES lines of the same date; a date continues over
+   the runs that follow it with the same date
+   """
+
+   cdate = None
+   prefix = None
+   lines = []
+   pos = offset
+   for line in fh:
+      start = pos
+      pos += len(line)
+      if line[0:8] != prefix:
+         prefix = line[0:8]
+         idate = get_prefix_date(prefix)
+      if not idate:
+         continue
+      if idate != cdate or len(lines) >= SPILLLINES:
+         if lines: yield (cdate, lines, start)
+         cdate = idate
+         lines = []
+      lines.append(line)
+
+   if lines: yield (cdate, lines, pos)
+
+def read_ispd_blocks(fh, offset = None):
+
+   cdate = None
+   prefix = None
+   lines = []
+   pos = offset or 0
+   for line in fh:
+      start = pos
+      pos += len(line)
+      if line[0:8] != prefix:   # normalize the date only where the prefix changes
+         prefix = line[0:8]
+         idate = get_prefix_date(prefix)
+      if not idate:
+         continue
+      if idate != cdate:
+         if lines: yield (cdate, lines) if offset is None else (cdate, lines, start)
+         cdate = idate
+         lines = []
+      lines.append(line)
+
+   if lines: yield (cdate, lines) if offset is None else (cdate, lines, pos)
+
+def get_mapped_blocks(fh, offset = None):
+   """
+   Yield the date blocks of a MappedFile from its current position, like read_ispd_blocks; runs of
+   lines with the same date prefix are found with one regex search each and handed to the parser
+   as MappedLines, views of the map that are not decoded until parsed
+   """
+
+   mm = fh.mm
+   view = memoryview(mm)
+   size = len(mm)
+   cdate = None
+   start = pos = fh.tell()
+   while pos < size:
+      prefix = mm[pos:pos+8]
+      idate = get_prefix_date(prefix)
+      if idate != cdate:
+         if cdate: yield (cdate, MappedLines(view[start:pos])) if offset is None else (cdate, MappedLines(view[start:pos]), pos)
+         cdate = idate
+         start = pos
+      pos = next_prefix_line(mm, pos, prefix)
+   fh.seek(size)
+   if cdate: yield (cdate, MappedLines(view[start:size])) if offset is None else (cdate, MappedLines(view[start:size]), size)
+   view.release()
+
+def next_prefix_line(mm, pos, prefix):
+   """ Return the offset of the first line after pos in a map that does not start with prefix, the map size if none """
+
+   boundary = PREFIXBOUNDS.get(prefix)
+   if boundary is None:
+      boundary = PREFIXBOUNDS[prefix] = re.compile(b'\n(?!' + re.escape(prefix) + b')')
+   match = boundary.search(mm, pos)
+
+   return match.end() if match else len(mm)
+
+def find_date_boundary(mm, pos):
+   """ Return the offset of the first line from pos on, or from the next line start, that starts a new date """
+
+   size = len(mm)
+   if pos <= 0: return 0
+   pos = mm.find(b'\n', pos - 1) + 1
+   if not pos: return size
+   cdate = get_prefix_date(mm[pos:pos+8]) if pos < size else None
+   while pos < size:
+      pos = next_prefix_line(mm, pos, mm[pos:pos+8])
+      if pos < size and get_prefix_date(mm[pos:pos+8]) != cdate: return pos
+
+   return size
+
 #
-# get the itidx record from given uid
+# get the itidx record from given uid; a reader of leading-UID records calls prefetch_itidx()
+# on each batch of uids read ahead, so that the uids are resolved without queries of their own
 #
+@timed('index')
 def get_itidx_date(uid):
 
    global CURIUID, CURIIDX, CURTIDX
    uidx = uid[0:2].lower()
    suid = uid[2:6]
-   table = "cntldb.itidx_{}".format(uidx)
 
-   pgrec = PgDBI.pgget(table, "*", "suid = '{}'".format(suid), PgLOG.LGEREX)
+   cache = ITIDXCACHE.get(uidx)
+   if not (cache and (cache['preloaded'] or suid in cache['checked'])):
+      prefetch_itidx([uid])    # not read ahead
+   pgrec = ITIDXCACHE[uidx]['records'].get(suid)
    if not pgrec:
-      logger.warning("{}: SKIP suid not in {}".format(suid, table))
-      return
+      logger.warning("{}: SKIP suid not in {}.itidx_{}".format(suid, CNTLSCHEMA, uidx))
+      return None
 
-   if CHKEXIST:    # check
-      table = "{}_{}".format(ATTMNAME, pgrec['tidx'])
-      cnd = "iidx = {}".format(pgrec['iidx'])
-      if ATTMNAME in MUNIQUE:
-         for fname in MUNIQUE[ATTMNAME]: 
-            cnd += " AND {} = '{}'".format(fname, pgrec[fname])
-
-      if PgDBI.pgget(table, "", cnd): return None
+   if CHKEXIST and ATTMNAME:    # check
+      key = itidx_exist_key(pgrec)
+      if key in ITIDXEXIST: return None
+      ITIDXEXIST.add(key)    # loaded from now on
 
    CURIUID = uid
    CURIIDX = pgrec['iidx']
@@ -228,6 +740,193 @@ def get_itidx_date(uid):
 
    return pgrec['date']
 
+#
+# fetch the itidx records of a batch of uids with one query per uid prefix table, and
+# the keys of their already loaded attachment records if CHKEXIST is set
+#
+@timed('index')
+def prefetch_itidx(uids):
+
+   suids = {}
+   for uid in uids:
+      uidx = uid[0:2].lower()
+      if uidx not in ITIDXCACHE:
+         ITIDXCACHE[uidx] = {'records': {}, 'checked': set(), 'preloaded': False}
+      if not ITIDXCACHE[uidx]['preloaded'] and uid[2:6] not in ITIDXCACHE[uidx]['checked']:
+         suids.setdefault(uidx, set()).add(uid[2:6])
+
+   pgrecs = []
+   for uidx in suids:
+      cache = ITIDXCACHE[uidx]
+      table = "{}.itidx_{}".format(CNTLSCHEMA, uidx)
+      if ITIDXPRELOAD:
+         cnds = [""]
+         cache['preloaded'] = True
+      else:
+         slist = sorted(suids[uidx])
+         cnds = ["suid IN ({})".format(', '.join(map(sql_value, slist[i:i+ITIDXBATCH]))) for i in range(0, len(slist), ITIDXBATCH)]
+      for cnd in cnds:
+         for pgrec in get_table_records(table, "*", cnd):
+            pgrec['date'] = str(pgrec['date'])
+            cache['records'][pgrec['suid']] = pgrec
+            pgrecs.append(pgrec)
+      cache['checked'].update(suids[uidx])
+
+   if CHKEXIST and ATTMNAME and pgrecs:
+      prefetch_itidx_exist(pgrecs)
+
+   return len(pgrecs)
+
+#
+# record the keys of the attachment records already in ATTMNAME_<tidx> for itidx records
+#
+def prefetch_itidx_exist(pgrecs):
+
+   if PARTITIONS is None: load_partitions()
+   fnames = MUNIQUE.get(ATTMNAME, [])
+   tidxs = {}
+   for pgrec in pgrecs:
+      tidxs.setdefault(pgrec['tidx'], set()).add(pgrec['iidx'])
+
+   for tidx in sorted(tidxs):
+      table = "{}_{}".format(ATTMNAME, tidx)
+      if partition_key(table) not in PARTITIONS: continue    # nothing loaded
+      iidxs = sorted(tidxs[tidx])
+      for i in range(0, len(iidxs), ITIDXBATCH):
+         cnd = "iidx IN ({})".format(', '.join(map(str, iidxs[i:i+ITIDXBATCH])))
+         for pgrec in get_table_records(table, ', '.join(['iidx'] + fnames), cnd):
+            ITIDXEXIST.add(itidx_exist_key(pgrec))
+
+#
+# key of an attachment record for the existence check: iidx plus the unique fields of ATTMNAME
+#
+def itidx_exist_key(pgrec):
+
+   return tuple([pgrec['iidx']] + [str(pgrec[fname]) for fname in MUNIQUE.get(ATTMNAME, [])])
+
+#
+# set the partition size over which the uids already loaded are checked with a Bloom filter
+#
+def set_duplicate_filter(bloomrows = None):
+
+   global DEDUPBLOOMROWS
+   if bloomrows is not None: DEDUPBLOOMROWS = bloomrows
+
+#
+# start checking the records of a new file against those already loaded if CHKEXIST is set;
+# the uids of each partition are loaded once per file
+#
+def start_duplicate_filter():
+
+   global DUPFILTER
+   DUPFILTER = DuplicateFilter(get_sink(), ISPD_NAMES[UIDIDX], DEDUPBLOOMROWS, DEDUPFPRATE) if CHKEXIST else None
+
+def end_duplicate_filter(fname):
+
+   global DUPFILTER
+   if DUPFILTER:
+      logger.info("{}: {} records already in ISPDDB skipped".format(fname, DUPFILTER.skipped))
+      count_stats(duplicates=DUPFILTER.skipped)
+      DUPFILTER = None
+
+@timed('index')
+def filter_existing_records(cdate, records):
+   """
+   Return the records of a date without those whose uid is already in the partitions
+   of the inventory records of the date; without CHKEXIST, return records as they are
+   """
+
+   if not DUPFILTER: return records
+   if PARTITIONS is None: load_partitions()
+   inventory = get_inventory_cache()
+   aname = ISPD_NAMES[UIDIDX]
+   partitions = []
+   for tidx in sorted({pgrec['tidx'] for pgrec in inventory.get_date_records(cdate) if pgrec.get('tidx')}):
+      table = "{}_{}".format(aname, tidx)
+      if partition_key(table) in PARTITIONS: partitions.append((table, inventory.tidx_count(tidx)))
+   if not partitions: return records
+
+   skipped = DUPFILTER.skipped
+   if isinstance(records, SpilledDay):
+      spilled = SpilledDay(SPILLDIR)
+      for part in records.parts(): spilled.add(DUPFILTER.filter(part, partitions))
+      records.close()
+      records = spilled
+   else:
+      records = DUPFILTER.filter(records, partitions)
+   if DUPFILTER.skipped > skipped:
+      logger.debug("{}: {} records already in ISPDDB skipped".format(cdate, DUPFILTER.skipped - skipped))
+
+   return records
+
+@timed('index')
+def delete_date_records(cdate, fname, records):
+   """
+   Delete the rows of a date loaded before from file fname, and their inventory records, before
+   the date is reloaded with records from the changed file.  The rows of the date are deleted
+   from the partitions of its inventory records of the file; where the date of another file
+   shares a partition, or without inventory records of the file, only the rows with the uids
+   of records are.  Return the rows deleted from the uid table
+   """
+
+   if PARTITIONS is None: load_partitions()
+   sink = get_sink()
+   inventory = get_inventory_cache()
+   fbase = os.path.basename(fname)
+   pgrecs = inventory.get_date_records(cdate)
+   loaded = [pgrec for pgrec in pgrecs if os.path.basename(pgrec.get('fname') or '') == fbase]
+   shared = {pgrec.get('tidx') for pgrec in pgrecs if pgrec not in loaded}
+   tidxs = sorted({pgrec['tidx'] for pgrec in loaded if pgrec.get('tidx')}) or [date2tidx(cdate)]
+   aname = ISPD_NAMES[UIDIDX]
+   anames = [name for name in ISPD_NAMES if name != aname] + [aname]    # the uid table last, the others select from it
+   uids = None
+   dcnt = 0
+   for tidx in tidxs:
+      utable = "{}_{}".format(aname, tidx)
+      if partition_key(utable) not in PARTITIONS: continue
+      if tidx in shared or not loaded:
+         if uids is None: uids = record_uids(records)
+         cnds = ["uid IN ({})".format(', '.join(map(sql_value, uids[i:i+ITIDXBATCH]))) for i in range(0, len(uids), ITIDXBATCH)]
+      else:
+         cnds = None
+      acnts = [0]*TABLECOUNT
+      for name in anames:
+         table = "{}_{}".format(name, tidx)
+         if partition_key(table) not in PARTITIONS: continue
+         if cnds is not None:
+            tcnds = cnds
+         elif name == aname:
+            tcnds = ["date = '{}'".format(cdate)]
+         else:
+            tcnds = ["uid IN (SELECT uid FROM {} WHERE date = '{}')".format(utable, cdate)]
+         for cnd in tcnds: acnts[ISPD_NAMES.index(name)] += sink.delete_records(table, cnd)
+      if CNTLUPDATE and any(acnts): update_control_tables(cdate, [-cnt for cnt in acnts], None, tidx)
+      dcnt += acnts[UIDIDX]
+
+   table = "{}.ispd_inventory".format(DBCNTL)
+   for pgrec in loaded:
+      sink.delete_records(table, "didx = {}".format(pgrec['didx']))
+      inventory.remove(pgrec['didx'])
+   if dcnt or loaded:
+      logger.info("{}: {} records and {} inventory records loaded before from {} deleted".format(cdate, dcnt, len(loaded), fbase))
+
+   return dcnt
+
+def record_uids(records):
+   """ Return the uids of the records of a date, spilled or not """
+
+   aname = ISPD_NAMES[UIDIDX]
+   parts = records.parts() if isinstance(records, SpilledDay) else [records]
+
+   return [uid for part in parts for uid in part[aname]['uid'].tolist()]
+
+#
+# get the records of a query as a list of dicts
+#
+def get_table_records(table, fields, cnd):
+
+   return get_sink().get_records(table, fields, cnd)
+
 #
 # get record date for given year, month and day
 #
@@ -267,16 +966,17 @@ def get_record_date(yr, mo, dy):
 #
 # get the tidx from table inventory for given date
 #
+@timed('inventory')
 def date2tidx(cdate):
 
-   table = "{}.ispd_inventory".format(DBCNTL)
-   pgrec = PgDBI.pgget(table, "tidx", "date = '{}'".format(cdate), PgLOG.LGEREX)
+   inventory = get_inventory_cache()
+   pgrec = inventory.get_date_record(cdate)
    if pgrec:
       return pgrec['tidx']
 
-   pgrec = PgDBI.pgget(table, "max(tidx) tidx, max(date) date", "", PgLOG.LGEREX)
-   if pgrec and PgUtil.diffdate(cdate, pgrec['date']) > 0:
-      return pgrec['tidx']
+   mdate = inventory.max_date()
+   if mdate and PgUtil.diffdate(cdate, mdate) > 0:
+      return inventory.max_tidx()
    else:
       return 1
 
@@ -285,29 +985,28 @@ def date2tidx(cdate):
 #
 def iidx2date(iidx):
 
-   table = "{}.ispd_inventory".format(DBCNTL)
-   pgrec = PgDBI.pgget(table, "date", "miniidx <= {} AND maxiidx >= {}".format(iidx, iidx), PgLOG.LGEREX)
-   return (pgrec['date'] if pgrec else None)
+   return get_inventory_cache().iidx2date(iidx)
 
 #
 # get max inventory index
 #
+@timed('inventory')
 def get_inventory_record(didx = 0, cntopt = 0):
 
    table = "{}.ispd_inventory".format(DBCNTL)
+   inventory = get_inventory_cache()
 
    if not didx:
       if cntopt == 2:
-         pgrec = PgDBI.pgget(table, "min(date) mdate", "tcount = 0", PgLOG.LGEREX)
-         if not (pgrec and pgrec['mdate']):
+         mdate = inventory.min_uncounted_date()
+         if not mdate:
             logger.error(table+": no counted-only inventory record exists")
-         didx = get_inventory_didx(pgrec['mdate'], 1)
+         didx = get_inventory_didx(mdate, 1)
       elif cntopt == 0:
-         pgrec = PgDBI.pgget(table, "max(didx) idx", "", PgLOG.LGEREX)
-         didx = (pgrec['idx'] if pgrec else 0)
+         didx = inventory.max_didx()
    if didx:
       cnd = "didx = {}".format(didx)
-      pgrec = PgDBI.pgget(table, "*", cnd, PgLOG.LGEREX)
+      pgrec = inventory.get_record(didx)
       if not pgrec:
          logger.error("{}: record not found for {}".format(table, cnd))
    else:
@@ -322,24 +1021,30 @@ def get_inventory_record(didx = 0, cntopt = 0):
 def get_inventory_didx(cdate, prev):
 
    table = "ispd_inventory"
-   fld = "didx, date"
-   if prev:
-      cnd = "date < '{}' ORDER BY date DESC".format(cdate)
-   else:
-      cnd = "date > '{}' ORDER BY date ASC".format(cdate)
+   didx = get_inventory_cache().get_date_didx(cdate, prev)
+   if not didx:
+      logger.error("{}: record not found {} {}".format(table, ("before" if prev else "after"), cdate))
 
-   pgrec = PgDBI.pgget(table, fld, cnd, PgLOG.LGEREX)
-   if not pgrec:
-      logger.error("{}: record not found for {}".format(table, cnd))
+   return didx
+
+#
+# get the in-memory inventory index, loading the inventory table on first use
+#
+@timed('inventory')
+def get_inventory_cache():
+
+   global INVCACHE
+   if INVCACHE is None:
+      INVCACHE = InventoryCache("{}.ispd_inventory".format(DBCNTL), get_sink()).load()
 
-   return pgrec['didx']
+   return INVCACHE
 
 #
 # initialize the global indices
 #
-def init_current_indices(lead_uid = 0, check_existing = 0):
+def init_current_indices(lead_uid = 0, check_existing = 0, update_control = 0):
 
-   global UIDIDX, CURIIDX, CURTIDX, CURIUID, AUTHREFS, LEADUID, CHKEXIST
+   global UIDIDX, CURIIDX, CURTIDX, CURIUID, AUTHREFS, LEADUID, CHKEXIST, CNTLUPDATE
    # leading info for iuida
    UIDIDX = ISPDS['ispdmeta']['tindex']
    CURIIDX = 0
@@ -348,6 +1053,174 @@ def init_current_indices(lead_uid = 0, check_existing = 0):
    AUTHREFS = {}
    LEADUID = lead_uid
    CHKEXIST = check_existing
+   CNTLUPDATE = update_control
+   ITIDXCACHE.clear()
+   ITIDXEXIST.clear()
+
+#
+# set the method used to load records into the ISPDDB tables
+#
+def set_load_method(load_method = None):
+
+   global LOADMETHOD
+   if not load_method: load_method = 'insert'
+   if load_method not in LOADMETHODS:
+      logger.error("{}: unknown load method, must be one of {}".format(load_method, '/'.join(LOADMETHODS)))
+      return
+   LOADMETHOD = load_method
+
+#
+# write the records, inventory and control tables to the sink of a name in ispd_sink.SINKS;
+# path is the database file or output directory of the sqlite and file sinks
+#
+def set_sink(name = None, path = None):
+
+   global SINK
+   SINK = open_sink(name, path, LOADMETHOD)
+   if STATS: SINK = CountingSink(SINK, STATS)
+
+def get_sink():
+   """ Return the current sink, the PgDBI connection if none is set """
+
+   global SINK
+   if SINK is None:
+      SINK = PgSink(None, LOADMETHOD)
+      if STATS: SINK = CountingSink(SINK, STATS)
+
+   return SINK
+
+def close_sink():
+
+   global SINK, INVCACHE
+   if SINK:
+      SINK.close()
+      SINK = None
+   INVCACHE = None    # the inventory of the next sink is loaded again
+
+#
+# collect the stage times, table loads and counts of the fill; close_stats() writes
+# them as JSON to jsonfile and in the Prometheus text format to promfile
+#
+def set_stats(jsonfile = None, promfile = None):
+
+   global STATS
+   STATS = IngestStats(jsonfile, promfile) if jsonfile or promfile else None
+
+def close_stats():
+
+   global STATS
+   if STATS:
+      summary = STATS.write()
+      logger.info("{} lines, {} rows in {:.2f}s: {:.0f} lines/s, {:.0f} rows/s, {} database round trips".format(
+                  summary['lines'], summary['rows'], summary['seconds'], summary['lines_per_sec'],
+                  summary['rows_per_sec'], summary['roundtrips']))
+      STATS = None
+
+def get_read_timer():
+   """ Return the timer of the reads of the input files for ispd_io.open_ispd_file(), None without stats """
+
+   return (lambda: STATS.timer('read')) if STATS else None
+
+def time_blocks(blocks, stage = 'dates'):
+   """ Yield the items of an iterator of date blocks, timing the time taken to get each as stage """
+
+   if not STATS: return blocks
+
+   def timed_blocks():
+      while True:
+         with STATS.timer(stage):
+            item = next(blocks, None)
+         if item is None: return
+         yield item
+
+   return timed_blocks()
+
+def count_stats(**counts):
+
+   if STATS: STATS.add_counts(**counts)
+
+def get_stats_snapshot():
+
+   return STATS.snapshot() if STATS else None
+
+def get_file_stats(fname, snapshot):
+   """ Return the stats summary of a file filled since snapshot, None without stats """
+
+   return STATS.file_summary(fname, snapshot) if STATS and snapshot else None
+
+def merge_file_stats(fname, summary):
+
+   if STATS and summary: STATS.merge_file(fname, summary)
+
+#
+# load the tables of each date concurrently over a pool of size connections, committed
+# together with two-phase commit if twophase is set; size < 2 loads them one after
+# another on the PgDBI connection
+#
+def set_pool_writer(size = 0, twophase = None):
+
+   global POOLWRITER, POOLTWOPHASE
+   close_pool_writer()
+   if twophase is not None: POOLTWOPHASE = twophase
+   if size and size > 1 and not get_sink().concurrent:
+      logger.warning("the {} sink is written by one connection, concurrent writers ignored".format(get_sink().name))
+   elif size and size > 1:
+      POOLWRITER = PoolWriter(size, LOADMETHOD, POOLTWOPHASE, STATS)
+
+#
+# wait for the dates queued on the pool writer to be committed
+#
+def wait_pool_writer():
+
+   if POOLWRITER: POOLWRITER.wait()
+
+def close_pool_writer():
+
+   global POOLWRITER
+   if POOLWRITER:
+      POOLWRITER.close()
+      POOLWRITER = None
+
+#
+# cache the parsed records of the input files in cachedir, evicting the least
+# recently used entries once the cache holds over nbytes
+#
+def set_parse_cache(cachedir = None, nbytes = None):
+
+   global PARSECACHE
+   PARSECACHE = ParseCache(cachedir, (CACHEBYTES if nbytes is None else nbytes), ISPD_FIELDS, ISPD_COLUMNS) if cachedir else None
+
+def open_parse_cache(fname):
+   """ Return the ispd_cache.CachedFile of a file on a hit, a CacheWriter on a miss, None without a cache """
+
+   return PARSECACHE.open(fname) if PARSECACHE else None
+
+#
+# add the inventory records of the date blocks of one file ahead of loading;
+# blocks is a list of (date, record count) in file order
+#
+def reserve_inventory_records(fname, blocks):
+
+   global INVENTORY
+   if not INVENTORY: INVENTORY = get_inventory_record()
+   records = []
+   for cdate, count in blocks:
+      INVENTORY = add_inventory_record(fname, cdate, count, INVENTORY)
+      precreate_partitions(INVENTORY)
+      records.append(INVENTORY)
+
+   return records
+
+#
+# initialize indices for a date from an inventory record reserved ahead of time
+#
+def init_indices_for_record(cdate, count, record):
+
+   global CURIIDX, CURTIDX
+   if record['date'] != cdate or record['count'] != count:
+      logger.error("{}/{}: reserved inventory record does not match {}/{}".format(record['date'], record['count'], cdate, count))
+   CURIIDX = record['miniidx'] - 1
+   CURTIDX = record['tidx']
 
 #
 # initialize indices for givn date
@@ -361,8 +1234,7 @@ def init_indices_for_date(cdate, fname):
       CURIIDX = INVENTORY['maxiidx']
       CURTIDX = INVENTORY['tidx']
    else:
-      table = "{}.ispd_inventory".format(DBCNTL)
-      pgrec = PgDBI.pgget(table, "*", "date = '{}'".format(cdate), PgLOG.LGEREX)
+      pgrec = get_inventory_cache().get_date_record(cdate)
       if not pgrec:
          logger.error("{}: given date not in inventory yet".format(cdate))
       if CURIIDX < pgrec['miniidx']:
@@ -372,61 +1244,168 @@ def init_indices_for_date(cdate, fname):
    return
 
 #
-# update or add control tables
+# accumulate the control table counts and itidx records of one date in memory;
+# they are written by flush_control_tables()
 #
+@timed('control')
 def update_control_tables(cdate, acnts, iuida, tidx = 0):
 
    if not tidx: tidx = date2tidx(cdate)
 
    if iuida and acnts[0]:
-      tname = "cntldb.itidx"
-      records = {}
+      itidx = CNTLRECORDS['itidx']
       for i in range(acnts[UIDIDX]):
-         auid = iuida['uid'][i][0:2].lower()
-         if auid not in records:
-            records[auid] = {'suid' : [], 'date' : [], 'tidx' : [], 'iidx' : []}
-         records[auid]['suid'].append(iuida['uid'][i][2:6])
-         records[auid]['date'].append(cdate)
-         records[auid]['tidx'].append(tidx)
-         records[auid]['iidx'].append(iuida['iidx'][i])
-
-      for auid in records:
-         add_records_to_table(tname, auid, records[auid], cdate)
-
-   tname = "cntldb.iattm"
-   dname = tname + "_daily"
+         uid = iuida['uid'][i]
+         itidx.setdefault(uid[0:2].lower(), {})[uid[2:6]] = (cdate, tidx, iuida['iidx'][i])
+
+   iattm = CNTLRECORDS['iattm']
+   daily = CNTLRECORDS['iattm_daily']
    for i in range(TABLECOUNT):
       if not acnts[i]: continue
-      aname = IMMA_NAMES[i]
-      cnd = "attm = '{}' AND tidx = {}".format(aname, tidx)
-      pgrec = PgDBI.pgget(tname, "aidx, count", cnd, PgLOG.LGWNEX)
-      if pgrec:
-         record = {'count' : (pgrec['count'] + acnts[i])}
-         PgDBI.pgupdt(tname, record, "aidx = {}".format(pgrec['aidx']), PgLOG.LGWNEX)
+      aname = ISPD_NAMES[i]
+      key = (aname, tidx)
+      iattm[key] = iattm.get(key, 0) + acnts[i]
+      key = (aname, cdate)
+      daily[key] = [tidx, (daily[key][1] if key in daily else 0) + acnts[i]]
+
+#
+# write the accumulated control records with multi-row upserts and clear them
+#
+@timed('control')
+def flush_control_tables():
+
+   tname = "{}.iattm".format(CNTLSCHEMA)
+   rows = [(aname, tidx, count) for (aname, tidx), count in CNTLRECORDS['iattm'].items()]
+   upsert_records(tname, ['attm', 'tidx', 'count'], rows, ['attm', 'tidx'],
+                  "count = iattm.count + EXCLUDED.count")
+
+   dname = tname + "_daily"
+   rows = [(cdate, tidx, aname, count) for (aname, cdate), (tidx, count) in CNTLRECORDS['iattm_daily'].items()]
+   upsert_records(dname, ['date', 'tidx', 'attm', 'count'], rows, ['attm', 'date'],
+                  "count = iattm_daily.count + EXCLUDED.count")
+
+   tname = "{}.itidx".format(CNTLSCHEMA)
+   itidx = CNTLRECORDS['itidx']
+   for auid in itidx:
+      table = check_partition(tname, auid)
+      rows = [(suid, cdate, tidx, iidx) for suid, (cdate, tidx, iidx) in itidx[auid].items()]
+      upsert_records(table, ['suid', 'date', 'tidx', 'iidx'], rows, ['suid'],
+                     "date = EXCLUDED.date, tidx = EXCLUDED.tidx, iidx = EXCLUDED.iidx")
+
+   for key in CNTLRECORDS: CNTLRECORDS[key].clear()
+
+#
+# insert rows into table with multi-row INSERT ... ON CONFLICT DO UPDATE statements
+#
+def upsert_records(table, fields, rows, keys, updates):
+
+   return get_sink().upsert_records(table, fields, rows, keys, updates)
+
+#
+# get the column definitions of an ISPD table as SQL, derived from ispddb_config
+#
+def get_table_columns_sql(aname):
+
+   attm = ISPDS[aname]['attm']
+   columns = []
+   for var in attm:
+      field = attm[var]
+      if field['type'] is str:
+         columns.append("{} varchar({})".format(var, field['size']))
       else:
-         record = {'tidx' : tidx, 'attm' : aname, 'count' : acnts[i]}
-         PgDBI.pgadd(tname, record, PgLOG.LGWNEX)
-
-      cnd = "attm = '{}' AND date = '{}'".format(aname, cdate)
-      pgrec = PgDBI.pgget(dname, "aidx, count", cnd, PgLOG.LGWNEX)
-      if pgrec:
-         record = {'count' : (pgrec['count'] + acnts[i])}
-         PgDBI.pgupdt(dname, record, "aidx = {}".format(pgrec['aidx']), PgLOG.LGWNEX)
+         columns.append("{} {}".format(var, SQLTYPES[field['type']]))
+   if 'year' in attm:
+      columns.append("date date")
+
+   return ', '.join(columns)
+
+#
+# load the names of the existing tables in the ISPDDB schemas into the partition cache
+#
+@timed('ddl')
+def load_partitions():
+
+   global PARTITIONS
+   sink = get_sink()
+   PARTITIONS = {partition_key(table) for table in sink.table_names([sink.schema, DBCNTL, CNTLSCHEMA])}
+
+   return PARTITIONS
+
+#
+# normalize a table name to the form cached in PARTITIONS
+#
+def partition_key(table):
+
+   schema = get_sink().schema
+   prefix = schema + '.' if schema else None
+   return table[len(prefix):] if prefix and table.startswith(prefix) else table
+
+#
+# get the existing partition with the lowest suffix for a table name
+#
+def get_partition_template(tname):
+
+   template = None
+   prefix = partition_key(tname) + '_'
+   for table in PARTITIONS:
+      if table.startswith(prefix):
+         suffix = table[len(prefix):]
+         if not template or (suffix.isdigit() and (not template[1].isdigit() or int(suffix) < int(template[1]))):
+            template = (table, suffix)
+
+   return template[0] if template else None
+
+#
+# make sure partition suffix of table name tname exists, creating it in-process if not;
+# with the pool writer, it is created and committed on a pooled connection
+#
+def check_partition(tname, suffix):
+
+   if PARTITIONS is None: load_partitions()
+   table = partition_key("{}_{}".format(tname, suffix))
+   if table in PARTITIONS:
+      return table
+
+   template = get_partition_template(tname)
+   columns = get_table_columns_sql(tname) if tname in ISPDS else None
+   sqlstr = partition_statement(table, template, columns)
+   with stage_timer('ddl'):
+      if POOLWRITER and sqlstr:
+         POOLWRITER.execute(sqlstr)    # committed before the pooled connections load it
       else:
-         record = {'date' : cdate, 'tidx' : tidx, 'attm' : aname, 'count' : acnts[i]}
-         PgDBI.pgadd(dname, record, PgLOG.LGWNEX)
+         get_sink().create_partition(table, tname, suffix, template, columns)
+   logger.info("{}: partition created".format(table))
+   PARTITIONS.add(table)
+
+   return table
+
+#
+# create the partitions of the next tidx ahead of time once the current one is nearly full
+#
+def precreate_partitions(inventory):
+
+   if inventory['tcount'] < get_sink().max_records*PRECREATE_RATIO:
+      return
+
+   suffix = str(inventory['tidx'] + 1)
+   for aname in ISPD_NAMES:
+      check_partition(aname, suffix)
 
 def add_records_to_table(tname, suffix, records, cdate):
    """ Add records to a table """
    table =  "{}_{}".format(tname, suffix)
-   if not PgDBI.pgcheck(table):
-      pgcmd = PgDBI.get_pgddl_command(tname)
-      PgLOG.pgsystem("{} -x {}".format(pgcmd, suffix), PgLOG.LGWNEX)
+   check_partition(tname, suffix)
 
-   cnt = PgDBI.pgmadd(table, records, PgLOG.LGEREX)
+   start = time.perf_counter()
+   with stage_timer('insert'):
+      cnt = get_sink().add_records(table, records)
 
    ess = 's' if cnt > 1 else ''
-   logger.info("{}: {} record{} added to {}".format(cdate, cnt, ess, table))
+   if STATS:   # the loads of each table are summarized by the stats instead
+      STATS.add_load(tname, cnt, time.perf_counter() - start)
+      logger.debug("{}: {} record{} added to {}".format(cdate, cnt, ess, table))
+   else:
+      logger.info("{}: {} record{} added to {}".format(cdate, cnt, ess, table))
 
    return cnt
 
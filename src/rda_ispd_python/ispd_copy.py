@@ -0,0 +1,92 @@
+"""
+Bulk loading of ISPD records with PostgreSQL COPY ... FROM STDIN (text format)
+"""
+
+import PgLOG
+import PgDBI
+
+from .ispd_buffer import TableBuffer
+
+import logging
+logger = logging.getLogger(__name__)
+
+COPY_NULL = '\\N'
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_ROWS = 10000     # rows formatted at a time by the copy stream
+COPY_SIZE = 1 << 20   # bytes psycopg2 reads from the copy stream per call
+
+def copy_text_column(vals):
+   """ Format a list of column values as COPY text fields """
+
+   return [COPY_NULL if val is None else
+           (val.translate(COPY_ESCAPES) if isinstance(val, str) else repr(val))
+           for val in vals]
+
+class CopyStream:
+   """
+   File-like object that formats the rows of a TableBuffer, or of a dict of
+   value lists, into COPY text format as psycopg2 reads it
+   """
+
+   def __init__(self, records, chunk=COPY_ROWS):
+      self.records = records
+      self.fields = list(records)
+      if isinstance(records, TableBuffer):
+         self.count = len(records)
+      else:
+         self.count = len(records[self.fields[0]]) if self.fields else 0
+      self.chunk = chunk
+      self.start = 0
+      self.buffer = ''
+      self.pos = 0
+
+   def next_chunk(self):
+      stop = min(self.start + self.chunk, self.count)
+      if isinstance(self.records, TableBuffer):
+         columns = [copy_text_column(self.records[fld].tolist(self.start, stop)) for fld in self.fields]
+      else:
+         columns = [copy_text_column(self.records[fld][self.start:stop]) for fld in self.fields]
+      self.start = stop
+
+      return ''.join(['\t'.join(row) + '\n' for row in zip(*columns)])
+
+   def read(self, size=-1):
+      if self.pos >= len(self.buffer):
+         if self.start >= self.count: return ''
+         self.buffer = self.next_chunk()
+         self.pos = 0
+      end = len(self.buffer) if size < 0 else self.pos + size
+      data = self.buffer[self.pos:end]
+      self.pos += len(data)
+
+      return data
+
+def copy_records(pgcur, table, records):
+   """ COPY all the rows of records into table with an open cursor; return the row count """
+
+   stream = CopyStream(records)
+   sqlstr = "COPY {} ({}) FROM STDIN".format(table, ','.join(stream.fields))
+   pgcur.copy_expert(sqlstr, stream, COPY_SIZE)
+
+   return stream.count
+
+def copy_records_to_table(table, records, logact = PgLOG.LGEREX):
+   """ COPY records into table over the PgDBI connection, the bulk equivalent of PgDBI.pgmadd """
+
+   pgcnt = 0
+   while True:
+      pgcur = PgDBI.pgcursor()
+      if not pgcur: return PgLOG.FAILURE
+      try:
+         count = copy_records(pgcur, table, records)
+      except PgDBI.PgSQL.Error as pgerr:
+         if not PgDBI.check_dberror(pgerr, pgcnt, "COPY " + table, None, logact): return PgLOG.FAILURE
+      else:
+         break
+      pgcnt += 1
+
+   pgcur.close()
+   # unlike pgmadd, the rows are not counted towards PGDBI['MTRANS']: a transaction open
+   # here is a batch of dates, committed whole by the fill
+
+   return count
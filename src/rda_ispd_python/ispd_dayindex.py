@@ -0,0 +1,277 @@
+"""
+Day index of an ISPD ASCII file, stored alongside it as <file>.days.json: the
+byte offset, length, line count and SHA-1 checksum of each run of lines with
+the same date, in file order.  A fill of selected dates reads a plain file's
+dates straight from their offsets, without reading the rest of the file; a
+compressed file is read up to the end of its last selected date.  The index
+also gives the records per date of a file without parsing it.  An index is
+stale once the size or modification time of its file changes.
+"""
+
+import hashlib
+import json
+import mmap
+import os
+
+from .ispd_common import *
+from .ispd_io import MappedLines, open_ispd_file, detect_compression, is_hdf5_file
+
+import logging
+logger = logging.getLogger(__name__)
+
+def index_path(fname):
+   return fname + DAYINDEXEXT
+
+def file_signature(fname):
+   """ Return the size and modification time that an index of a file is valid for """
+
+   stat = os.stat(fname)
+   return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def normalize_date(text):
+   """ Return the normalized date of a YYYY-MM-DD or YYYYMMDD string """
+
+   digits = text.strip().replace('-', '')
+   if len(digits) != 8 or not digits.isdigit():
+      logger.error("{}: not a date, YYYY-MM-DD expected".format(text))
+      raise ValueError(text)
+
+   return get_ispd_date(digits)
+
+def day_entry(cdate, offset, data):
+   """ Return the index entry of a run of lines of one date, data its bytes """
+
+   lines = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+   return {'date': cdate, 'offset': offset, 'length': len(data), 'lines': lines,
+           'checksum': hashlib.sha1(data).hexdigest()}
+
+def scan_mapped_days(fname):
+   """ Return the index entries of the date runs of a plain file, split as get_mapped_blocks() does """
+
+   days = []
+   if not os.path.getsize(fname): return days
+   with open(fname, 'rb') as fh:
+      mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+   try:
+      size = len(mm)
+      cdate = None
+      start = pos = 0
+      while pos < size:
+         prefix = mm[pos:pos+8]
+         idate = get_prefix_date(prefix)
+         if idate != cdate:
+            if cdate: days.append(day_entry(cdate, start, mm[start:pos]))
+            cdate = idate
+            start = pos
+         pos = next_prefix_line(mm, pos, prefix)
+      if cdate: days.append(day_entry(cdate, start, mm[start:size]))
+   finally:
+      mm.close()
+
+   return days
+
+def scan_stream_days(fname):
+   """ Return the index entries of the date runs of a compressed file; offsets are those of its decompressed text """
+
+   days = []
+   start = 0
+   with open_ispd_file(fname) as fh:
+      for cdate, lines, end in get_ispd_blocks(fh, 0):
+         days.append(day_entry(cdate, start, ''.join(lines).encode('latin_1')))
+         start = end
+
+   return days
+
+class DateSelection:
+   """ Dates selected for a fill: a list of dates and/or an inclusive (start, end) range """
+
+   def __init__(self, dates=None, date_range=None):
+      self.dates = {normalize_date(date) for date in dates} if dates else None
+      self.range = tuple(normalize_date(date) for date in date_range) if date_range else None
+
+   def __bool__(self):
+      return self.dates is not None or self.range is not None
+
+   def __contains__(self, cdate):
+      if self.dates is not None and cdate in self.dates: return True
+      return self.range is not None and self.range[0] <= cdate <= self.range[1]
+
+   def __str__(self):
+      parts = sorted(self.dates) if self.dates else []
+      if self.range: parts.append("{} to {}".format(*self.range))
+      return ', '.join(parts)
+
+class DayIndex:
+   """ Date runs of one input file, loaded from or written to its sidecar index """
+
+   def __init__(self, fname, info):
+      self.fname = fname
+      self.info = info
+      self.days = info['days']
+
+   @property
+   def plain(self):
+      return not self.info['compression']
+
+   def select(self, selection):
+      """ Return the entries of the selected dates, in file order """
+
+      return [day for day in self.days if day['date'] in selection]
+
+   def counts(self, selection=None):
+      """ Return the (date, lines) of each date of the file, or of the selected dates, in date order """
+
+      counts = {}
+      for day in (self.select(selection) if selection else self.days):
+         counts[day['date']] = counts.get(day['date'], 0) + day['lines']
+
+      return sorted(counts.items())
+
+   def end(self, selection):
+      """ Return the offset at the end of the last selected date, 0 if none is in the file """
+
+      return max((day['offset'] + day['length'] for day in self.select(selection)), default=0)
+
+   def check(self, days=None):
+      """ Return the dates of the entries, all by default, whose bytes do not match their checksums """
+
+      days = self.days if days is None else days
+      if not self.plain:
+         current = {(day['offset'], day['checksum']) for day in scan_stream_days(self.fname)}
+         return [day['date'] for day in days if (day['offset'], day['checksum']) not in current]
+
+      bad = []
+      with open(self.fname, 'rb') as fh:
+         for day in days:
+            fh.seek(day['offset'])
+            data = fh.read(day['length'])
+            if len(data) != day['length'] or hashlib.sha1(data).hexdigest() != day['checksum']: bad.append(day['date'])
+
+      return bad
+
+def build_day_index(fname):
+   """ Scan an ISPD ASCII file, write its day index alongside it and return the DayIndex; None for HDF5 files """
+
+   if is_hdf5_file(fname):
+      logger.error("{}: HDF5 files are read by rows, not indexed by date".format(fname))
+      return None
+
+   signature = file_signature(fname)
+   compression = detect_compression(fname)
+   days = scan_stream_days(fname) if compression else scan_mapped_days(fname)
+   info = {'version': DAYINDEXVERSION, 'file': os.path.basename(fname), 'compression': compression}
+   info.update(signature)
+   info['days'] = days
+   ipath = index_path(fname)
+   # write aside and rename, so a fill never reads a partial index
+   with open(ipath + '.tmp', 'w') as fh:
+      json.dump(info, fh)
+   os.replace(ipath + '.tmp', ipath)
+   logger.info("{}: {} date runs of {} lines indexed".format(fname, len(days), sum(day['lines'] for day in days)))
+
+   return DayIndex(fname, info)
+
+def load_day_index(fname):
+   """ Return the DayIndex of a file, None if it has none or it is stale """
+
+   ipath = index_path(fname)
+   if not os.path.exists(ipath): return None
+   try:
+      with open(ipath, 'r') as fh:
+         info = json.load(fh)
+   except ValueError:
+      logger.warning("{}: unreadable day index, ignored".format(ipath))
+      return None
+   if info.get('version') != DAYINDEXVERSION:
+      logger.warning("{}: day index of version {}, rebuild it".format(ipath, info.get('version')))
+      return None
+   signature = file_signature(fname)
+   if info['size'] != signature['size'] or info['mtime'] != signature['mtime']:
+      logger.warning("{}: file changed since its day index was built, rebuild it".format(fname))
+      return None
+
+   return DayIndex(fname, info)
+
+class IndexedDays:
+   """ Selected dates of a memory-mapped plain file, read from the offsets of its day index """
+
+   def __init__(self, fname, days):
+      self.fname = fname
+      self.days = days
+      with open(fname, 'rb') as fh:
+         self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) if days else None
+      self.pos = 0
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def seek(self, offset):
+      self.pos = offset
+      return offset
+
+   def tell(self):
+      return self.pos
+
+   def get_blocks(self, offset=None):
+      """ Yield (date, MappedLines) of each selected date from the current position; given offset, with its end offset """
+
+      if not self.days: return
+      view = memoryview(self.mm)
+      for day in self.days:
+         start = day['offset']
+         end = start + day['length']
+         if start < self.pos: continue
+         self.pos = end
+         lines = MappedLines(view[start:end])
+         yield (day['date'], lines) if offset is None else (day['date'], lines, end)
+      view.release()
+
+   def close(self):
+      if self.mm is None: return
+      try:
+         self.mm.close()
+      except BufferError:
+         pass    # dates not parsed yet still refer to the map; it is closed when they are freed
+
+def open_selected_days(fname, selection):
+   """
+   Return an IndexedDays of the selected dates of a plain file with a current day index
+   whose checksums match, or None if the file is to be read through for them instead
+   """
+
+   index = load_day_index(fname)
+   if index is None:
+      logger.info("{}: no current day index, read through for the dates {}".format(fname, selection))
+      return None
+   if not index.plain: return None
+
+   days = index.select(selection)
+   bad = index.check(days)
+   if bad:
+      logger.warning("{}: dates {} do not match their day index checksums, read through instead".format(fname, ', '.join(bad)))
+      return None
+   logger.info("{}: {} runs of the dates {} read from the day index".format(fname, len(days), selection))
+
+   return IndexedDays(fname, days)
+
+def selection_end(fname, selection):
+   """
+   Return the offset at the end of the last selected date of a compressed file from its day index,
+   None without one; plain files with a usable index are read by IndexedDays instead
+   """
+
+   index = load_day_index(fname)
+   return index.end(selection) if index and not index.plain else None
+
+def select_date_blocks(blocks, selection, end=None):
+   """
+   Yield the (date, lines, end offset) blocks of the selected dates; reading stops
+   after the block reaching end, the offset at the end of the last selected date
+   """
+
+   for block in blocks:
+      if block[0] in selection: yield block
+      if end is not None and block[2] >= end: break
@@ -0,0 +1,107 @@
+"""
+Detection of the ISPD records already in ISPDDB, for fills with check_existing.
+The uids of a partition of the uid table are loaded once per file, the first
+time a date with records in it is filled, a page of DEDUPPAGE at a time; they
+are kept in an exact set, or in a Bloom filter for partitions of over
+DEDUPBLOOMROWS rows, whose hits are confirmed with batched queries.  The
+records of a date are then filtered in bulk before they are loaded.
+"""
+
+import hashlib
+import math
+
+from .ispddb_config import *
+from .ispd_sink import sql_value
+
+import logging
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+   """ Bloom filter of count string keys with a false positive rate of fprate """
+
+   def __init__(self, count, fprate):
+      self.nbits = max(64, int(-count*math.log(fprate)/math.log(2)**2))
+      self.nhashes = max(1, round(self.nbits/max(count, 1)*math.log(2)))
+      self.bits = bytearray((self.nbits + 7) >> 3)
+
+   def positions(self, key):
+      # double hashing over the two halves of one digest
+      digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+      h1 = int.from_bytes(digest[0:8], 'little')
+      h2 = int.from_bytes(digest[8:16], 'little') | 1
+      return [(h1 + i*h2) % self.nbits for i in range(self.nhashes)]
+
+   def add(self, key):
+      for pos in self.positions(key):
+         self.bits[pos >> 3] |= 1 << (pos & 7)
+
+   def __contains__(self, key):
+      return all(self.bits[pos >> 3] >> (pos & 7) & 1 for pos in self.positions(key))
+
+class PartitionKeys:
+   """ uids of one partition of the uid table, in an exact set or a Bloom filter """
+
+   def __init__(self, sink, table, count, bloomrows=DEDUPBLOOMROWS, fprate=DEDUPFPRATE):
+      self.sink = sink
+      self.table = table
+      self.bloom = BloomFilter(count, fprate) if bloomrows and count > bloomrows else None
+      self.keys = set() if self.bloom is None else None
+      self.count = 0
+      last = ''
+      while True:
+         pgrecs = sink.get_records(table, 'uid', "uid > {} ORDER BY uid LIMIT {}".format(sql_value(last), DEDUPPAGE))
+         for pgrec in pgrecs:
+            if self.bloom is None:
+               self.keys.add(pgrec['uid'])
+            else:
+               self.bloom.add(pgrec['uid'])
+         self.count += len(pgrecs)
+         if len(pgrecs) < DEDUPPAGE: break
+         last = pgrecs[-1]['uid']
+      logger.info("{}: {} uids loaded{}".format(table, self.count, (" into a Bloom filter" if self.bloom else "")))
+
+   def existing(self, uids):
+      """ Return the set of uids that are in the partition """
+
+      if self.bloom is None: return {uid for uid in uids if uid in self.keys}
+
+      hits = sorted({uid for uid in uids if uid in self.bloom})
+      found = set()
+      for i in range(0, len(hits), ITIDXBATCH):
+         cnd = "uid IN ({})".format(', '.join(map(sql_value, hits[i:i+ITIDXBATCH])))
+         found.update(pgrec['uid'] for pgrec in self.sink.get_records(self.table, 'uid', cnd))
+
+      return found
+
+class DuplicateFilter:
+   """ uids already loaded in the partitions of the uid table, for the dates of one file """
+
+   def __init__(self, sink, aname, bloomrows=DEDUPBLOOMROWS, fprate=DEDUPFPRATE):
+      self.sink = sink
+      self.aname = aname
+      self.bloomrows = bloomrows
+      self.fprate = fprate
+      self.partitions = {}    # partition table: PartitionKeys
+      self.skipped = 0
+
+   def get_partition(self, table, count):
+      if table not in self.partitions:
+         self.partitions[table] = PartitionKeys(self.sink, table, count, self.bloomrows, self.fprate)
+      return self.partitions[table]
+
+   def filter(self, records, partitions):
+      """
+      Return a DayBuffer of the records whose uid is in none of partitions, a list of
+      (partition table, row count); records are returned as they are if none is skipped
+      """
+
+      uids = records[self.aname]['uid'].tolist()
+      existing = set()
+      for table, count in partitions:
+         existing |= self.get_partition(table, count).existing(uids)
+      if not existing: return records
+
+      rows = [i for i, uid in enumerate(uids) if uid not in existing]
+      self.skipped += len(uids) - len(rows)
+
+      return records.take(rows)
@@ -0,0 +1,161 @@
+"""
+Reading of the original ISPD records from HDF5 files.  The datasets are read
+H5CHUNK rows at a time and decoded by the vectorized block parser into the
+same day buffers as the ASCII input, without formatting any lines.
+
+Expected layout of a file:
+
+   H5GROUP (default '/')
+      uid            1-D, one value per record
+      ncep_type      1-D
+      ...            one dataset per field of an ASCII line
+      icoads_uid     1-D
+
+- There is one dataset for each of the FIELD_COUNT (41) fields of an ISPD ASCII
+  line, named after the variable of the whole field, as returned by
+  get_dataset_fields(); the variables taken from part of a field (e.g. the
+  date parts of uid) have no dataset of their own.
+- All the datasets have the same length, one row per record, and row i of every
+  dataset belongs to the same record.  The rows are in file order, grouped by
+  date like the lines of an ASCII file: the date is the first 8 characters of uid.
+- String fields are fixed-length byte strings or variable-length strings,
+  holding the text of the ASCII field; numeric fields are integers or floats,
+  with the missing value of the field or NaN for a missing value.  A number is
+  decoded from its shortest text, whole floats of int fields without a fraction.
+- A missing dataset is logged and loaded as empty (missing) values.
+
+Positions within a file, for the checkpoint journal and the parse cache, are
+row numbers rather than byte offsets.
+"""
+
+import numpy
+
+from . import ispd_common
+from .ispd_block import BlockColumn, decode_ispd_fields, substr_column
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+def get_dataset_fields():
+   """ Return the (dataset name, field type) of each ISPD field index, from the variables without a position """
+
+   fields = [None]*FIELD_COUNT
+   for aname in ISPDS:
+      attm = ISPDS[aname]['attm']
+      for var in attm:
+         field = attm[var]
+         if field['position'] is None and fields[field['field_index']] is None:
+            fields[field['field_index']] = (var, field['type'])
+
+   return fields
+
+def dataset_strings(values, field_type):
+   """ Convert the values read from a dataset to the unicode array of the ASCII field text """
+
+   kind = values.dtype.kind
+   if kind == 'S':
+      return numpy.char.decode(values, 'latin_1')
+   if kind == 'O':
+      return numpy.array([val.decode('latin_1') if isinstance(val, bytes) else str(val) for val in values.tolist()], dtype=str)
+   if kind == 'f' and field_type is int:
+      # whole numbers stored as floats, e.g. with NaN for missing values, are written without a fraction
+      text = values.astype(str)
+      whole = numpy.isfinite(values) & (values == numpy.trunc(values))
+      return numpy.where(whole, numpy.where(whole, values, 0).astype(numpy.int64).astype(str), text)
+
+   return values.astype(str)    # NaN becomes 'nan', which decodes to the missing value
+
+class HDF5Reader:
+   """ ISPD records of an HDF5 file, read from its field datasets by rows; positions are row numbers """
+
+   def __init__(self, fname, group=None):
+      import h5py
+      self.fname = fname
+      self.h5 = h5py.File(fname, 'r')
+      group = group or H5GROUP
+      self.datasets = []    # (dataset or None, field type) per field index
+      missing = []
+      for name, field_type in get_dataset_fields():
+         path = "{}/{}".format(group.rstrip('/'), name)
+         if path in self.h5:
+            self.datasets.append((self.h5[path], field_type))
+         else:
+            self.datasets.append((None, field_type))
+            missing.append(name)
+      self.rows = len(self.datasets[0][0]) if self.datasets[0][0] is not None else 0
+      if missing:
+         logger.warning("{}: no dataset for {} in {}, loaded as empty".format(fname, ', '.join(missing), group))
+      if not self.rows:
+         logger.error("{}: no uid dataset, or no rows, in {}".format(fname, group))
+      for dataset, field_type in self.datasets:
+         if dataset is not None and len(dataset) != self.rows:
+            logger.error("{}: dataset {} has {} rows, {} expected".format(fname, dataset.name, len(dataset), self.rows))
+            self.rows = min(self.rows, len(dataset))
+      self.pos = 0
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def seek(self, row):
+      self.pos = row
+      return row
+
+   def tell(self):
+      return self.pos
+
+   def read_fields(self, start, stop):
+      """ Return the text of rows start to stop as a list of per-field unicode arrays """
+
+      fields = []
+      for dataset, field_type in self.datasets:
+         if dataset is None:
+            fields.append(numpy.full(stop - start, '', dtype='U1'))
+         else:
+            fields.append(dataset_strings(dataset[start:stop], field_type))
+
+      return fields
+
+   def get_blocks(self, offset=None):
+      """
+      Yield (date, DayBuffer) for each run of rows with the same date from the current row;
+      given the row offset, yield (date, DayBuffer, row at the end of the run); within the
+      memory budget of ispd_common, a date over it is spilled to a SpilledDay instead
+      """
+
+      cdate = None
+      records = spilled = None
+      while self.pos < self.rows:
+         start = self.pos
+         stop = min(start + H5CHUNK, self.rows)
+         fields = self.read_fields(start, stop)
+         columns = decode_ispd_fields(fields)
+         prefixes = substr_column(fields[0], 0, 8)
+         bounds = [0] + (numpy.flatnonzero(prefixes[1:] != prefixes[:-1]) + 1).tolist() + [stop - start]
+         for i in range(len(bounds) - 1):
+            rstart, rstop = bounds[i], bounds[i+1]
+            idate = ispd_common.get_prefix_date(str(prefixes[rstart]))
+            if not idate: continue
+            if idate != cdate:
+               if records:
+                  records = ispd_common.end_day_records(cdate, records, spilled)
+                  yield (cdate, records) if offset is None else (cdate, records, start + rstart)
+               cdate = idate
+               records = ispd_common.initialize_ispd_records()
+               spilled = None
+            elif ispd_common.MEMBUDGET and records.nbytes > ispd_common.MEMBUDGET:
+               spilled = ispd_common.spill_day_records(spilled, records)
+               records = ispd_common.initialize_ispd_records()
+            records.extend_block([BlockColumn(column.values[rstart:rstop], column.missing[rstart:rstop],
+                                              column.null[rstart:rstop]) for column in columns], cdate)
+         self.pos = stop
+
+      if records:
+         records = ispd_common.end_day_records(cdate, records, spilled)
+         yield (cdate, records) if offset is None else (cdate, records, self.rows)
+
+   def close(self):
+      self.h5.close()
@@ -0,0 +1,136 @@
+"""
+In-memory index of the ISPD inventory table (ispddb.ispd_inventory), loaded
+once and kept in sync as inventory records are added, updated or deleted
+"""
+
+from bisect import bisect_left, bisect_right, insort
+
+import logging
+logger = logging.getLogger(__name__)
+
+class InventoryCache:
+   """
+   Inventory records keyed by didx, with sorted (date, didx) and
+   (miniidx, didx) lists for lookups by date and by iidx
+   """
+
+   def __init__(self, table, sink):
+      self.table = table
+      self.sink = sink      # ispd_sink sink the table is read from
+      self.records = {}     # didx: inventory record
+      self.dates = []       # sorted (date, didx)
+      self.iidxs = []       # sorted (miniidx, didx) of records holding iidx ranges
+      self.maxtidx = None
+
+   def load(self):
+      """ Read the whole inventory table once """
+
+      self.records = {}
+      self.dates = []
+      self.iidxs = []
+      self.maxtidx = None
+      for pgrec in self.sink.get_records(self.table, "*", ""):
+         self.add(pgrec)
+
+      return self
+
+   def add(self, record):
+      """ Add a new inventory record, or merge updated fields into an existing one """
+
+      didx = record['didx']
+      pgrec = self.records.get(didx)
+      if pgrec:
+         self.unindex(pgrec)
+         pgrec.update(record)
+      else:
+         pgrec = self.records[didx] = dict(record)
+      if pgrec.get('date') is not None: pgrec['date'] = str(pgrec['date'])
+      if pgrec.get('tidx') is not None and (self.maxtidx is None or pgrec['tidx'] > self.maxtidx):
+         self.maxtidx = pgrec['tidx']
+      self.index(pgrec)
+
+      return pgrec
+
+   def remove(self, didx):
+      """ Remove the record of didx, deleted from the table """
+
+      pgrec = self.records.pop(didx, None)
+      if not pgrec: return
+      self.unindex(pgrec)
+      if pgrec.get('tidx') is not None and pgrec['tidx'] == self.maxtidx:
+         self.maxtidx = max([rec['tidx'] for rec in self.records.values() if rec.get('tidx') is not None], default=None)
+
+   def index(self, pgrec):
+
+      if pgrec.get('date'): insort(self.dates, (pgrec['date'], pgrec['didx']))
+      if pgrec.get('count') and pgrec.get('miniidx') is not None: insort(self.iidxs, (pgrec['miniidx'], pgrec['didx']))
+
+   def unindex(self, pgrec):
+
+      for keys, key in ((self.dates, (pgrec.get('date'), pgrec['didx'])),
+                        (self.iidxs, (pgrec.get('miniidx'), pgrec['didx']))):
+         i = bisect_left(keys, key) if key[0] is not None else len(keys)
+         if i < len(keys) and keys[i] == key: del keys[i]
+
+   def get_record(self, didx):
+      """ Return a copy of the record of didx, None if not found """
+
+      pgrec = self.records.get(didx)
+      return dict(pgrec) if pgrec else None
+
+   def get_date_record(self, cdate):
+      """ Return a copy of the first record of a date, None if the date is not in inventory """
+
+      i = bisect_left(self.dates, (cdate, 0))
+      if i < len(self.dates) and self.dates[i][0] == cdate:
+         return dict(self.records[self.dates[i][1]])
+      return None
+
+   def get_date_records(self, cdate):
+      """ Return copies of all the records of a date, in didx order """
+
+      i = bisect_left(self.dates, (cdate, 0))
+      j = bisect_right(self.dates, (cdate, float('inf')))
+      return [dict(self.records[didx]) for date, didx in self.dates[i:j]]
+
+   def tidx_count(self, tidx):
+      """ Return the records counted in the partitions of tidx, the largest tcount of its inventory records """
+
+      return max([pgrec['tcount'] or 0 for pgrec in self.records.values() if pgrec.get('tidx') == tidx] or [0])
+
+   def get_date_didx(self, cdate, prev):
+      """ Return didx of the latest record before (prev) or earliest record after a date """
+
+      if prev:
+         i = bisect_left(self.dates, (cdate, 0))
+         if i == 0: return None
+         pdate = self.dates[i-1][0]
+         return self.dates[bisect_left(self.dates, (pdate, 0))][1]
+      else:
+         i = bisect_right(self.dates, (cdate, float('inf')))
+         return self.dates[i][1] if i < len(self.dates) else None
+
+   def iidx2date(self, iidx):
+      """ Return the date of the record whose [miniidx, maxiidx] range holds iidx """
+
+      i = bisect_right(self.iidxs, (iidx, float('inf'))) - 1
+      if i >= 0:
+         pgrec = self.records[self.iidxs[i][1]]
+         if pgrec['maxiidx'] >= iidx: return pgrec['date']
+      return None
+
+   def max_didx(self):
+      return max(self.records) if self.records else 0
+
+   def max_tidx(self):
+      return self.maxtidx
+
+   def max_date(self):
+      return self.dates[-1][0] if self.dates else None
+
+   def min_uncounted_date(self):
+      """ Return the earliest date of the counted-only records (tcount = 0) """
+
+      for cdate, didx in self.dates:
+         if not self.records[didx]['tcount']: return cdate
+      return None
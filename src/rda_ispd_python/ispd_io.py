@@ -0,0 +1,320 @@
+"""
+Reading of plain and compressed (gzip, bzip2, xz, zstd) ISPD ASCII files as
+text streams.  The compression is detected from the magic bytes at the start
+of the file, the input is read in blocks of READSIZE bytes, and decompression
+can run on a separate thread to overlap with parsing.  Plain files can also
+be memory-mapped and split into dates without reading them line by line.
+HDF5 files are recognized by their signature and read by ispd_hdf5.
+"""
+
+import bz2
+import gzip
+import io
+import lzma
+import mmap
+import os
+import queue
+import threading
+
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+MAGICS = [(b'\x1f\x8b', 'gzip'),
+          (b'BZh', 'bz2'),
+          (b'\xfd7zXZ\x00', 'xz'),
+          (b'\x28\xb5\x2f\xfd', 'zstd')]
+HDF5MAGIC = b'\x89HDF\r\n\x1a\n'
+
+def detect_compression(fname):
+   """ Return the compression of a file from its magic bytes, None for a plain file """
+
+   with open(fname, 'rb') as fh:
+      head = fh.read(8)
+   for magic, compression in MAGICS:
+      if head.startswith(magic): return compression
+
+   return None
+
+def is_hdf5_file(fname):
+   """ Return True if a file starts with the HDF5 signature """
+
+   with open(fname, 'rb') as fh:
+      return fh.read(len(HDF5MAGIC)) == HDF5MAGIC
+
+class ZstdStream(io.RawIOBase):
+   """ Decompressed bytes of a zstd file; seeking backward reopens the file """
+
+   def __init__(self, fname):
+      import zstandard
+      self.fname = fname
+      self.decompressor = zstandard.ZstdDecompressor()
+      self.reader = None
+      self.open()
+
+   def open(self):
+      if self.reader: self.reader.close()
+      self.reader = self.decompressor.stream_reader(open(self.fname, 'rb'), read_size=READSIZE, closefd=True)
+      self.pos = 0
+
+   def readable(self):
+      return True
+
+   def seekable(self):
+      return True
+
+   def tell(self):
+      return self.pos
+
+   def readinto(self, buf):
+      cnt = self.reader.readinto(buf)
+      self.pos += cnt
+      return cnt
+
+   def seek(self, offset, whence=io.SEEK_SET):
+      if whence == io.SEEK_CUR: offset += self.pos
+      if whence == io.SEEK_END or offset < 0:
+         raise io.UnsupportedOperation("zstd streams seek from the start only")
+      if offset < self.pos: self.open()
+      if offset > self.pos: self.pos = self.reader.seek(offset)
+      return self.pos
+
+   def close(self):
+      if self.reader: self.reader.close()
+      io.RawIOBase.close(self)
+
+def open_binary(fname, compression):
+   """ Open a file as a binary stream of its decompressed bytes """
+
+   if compression == 'gzip': return gzip.open(fname, 'rb')
+   if compression == 'bz2': return bz2.open(fname, 'rb')
+   if compression == 'xz': return lzma.open(fname, 'rb')
+   if compression == 'zstd':
+      try:
+         return io.BufferedReader(ZstdStream(fname), READSIZE)
+      except ImportError:
+         logger.error("{}: reading zstd compressed files requires the zstandard package".format(fname))
+         raise
+
+   return open(fname, 'rb', buffering=READSIZE)
+
+class ThreadedStream(io.RawIOBase):
+   """ Raw stream of the blocks of another binary stream, read ahead by a separate thread """
+
+   def __init__(self, stream, size=READSIZE):
+      self.stream = stream
+      self.size = size
+      self.pos = 0
+      self.block = memoryview(b'')
+      self.thread = None
+      self.start()
+
+   def start(self):
+      self.blocks = queue.Queue(READQSIZE)
+      self.stop = threading.Event()
+      self.thread = threading.Thread(target=self.read_blocks, name='ispd-decompress', daemon=True)
+      self.thread.start()
+
+   def read_blocks(self):
+      try:
+         while not self.stop.is_set():
+            block = self.stream.read(self.size)
+            while not self.stop.is_set():
+               try:
+                  self.blocks.put(block, timeout=0.1)
+                  break
+               except queue.Full:
+                  continue
+            if not block: return
+      except Exception as e:
+         self.blocks.put(e)
+
+   def halt(self):
+      if self.thread:
+         self.stop.set()
+         self.thread.join()
+         self.thread = None
+
+   def readable(self):
+      return True
+
+   def seekable(self):
+      return True
+
+   def tell(self):
+      return self.pos
+
+   def readinto(self, buf):
+      if not self.block:
+         if self.thread is None: return 0
+         block = self.blocks.get()
+         if isinstance(block, Exception): raise block
+         if not block:
+            self.thread.join()
+            self.thread = None
+            return 0
+         self.block = memoryview(block)
+      cnt = min(len(buf), len(self.block))
+      buf[:cnt] = self.block[:cnt]
+      self.block = self.block[cnt:]
+      self.pos += cnt
+      return cnt
+
+   def seek(self, offset, whence=io.SEEK_SET):
+      if whence == io.SEEK_CUR: offset += self.pos
+      if whence == io.SEEK_END: raise io.UnsupportedOperation("threaded streams seek from the start only")
+      self.halt()
+      self.pos = self.stream.seek(offset)
+      self.block = memoryview(b'')
+      self.start()
+      return self.pos
+
+   def close(self):
+      self.halt()
+      self.stream.close()
+      io.RawIOBase.close(self)
+
+class TimedStream(io.RawIOBase):
+   """ Raw stream of another binary stream, timing its reads with the context manager of timer() """
+
+   def __init__(self, stream, timer):
+      self.stream = stream
+      self.timer = timer
+
+   def readable(self):
+      return True
+
+   def seekable(self):
+      return True
+
+   def tell(self):
+      return self.stream.tell()
+
+   def readinto(self, buf):
+      with self.timer():
+         return self.stream.readinto(buf)
+
+   def seek(self, offset, whence=io.SEEK_SET):
+      return self.stream.seek(offset, whence)
+
+   def close(self):
+      self.stream.close()
+      io.RawIOBase.close(self)
+
+class MappedFile:
+   """ Memory-mapped plain ISPD file, with the file methods the fill uses to resume """
+
+   def __init__(self, fname):
+      self.fname = fname
+      with open(fname, 'rb') as fh:
+         self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      self.pos = 0
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def seek(self, offset):
+      self.pos = offset
+      return offset
+
+   def tell(self):
+      return self.pos
+
+   def read(self, size=-1):
+      end = len(self.mm) if size < 0 else min(self.pos + size, len(self.mm))
+      data = self.mm[self.pos:end].decode('latin_1')
+      self.pos = end
+      return data
+
+   def readline(self):
+      end = self.mm.find(b'\n', self.pos)
+      return self.read(end + 1 - self.pos if end >= 0 else -1)
+
+   def close(self):
+      try:
+         self.mm.close()
+      except BufferError:
+         pass    # date blocks not parsed yet still refer to the map; it is closed when they are freed
+
+class MappedLines:
+   """ Lines of a date block of a MappedFile, decoded when the parser first reads them """
+
+   def __init__(self, view):
+      self.view = view
+      self.decoded = None
+
+   @property
+   def lines(self):
+      if self.decoded is None:
+         text = str(self.view, 'latin_1')
+         self.view.release()
+         if '\r' in text: text = text.replace('\r\n', '\n')
+         lines = text.split('\n')
+         last = lines.pop()
+         self.decoded = [line + '\n' for line in lines]
+         if last: self.decoded.append(last)
+      return self.decoded
+
+   def chunks(self, count):
+      """ Yield the lines in lists of up to count lines, decoding READSIZE bytes of the view at a time """
+
+      if self.decoded is not None:
+         for start in range(0, len(self.decoded), count): yield self.decoded[start:start+count]
+         return
+
+      view = self.view
+      lines = []
+      carry = ''
+      for start in range(0, len(view), READSIZE):
+         text = carry + str(view[start:start+READSIZE], 'latin_1')
+         if '\r' in text: text = text.replace('\r\n', '\n')
+         parts = text.split('\n')
+         carry = parts.pop()
+         lines.extend([part + '\n' for part in parts])
+         while len(lines) >= count:
+            yield lines[0:count]
+            del lines[0:count]
+      if carry: lines.append(carry)
+      view.release()
+      for start in range(0, len(lines), count): yield lines[start:start+count]
+
+   def __len__(self):
+      return len(self.lines)
+
+   def __iter__(self):
+      return iter(self.lines)
+
+   def __getitem__(self, idx):
+      return self.lines[idx]
+
+def open_ispd_file(fname, threaded=False, mapped=False, timer=None):
+   """
+   Open an ISPD ASCII file, compressed or not, as a latin_1 text stream; with threaded,
+   the file is read and decompressed on a separate thread; with mapped, a plain file
+   is memory-mapped instead; an HDF5 file is opened as an ispd_hdf5.HDF5Reader;
+   timer, if given, returns a context manager that times each read of the stream
+   """
+
+   if is_hdf5_file(fname):
+      try:
+         from .ispd_hdf5 import HDF5Reader
+      except ImportError:
+         logger.error("{}: reading HDF5 files requires the h5py package".format(fname))
+         raise
+      return HDF5Reader(fname)
+
+   compression = detect_compression(fname)
+   if mapped and not compression and os.path.getsize(fname):
+      return MappedFile(fname)
+   if compression: logger.debug("{}: reading {} compressed input".format(fname, compression))
+   stream = open_binary(fname, compression)
+   if threaded: stream = io.BufferedReader(ThreadedStream(stream), READSIZE)
+   if timer: stream = io.BufferedReader(TimedStream(stream, timer), READSIZE)
+   fh = io.TextIOWrapper(stream, encoding='latin_1')
+   fh._CHUNK_SIZE = READSIZE    # decode large blocks rather than the default 8 KB
+
+   return fh
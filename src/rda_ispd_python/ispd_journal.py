@@ -0,0 +1,68 @@
+"""
+Checkpoint journal of an ISPDDB fill: an append-only file of JSON lines, one
+per committed batch of dates, recording where each input file can be resumed
+and the record indices and inventory state at that point.  A batch that ends
+within a date spilled to disk records the start of that date and the record
+index of its last record committed (partiidx), so the date is resumed after it.
+"""
+
+import json
+import os
+
+import logging
+logger = logging.getLogger(__name__)
+
+class CheckpointJournal:
+   """ Latest checkpoint of each input file, read from and appended to a journal file """
+
+   def __init__(self, path):
+      self.path = path
+      self.entries = {}    # absolute file name: latest entry
+      if os.path.exists(path):
+         with open(path, 'r') as fh:
+            for line in fh:
+               try:
+                  entry = json.loads(line)
+               except ValueError:
+                  logger.warning("{}: skip incomplete journal line".format(path))
+                  continue
+               self.entries[entry['file']] = entry
+      self.fh = open(path, 'a')
+
+   @staticmethod
+   def key(fname):
+      return os.path.abspath(fname)
+
+   def last(self, fname):
+      """ Return the latest entry of a file, None if the file has none """
+
+      return self.entries.get(self.key(fname))
+
+   def write(self, entry):
+      """ Append an entry and force it to disk, so it survives a crash right after the commit """
+
+      entry['file'] = self.key(entry['file'])
+      self.entries[entry['file']] = entry
+      self.fh.write(json.dumps(entry, default=str) + '\n')
+      self.fh.flush()
+      os.fsync(self.fh.fileno())
+
+   def record(self, fname, state):
+      """ Record the state after the last committed date of a file """
+
+      entry = dict(state)
+      entry.update({'file': fname, 'status': 'partial'})
+      self.write(entry)
+
+   def reserve(self, fname):
+      """ Record that inventory was reserved for a whole file, by a parallel fill """
+
+      self.write({'file': fname, 'status': 'reserved'})
+
+   def finish(self, fname):
+      """ Record that a file is loaded completely """
+
+      self.write({'file': fname, 'status': 'done'})
+
+   def close(self):
+      self.fh.close()
@@ -0,0 +1,122 @@
+"""
+Load manifest of ISPDDB fills: a SQLite file recording the size, modification
+time and content checksum of each input file loaded, with the checksum and
+line count of each of its dates.  A fill with a manifest skips the files that
+are unchanged since they were loaded, told by their size and modification
+time alone, and reloads only the dates of a changed file whose contents
+changed, after deleting the records loaded before for those dates.  A date
+with records skipped by the duplicate filter is recorded without a checksum,
+and its file without a signature, so a later fill reloads it.  The dates of a
+file are checksummed as for its day index, which is used instead if it is current.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+
+from .ispd_cache import file_hash
+from .ispd_dayindex import file_signature, load_day_index, scan_mapped_days, scan_stream_days
+from .ispd_io import detect_compression, is_hdf5_file
+
+import logging
+logger = logging.getLogger(__name__)
+
+MANIFESTDDL = ["CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+               "checksum TEXT, dates INTEGER, lines INTEGER, loaded TEXT)",
+               "CREATE TABLE IF NOT EXISTS days (file TEXT, date TEXT, checksum TEXT, lines INTEGER, "
+               "PRIMARY KEY (file, date))"]
+
+def scan_file_days(fname):
+   """
+   Return the content checksum of a file and the {date: (checksum, lines)} of its dates, the
+   checksums of the runs of a date combined; an HDF5 file has a checksum of its bytes and no dates
+   """
+
+   if is_hdf5_file(fname): return file_hash(fname), None
+
+   index = load_day_index(fname)
+   runs = index.days if index else scan_stream_days(fname) if detect_compression(fname) else scan_mapped_days(fname)
+   checksums = {}
+   lines = {}
+   for run in runs:
+      checksums.setdefault(run['date'], []).append(run['checksum'])
+      lines[run['date']] = lines.get(run['date'], 0) + run['lines']
+   digest = hashlib.sha1(' '.join(run['checksum'] for run in runs).encode()).hexdigest()
+   days = {cdate: (sums[0] if len(sums) == 1 else hashlib.sha1(' '.join(sums).encode()).hexdigest(), lines[cdate])
+           for cdate, sums in checksums.items()}
+
+   return digest, days
+
+class LoadManifest:
+   """ Files and dates loaded into ISPDDB, and the pending state of the files being filled """
+
+   def __init__(self, path):
+      self.path = path
+      self.db = sqlite3.connect(path)
+      for ddl in MANIFESTDDL: self.db.execute(ddl)
+      self.db.commit()
+      self.pending = {}    # absolute file name: (signature, checksum, days) to record once it is loaded
+
+   @staticmethod
+   def key(fname):
+      return os.path.abspath(fname)
+
+   def get_file(self, key):
+      row = self.db.execute("SELECT size, mtime, checksum FROM files WHERE file = ?", (key,)).fetchone()
+      return {'size': row[0], 'mtime': row[1], 'checksum': row[2]} if row else None
+
+   def get_days(self, key):
+      return {row[0]: row[1] for row in self.db.execute("SELECT date, checksum FROM days WHERE file = ?", (key,))}
+
+   def plan(self, fname):
+      """
+      Return {'status': 'new', 'unchanged' or 'changed', 'dates': changed dates to reload,
+      'removed': dates loaded that the file no longer has} of a file; the dates of a
+      changed HDF5 file are None, it is reloaded whole
+      """
+
+      key = self.key(fname)
+      entry = self.get_file(key)
+      signature = file_signature(fname)
+      if entry and entry['size'] == signature['size'] and entry['mtime'] == signature['mtime']:
+         return {'status': 'unchanged', 'dates': [], 'removed': []}
+
+      checksum, days = scan_file_days(fname)
+      self.pending[key] = (signature, checksum, days)
+      if not entry: return {'status': 'new', 'dates': None, 'removed': []}
+      if checksum == entry['checksum']:
+         self.commit(fname)    # touched only, record its new modification time
+         return {'status': 'unchanged', 'dates': [], 'removed': []}
+      if days is None: return {'status': 'changed', 'dates': None, 'removed': []}
+
+      loaded = self.get_days(key)
+      return {'status': 'changed', 'dates': sorted(cdate for cdate in days if loaded.get(cdate) != days[cdate][0]),
+              'removed': sorted(set(loaded) - set(days))}
+
+   def commit(self, fname, skipped=()):
+      """
+      Record the pending state of a file once it is loaded; the dates in skipped had records
+      skipped as already loaded, and are recorded as not loaded, with their file as changed
+      """
+
+      key = self.key(fname)
+      if key not in self.pending: return
+      signature, checksum, days = self.pending.pop(key)
+      days = days or {}
+      if skipped:
+         logger.info("{}: dates {} with records skipped as already loaded, not recorded in the manifest".format(
+                     fname, ', '.join(sorted(skipped))))
+         signature = {'size': None, 'mtime': None}
+         checksum = None
+      with self.db:
+         self.db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (key, signature['size'], signature['mtime'], checksum, len(days),
+                          sum(count for digest, count in days.values()), time.strftime('%Y-%m-%dT%H:%M:%S')))
+         self.db.execute("DELETE FROM days WHERE file = ?", (key,))
+         self.db.executemany("INSERT INTO days VALUES (?, ?, ?, ?)",
+                             [(key, cdate, (None if cdate in skipped else digest), count)
+                              for cdate, (digest, count) in sorted(days.items())])
+
+   def close(self):
+      self.db.close()
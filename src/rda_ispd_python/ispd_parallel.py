@@ -0,0 +1,90 @@
+"""
+Parallel fill of several ISPD files with a pool of worker processes.  The
+inventory records of all the date blocks are reserved up front, in the order
+a serial run adds them, so the iidx/tidx numbering is the same as serial.
+"""
+
+import multiprocessing
+
+from .ispd_common import *
+from .ispd_io import open_ispd_file
+from .ispd_dayindex import load_day_index
+
+import logging
+logger = logging.getLogger(__name__)
+
+FILLER = None     # FillISPD object of a worker process
+
+def scan_ispd_file(fname, selection=None):
+   """ Return the (date, record count) of each block of lines in an ISPD file, or of its selected dates """
+
+   if selection:
+      index = load_day_index(fname)
+      if index and index.plain:    # read by the worker from the same index
+         return [(day['date'], day['lines']) for day in index.select(selection)]
+
+   with open_ispd_file(fname, mapped=True) as fh:
+      return [(cdate, lines.counts()[UIDIDX] if isinstance(lines, DayBuffer) else len(lines))
+              for cdate, lines in get_ispd_blocks(fh) if not selection or cdate in selection]
+
+def reserve_file_indices(files, add_inventory, selection=None):
+   """
+   Scan the files and, if add_inventory, reserve the inventory records of all
+   their date blocks, or of their selected dates, in one transaction; return the reserved records per file
+   and create the table partitions the workers need
+   """
+
+   reserved = {}
+   tidxs = set()
+   if add_inventory: get_sink().start_transaction()
+   for fname in files:
+      blocks = scan_ispd_file(fname, selection)
+      if add_inventory:
+         reserved[fname] = reserve_inventory_records(fname, blocks)
+         tidxs.update(record['tidx'] for record in reserved[fname])
+      else:
+         reserved[fname] = None
+         tidxs.update(date2tidx(cdate) for cdate, count in blocks)
+      logger.info("{}: {} date blocks scanned".format(fname, len(blocks)))
+   if add_inventory: get_sink().end_transaction()
+   for fname in files: reserve_checkpoint(fname)
+
+   for tidx in sorted(tidxs):
+      for aname in ISPD_NAMES:
+         check_partition(aname, str(tidx))
+
+   return reserved
+
+def init_worker(options):
+   """ Set up a worker process with its own database connection """
+
+   global FILLER
+   from .ispddb import FillISPD
+
+   get_sink().detach()    # drop the connection inherited from the parent without closing it
+   FILLER = FillISPD(**options)
+   FILLER.initialize_db()
+   FILLER.initialize_indices()
+
+def fill_worker(task):
+   """ Fill one file in a worker process with its reserved inventory records; return its counts and stats """
+
+   fname, reserved = task
+   acnts = FILLER.process_ispd_file(fname, reserved)
+   return acnts, FILLER.file_stats
+
+def fill_files_parallel(filler, files, jobs):
+   """ Fill the files with jobs worker processes; return the total counts per table """
+
+   reserved = reserve_file_indices(files, filler.add_inventory, filler.selection)
+   get_sink().disconnect()
+
+   tcounts = [0]*TABLECOUNT
+   tasks = [(fname, reserved[fname]) for fname in files]
+   with multiprocessing.Pool(jobs, init_worker, (filler.get_options(),)) as pool:
+      for (fname, reserved), (acnts, fstats) in zip(tasks, pool.imap(fill_worker, tasks)):
+         for i in range(TABLECOUNT): tcounts[i] += acnts[i]
+         merge_file_stats(fname, fstats)
+         if filler.load_manifest: filler.load_manifest.commit(fname)
+
+   return tcounts
@@ -0,0 +1,159 @@
+"""
+Pipelined fill of one ISPD file: a reader thread yields date blocks, a parser
+thread builds the day buffers and a writer thread loads them, with bounded
+queues between the stages.  The writer handles the date blocks strictly in
+file order, so inventory records and record indices are assigned as in a
+serial run.  With a memory budget, the date blocks held in the queues are
+counted against it as well.
+"""
+
+import os
+import queue
+import threading
+import time
+
+from .ispd_common import *
+from . import ispd_common
+
+import logging
+logger = logging.getLogger(__name__)
+
+class PipelineStage(threading.Thread):
+   """ Pipeline thread that feeds its results to an output queue and records the time it is busy """
+
+   def __init__(self, name, pipeline, inqueue, outqueue, action):
+      threading.Thread.__init__(self, name=name, daemon=True)
+      self.pipeline = pipeline
+      self.inqueue = inqueue
+      self.outqueue = outqueue
+      self.action = action
+      self.busy = 0.0
+
+   def run(self):
+      try:
+         for item in self.items():
+            start = time.perf_counter()
+            result = self.action(item)
+            self.busy += time.perf_counter() - start
+            if self.outqueue is not None: self.pipeline.put(self.outqueue, result, self.inqueue is None)
+      except Exception as e:
+         self.pipeline.fail(e)
+      if self.outqueue is not None: self.pipeline.put(self.outqueue, None)
+
+   def items(self):
+      while not self.pipeline.stop.is_set():
+         try:
+            item = self.inqueue.get(timeout=0.1)
+         except queue.Empty:
+            continue
+         if item is None: return
+         self.pipeline.taken(item)
+         yield item
+
+class ReaderStage(PipelineStage):
+   """ First stage: its items are the date blocks of the input file """
+
+   def __init__(self, name, pipeline, blocks, outqueue):
+      PipelineStage.__init__(self, name, pipeline, None, outqueue, lambda item: item)
+      self.blocks = blocks
+
+   def items(self):
+      blocks = self.blocks
+      while not self.pipeline.stop.is_set():
+         start = time.perf_counter()
+         item = next(blocks, None)
+         self.busy += time.perf_counter() - start
+         if item is None: return
+         yield item
+
+class FillPipeline:
+   """ Reader, parser and writer stages for one file """
+
+   def __init__(self, filler, blocks, fname, reserved=None):
+      self.filler = filler
+      self.fname = fname
+      self.reserved = reserved
+      self.stop = threading.Event()
+      self.errors = []
+      self.acounts = [0]*TABLECOUNT
+      self.queued = 0    # bytes of the date blocks in the queues, held within MEMBUDGET
+      self.space = threading.Condition()
+      bqueue = queue.Queue(PIPEQSIZE)
+      days = queue.Queue(PIPEQSIZE)
+      self.stages = [ReaderStage('ispd-reader', self, blocks, bqueue),
+                     PipelineStage('ispd-parser', self, bqueue, days, self.parse),
+                     PipelineStage('ispd-writer', self, days, None, self.write)]
+
+   @staticmethod
+   def item_bytes(item):
+      """ Return the bytes in memory of a queued item, the lines of a date block or the records of a parsed date """
+
+      if item is None: return 0
+      return block_bytes(item[1][1] if len(item) == 2 else item[2])
+
+   def put(self, outqueue, item, bounded=False):
+      """
+      Queue an item once its queue has room for it; a bounded put, of a new date block
+      by the reader, also waits until the queued blocks leave room for it in MEMBUDGET
+      """
+
+      budget = ispd_common.MEMBUDGET
+      nbytes = self.item_bytes(item) if budget else 0
+      with self.space:
+         # a block over the budget on its own is queued once the queues are empty; the parser
+         # never waits here, since the blocks queued ahead of it are only freed by itself
+         while bounded and nbytes and self.queued and self.queued + nbytes > budget and not self.stop.is_set():
+            self.space.wait(0.1)
+         self.queued += nbytes
+         note_buffer_bytes(self.queued)
+      while not self.stop.is_set():
+         try:
+            outqueue.put(item, timeout=0.1)
+            return
+         except queue.Full:
+            continue
+
+   def taken(self, item):
+      """ Release the bytes of an item taken from a queue """
+
+      nbytes = self.item_bytes(item) if ispd_common.MEMBUDGET else 0
+      if not nbytes: return
+      with self.space:
+         self.queued -= nbytes
+         self.space.notify_all()
+
+   def fail(self, error):
+      self.errors.append(error)
+      self.stop.set()
+
+   def parse(self, item):
+      bidx, (cdate, lines, end) = item
+      return (bidx, cdate, self.filler.get_date_records(cdate, lines), end)
+
+   def write(self, item):
+      bidx, cdate, records, end = item
+      reserved = self.reserved[bidx] if self.reserved else None
+      acnts = self.filler.add_date_records(cdate, records, self.fname, reserved, (bidx, end))
+      for i in range(TABLECOUNT): self.acounts[i] += acnts[i]
+
+   def run(self):
+      start = time.perf_counter()
+      for stage in self.stages: stage.start()
+      for stage in self.stages: stage.join()
+      if self.errors: raise self.errors[0]
+
+      wall = time.perf_counter() - start
+      read, parse, write = [stage.busy for stage in self.stages]
+      hidden = min(parse, max(0.0, read + parse + write - wall))
+      logger.info("{}: read {:.2f}s, parse {:.2f}s, write {:.2f}s in {:.2f}s; {:.2f}s of parsing hidden behind writing".format(
+                  os.path.basename(self.fname), read, parse, write, wall, hidden))
+
+      return self.acounts
+
+def fill_file_pipelined(filler, blocks, fname, reserved=None):
+   """
+   Fill the records of an open ISPD file through the reader/parser/writer pipeline;
+   blocks iterates (block index, (date, lines, end offset)) of the file
+   """
+
+   return FillPipeline(filler, blocks, fname, reserved).run()
@@ -0,0 +1,201 @@
+"""
+Concurrent loading of the ISPD tables over a pool of database connections.
+The tables of one date are loaded in parallel on separate connections and
+committed once all of them are loaded.  With two-phase commit, which needs
+max_prepared_transactions > 0 on the server, a date is either loaded into all
+of its tables or into none.
+"""
+
+import contextlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import PgLOG
+import PgDBI
+
+from .ispddb_config import *
+from .ispd_copy import copy_records
+
+import logging
+logger = logging.getLogger(__name__)
+
+def pool_connect():
+   """ Open a new connection with the settings of the PgDBI connection """
+
+   # PgDBI.pgconnect() keeps its connection in a module global; borrow it to open
+   # one more connection with the same settings and retries, then restore it
+   pgdb = PgDBI.pgdb
+   PgDBI.pgdb = None
+   try:
+      conn = PgDBI.pgconnect(0, 0, False)
+   finally:
+      PgDBI.pgdb = pgdb
+      PgLOG.PGLOG['PGDBBUF'] = pgdb
+   if not conn:
+      logger.error("Cannot open a pooled connection to {}".format(PgDBI.PGDBI['DBNAME']))
+      return None
+
+   pgcur = conn.cursor()
+   pgcur.execute("SET search_path = '{}'".format(PgDBI.PGDBI['SCNAME']))
+   pgcur.close()
+   conn.commit()
+
+   return conn
+
+def insert_records(pgcur, table, records):
+   """ Insert all the rows of records with multi-row INSERT statements on an open cursor """
+
+   from psycopg2.extras import execute_values
+
+   if hasattr(records, 'to_records'): records = records.to_records()
+   fields = list(records)
+   values = list(zip(*records.values()))
+   execute_values(pgcur, "INSERT INTO {} ({}) VALUES %s".format(table, ','.join(fields)), values,
+                  page_size=PgDBI.PGDBI['PGSIZE'])
+
+   return len(values)
+
+class PoolWriter:
+   """
+   Load the tables of each date concurrently over size connections; up to
+   size//TABLECOUNT dates are in flight at a time; the loads are added to the
+   ispd_stats.IngestStats stats, if given.  A date holds a connection per table
+   until all of its tables are prepared, so size is at least TABLECOUNT
+   """
+
+   def __init__(self, size, load_method='insert', twophase=False, stats=None):
+      if size < TABLECOUNT:
+         logger.warning("{} pooled connections cannot load the {} tables of a date together, {} opened".format(
+                        size, TABLECOUNT, TABLECOUNT))
+         size = TABLECOUNT
+      self.size = size
+      self.load_method = load_method
+      self.twophase = twophase
+      self.stats = stats
+      self.conns = queue.Queue()
+      for i in range(size):
+         self.conns.put(pool_connect())
+      self.tables = ThreadPoolExecutor(size, thread_name_prefix='ispd-table')
+      self.days = ThreadPoolExecutor(size//TABLECOUNT, thread_name_prefix='ispd-day')
+      self.inflight = threading.Semaphore(size//TABLECOUNT)
+      self.futures = []
+      self.xidcnt = 0
+      self.lock = threading.Lock()
+
+   def execute(self, sqlstr):
+      """
+      Run one statement on a pooled connection and commit it; tables are created
+      so, since the pooled connections cannot see those created in the open
+      transaction of the PgDBI connection
+      """
+
+      conn = self.conns.get()
+      try:
+         pgcur = conn.cursor()
+         pgcur.execute(sqlstr)
+         pgcur.close()
+         conn.commit()
+         if self.stats: self.stats.add_call('create_partition')
+      except Exception:
+         conn.rollback()
+         raise
+      finally:
+         self.conns.put(conn)
+
+   def next_xid(self, conn, cdate, aname):
+      with self.lock:
+         self.xidcnt += 1
+         return conn.xid(0, "ispd-{}-{}-{}-{}".format(os.getpid(), self.xidcnt, cdate, aname), "ispddb")
+
+   def load_table(self, cdate, aname, table, parts):
+      """ Load the record parts of one table in an open transaction; return its connection and row count """
+
+      conn = self.conns.get()
+      try:
+         if self.twophase: conn.tpc_begin(self.next_xid(conn, cdate, aname))
+         pgcur = conn.cursor()
+         cnt = 0
+         start = time.perf_counter()
+         with (self.stats.timer('insert') if self.stats else contextlib.nullcontext()):
+            for records in parts:
+               if self.load_method == 'copy':
+                  cnt += copy_records(pgcur, table, records)
+               else:
+                  cnt += insert_records(pgcur, table, records)
+               if self.stats: self.stats.add_call('add_records')
+         if self.stats: self.stats.add_load(aname, cnt, time.perf_counter() - start)
+         pgcur.close()
+         if self.twophase: conn.tpc_prepare()
+      except Exception:
+         self.release(conn, False)
+         raise
+
+      return conn, cnt
+
+   def release(self, conn, commit):
+      """ End the transaction of a connection and put it back in the pool """
+
+      try:
+         if self.twophase and conn.status == PgDBI.PgSQL.extensions.STATUS_PREPARED:
+            conn.tpc_commit() if commit else conn.tpc_rollback()
+         else:
+            conn.commit() if commit else conn.rollback()
+      finally:
+         self.conns.put(conn)
+
+   def load_day(self, cdate, tables):
+      """ Load the tables of one date concurrently and commit them together """
+
+      try:
+         futures = [self.tables.submit(self.load_table, cdate, aname, table, parts)
+                    for aname, table, parts in tables]
+         results = []
+         error = None
+         for future in futures:
+            try:
+               results.append(future.result())
+            except Exception as e:
+               error = error or e
+         for conn, cnt in results:
+            self.release(conn, error is None)
+         if error: raise error
+         for (aname, table, parts), (conn, cnt) in zip(tables, results):
+            ess = 's' if cnt > 1 else ''
+            # with stats, the loads of each table are summarized by them instead
+            (logger.debug if self.stats else logger.info)("{}: {} record{} added to {}".format(cdate, cnt, ess, table))
+      finally:
+         self.inflight.release()
+
+   def submit_day(self, cdate, tables):
+      """
+      Queue the loading of one date; tables is a list of (table name, partition, record parts).
+      Blocks while the maximum number of dates are in flight
+      """
+
+      self.inflight.acquire()
+      self.futures.append(self.days.submit(self.load_day, cdate, tables))
+      self.check(False)
+
+   def check(self, wait):
+      """ Raise the error of a failed date; with wait, block until all queued dates are done """
+
+      pending = []
+      for future in self.futures:
+         if wait or future.done():
+            future.result()
+         else:
+            pending.append(future)
+      self.futures = pending
+
+   def wait(self):
+      self.check(True)
+
+   def close(self):
+      self.wait()
+      self.days.shutdown()
+      self.tables.shutdown()
+      while not self.conns.empty():
+         self.conns.get().close()
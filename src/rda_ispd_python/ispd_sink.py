@@ -0,0 +1,486 @@
+"""
+Output sinks of an ISPDDB fill.  A sink receives the ISPD records, the
+inventory records and the control table upserts, and answers the queries the
+fill makes for existing tables and records.  PgSink is the ISPDDB over PgDBI;
+SQLiteSink loads a local SQLite database, NullSink only counts the records and
+FileSink writes COPY text files per table partition with an SQL script of the
+inventory and control records, to be loaded elsewhere.
+"""
+
+import abc
+import os
+import sqlite3
+
+import PgLOG
+import PgDBI
+
+from .ispddb_config import *
+from .ispd_buffer import TableBuffer
+from .ispd_copy import COPY_SIZE, CopyStream, copy_records_to_table
+
+import logging
+logger = logging.getLogger(__name__)
+
+def sql_value(val):
+   """ Format a value as an SQL literal """
+
+   if val is None:
+      return 'NULL'
+   elif isinstance(val, str):
+      return "'{}'".format(val.replace("'", "''"))
+   else:
+      return str(val)
+
+def partition_statement(table, template, columns):
+   """ Return the SQL creating table like table template or with the SQL column definitions, None with neither """
+
+   if template:
+      return "CREATE TABLE IF NOT EXISTS {} (LIKE {} INCLUDING ALL)".format(table, template)
+   elif columns:
+      return "CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns)
+   else:
+      return None
+
+def upsert_statements(table, fields, rows, keys, updates):
+   """ Yield multi-row INSERT ... ON CONFLICT DO UPDATE statements of CNTLBATCH rows each """
+
+   for i in range(0, len(rows), CNTLBATCH):
+      values = ', '.join(["({})".format(', '.join(map(sql_value, row))) for row in rows[i:i+CNTLBATCH]])
+      yield "INSERT INTO {} ({}) VALUES {} ON CONFLICT ({}) DO UPDATE SET {}".format(
+            table, ', '.join(fields), values, ', '.join(keys), updates)
+
+def column_records(records):
+   """ Return records, a TableBuffer or a dict of value lists, as a dict of value lists """
+
+   return records.to_records() if isinstance(records, TableBuffer) else records
+
+class ISPDSink(abc.ABC):
+   """
+   Base of the sinks, with the defaults of a sink that has no connection and no
+   transactions; conditions (cnd) and update expressions are SQL as for PgDBI
+   """
+
+   name = None
+   concurrent = False    # True if pooled writers and parallel worker processes can write to it
+   schema = None         # default schema, stripped from the cached partition names
+
+   def connect(self):
+      pass
+
+   def close(self):
+      pass
+
+   def detach(self):
+      """ Drop a connection inherited by a worker process without closing it """
+      pass
+
+   def disconnect(self):
+      pass
+
+   @property
+   def max_records(self):
+      """ records per tidx partition """
+      return PgDBI.PGDBI['MAXICNT']
+
+   @property
+   def in_transaction(self):
+      return False
+
+   def start_transaction(self):
+      pass
+
+   def end_transaction(self):
+      pass
+
+   @abc.abstractmethod
+   def table_names(self, schemas):
+      """ Return the names of the existing tables, qualified by schema """
+
+   @abc.abstractmethod
+   def create_partition(self, table, tname, suffix, template, columns):
+      """ Create table, partition suffix of tname, like table template or with the SQL column definitions """
+
+   @abc.abstractmethod
+   def get_records(self, table, fields, cnd):
+      """ Return the records of a query as a list of dicts """
+
+   @abc.abstractmethod
+   def add_record(self, table, record):
+      """ Add one record; return its auto-generated id """
+
+   @abc.abstractmethod
+   def update_record(self, table, record, cnd):
+      """ Update the records matching cnd with the fields of record; return the row count """
+
+   @abc.abstractmethod
+   def add_records(self, table, records):
+      """ Add all the rows of records, a TableBuffer or a dict of value lists; return the row count """
+
+   @abc.abstractmethod
+   def upsert_records(self, table, fields, rows, keys, updates):
+      """ Insert rows, tuples of fields, updating the rows that conflict on keys with the SQL updates """
+
+   @abc.abstractmethod
+   def delete_records(self, table, cnd):
+      """ Delete the rows of table matching cnd; return the row count """
+
+class PgSink(ISPDSink):
+   """ The ISPDDB PostgreSQL database over the PgDBI connection """
+
+   name = 'postgres'
+   concurrent = True
+
+   def __init__(self, path=None, load_method='insert'):
+      self.load_method = load_method
+      self.mtrans = None    # PGDBI['MTRANS'] suspended while a transaction is open
+
+   def connect(self):
+      PgDBI.ispddb_dbname()
+
+   def close(self):
+      PgLOG.pgexit()
+
+   def detach(self):
+      PgDBI.pgdisconnect(0)
+
+   def disconnect(self):
+      PgDBI.pgdisconnect()
+
+   @property
+   def schema(self):
+      return PgDBI.PGDBI['SCNAME']
+
+   @property
+   def in_transaction(self):
+      return bool(PgDBI.curtran)
+
+   def start_transaction(self):
+      # PgDBI commits a transaction part way once it holds over MTRANS changes; the
+      # transactions of a fill, a batch of dates with their inventory records, commit whole
+      if self.mtrans is None:
+         self.mtrans = PgDBI.PGDBI['MTRANS']
+         PgDBI.PGDBI['MTRANS'] = float('inf')
+      PgDBI.starttran()
+
+   def end_transaction(self):
+      PgDBI.endtran()
+      if self.mtrans is not None:
+         PgDBI.PGDBI['MTRANS'] = self.mtrans
+         self.mtrans = None
+
+   def table_names(self, schemas):
+      cnd = "table_schema IN ('{}')".format("', '".join(set(schemas)))
+      pgrecs = PgDBI.pgmget('information_schema.tables', 'table_schema, table_name', cnd, PgLOG.LGEREX)
+      if not pgrecs: return set()
+
+      return {"{}.{}".format(scname, tbname) for scname, tbname in zip(pgrecs['table_schema'], pgrecs['table_name'])}
+
+   def create_partition(self, table, tname, suffix, template, columns):
+      sqlstr = partition_statement(table, template, columns)
+      if sqlstr:
+         PgDBI.pgexec(sqlstr, PgLOG.LGEREX)
+      else:
+         pgcmd = PgDBI.get_pgddl_command(tname)
+         PgLOG.pgsystem("{} -x {}".format(pgcmd, suffix), PgLOG.LGWNEX)
+
+   def get_records(self, table, fields, cnd):
+      pgrecs = PgDBI.pgmget(table, fields, cnd, PgLOG.LGEREX)
+      if not pgrecs: return []
+      fnames = list(pgrecs)
+
+      return [dict(zip(fnames, vals)) for vals in zip(*pgrecs.values())]
+
+   def add_record(self, table, record):
+      return PgDBI.pgadd(table, record, PgLOG.LGEREX|PgLOG.AUTOID)
+
+   def update_record(self, table, record, cnd):
+      return PgDBI.pgupdt(table, record, cnd, PgLOG.LGEREX)
+
+   def add_records(self, table, records):
+      if self.load_method == 'copy':
+         return copy_records_to_table(table, records, PgLOG.LGEREX)
+
+      return PgDBI.pgmadd(table, column_records(records), PgLOG.LGEREX)
+
+   def upsert_records(self, table, fields, rows, keys, updates):
+      cnt = 0
+      for sqlstr in upsert_statements(table, fields, rows, keys, updates):
+         cnt += PgDBI.pgexec(sqlstr, PgLOG.LGEREX)
+
+      return cnt
+
+   def delete_records(self, table, cnd):
+      return PgDBI.pgdel(table, cnd, PgLOG.LGEREX)
+
+# SQL column definitions of the tables a SQLite database is set up with, or that have no template
+SQLITE_TABLES = {
+   DBCNTL + '.ispd_inventory': "didx integer PRIMARY KEY AUTOINCREMENT, date date, fname varchar(255), count integer, "
+                               "tidx integer, tcount integer, miniidx integer, maxiidx integer",
+   CNTLSCHEMA + '.iattm': "attm varchar(20), tidx integer, count integer, PRIMARY KEY (attm, tidx)",
+   CNTLSCHEMA + '.iattm_daily': "date date, tidx integer, attm varchar(20), count integer, PRIMARY KEY (attm, date)",
+   CNTLSCHEMA + '.itidx': "suid varchar(4) PRIMARY KEY, date date, tidx integer, iidx integer"
+}
+
+class SQLiteSink(ISPDSink):
+   """
+   Local SQLite database at path; the ISPD tables are in its main database and the
+   tables of the DBCNTL and CNTLSCHEMA schemas in attached <path>.<schema>.sqlite files
+   """
+
+   name = 'sqlite'
+
+   def __init__(self, path=None, load_method=None):
+      self.path = path or 'ispddb.sqlite'
+      self.conn = None
+
+   def connect(self):
+      # the pipeline writes from its writer thread, one thread at a time
+      self.conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+      for scname in sorted({DBCNTL, CNTLSCHEMA}):
+         spath = ':memory:' if self.path == ':memory:' else "{}.{}.sqlite".format(os.path.splitext(self.path)[0], scname)
+         self.conn.execute("ATTACH DATABASE ? AS {}".format(scname), (spath,))
+      for table in SQLITE_TABLES:
+         # itidx only holds the columns of its itidx_<xx> partitions, one per first two characters
+         # of the uids, created by create_partition as they are written; the parent is never written
+         if not table.endswith('.itidx'):
+            self.conn.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, SQLITE_TABLES[table]))
+
+   def close(self):
+      if self.conn:
+         if self.conn.in_transaction: self.conn.execute("COMMIT")
+         self.conn.close()
+         self.conn = None
+
+   @property
+   def in_transaction(self):
+      return self.conn.in_transaction
+
+   def start_transaction(self):
+      if not self.conn.in_transaction: self.conn.execute("BEGIN")
+
+   def end_transaction(self):
+      if self.conn.in_transaction: self.conn.execute("COMMIT")
+
+   def execute(self, sqlstr, params=()):
+      """ Execute a statement, in a transaction of its own if none is open """
+
+      if self.conn.in_transaction: return self.conn.execute(sqlstr, params)
+      with self.conn:
+         self.conn.execute("BEGIN")
+         return self.conn.execute(sqlstr, params)
+
+   def table_names(self, schemas):
+      names = set()
+      for seq, scname, fname in self.conn.execute("PRAGMA database_list").fetchall():
+         for (tbname,) in self.conn.execute("SELECT name FROM {}.sqlite_master WHERE type = 'table'".format(scname)):
+            names.add(tbname if scname == 'main' else "{}.{}".format(scname, tbname))
+
+      return names
+
+   def create_partition(self, table, tname, suffix, template, columns):
+      if template:
+         scname, tbname = template.split('.', 1) if '.' in template else ('main', template)
+         sqlstr = self.conn.execute("SELECT sql FROM {}.sqlite_master WHERE name = ?".format(scname), (tbname,)).fetchone()[0]
+         columns = sqlstr[sqlstr.index('(')+1:sqlstr.rindex(')')]
+      elif not columns:
+         columns = SQLITE_TABLES.get(tname)
+      if not columns:
+         logger.error("{}: no table definition for SQLite".format(tname))
+         return
+      self.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns))
+
+   def get_records(self, table, fields, cnd):
+      sqlstr = "SELECT {} FROM {}".format(fields, table)
+      if cnd: sqlstr += " WHERE " + cnd
+      cursor = self.conn.execute(sqlstr)
+      fnames = [desc[0] for desc in cursor.description]
+
+      return [dict(zip(fnames, vals)) for vals in cursor.fetchall()]
+
+   def add_record(self, table, record):
+      fields = list(record)
+      sqlstr = "INSERT INTO {} ({}) VALUES ({})".format(table, ', '.join(fields), ', '.join(['?']*len(fields)))
+
+      return self.execute(sqlstr, [record[field] for field in fields]).lastrowid
+
+   def update_record(self, table, record, cnd):
+      fields = list(record)
+      sqlstr = "UPDATE {} SET {} WHERE {}".format(table, ', '.join(["{} = ?".format(field) for field in fields]), cnd)
+
+      return self.execute(sqlstr, [record[field] for field in fields]).rowcount
+
+   def add_records(self, table, records):
+      records = column_records(records)
+      fields = list(records)
+      rows = list(zip(*records.values()))
+      sqlstr = "INSERT INTO {} ({}) VALUES ({})".format(table, ', '.join(fields), ', '.join(['?']*len(fields)))
+      if self.conn.in_transaction:
+         self.conn.executemany(sqlstr, rows)
+      else:
+         with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(sqlstr, rows)
+
+      return len(rows)
+
+   def upsert_records(self, table, fields, rows, keys, updates):
+      for sqlstr in upsert_statements(table, fields, rows, keys, updates):
+         self.execute(sqlstr)
+
+      return len(rows)
+
+   def delete_records(self, table, cnd):
+      return self.execute("DELETE FROM {} WHERE {}".format(table, cnd)).rowcount
+
+class NullSink(ISPDSink):
+   """ Sink that keeps nothing and only counts the records added to each table, e.g. to time the parsing """
+
+   name = 'null'
+
+   def __init__(self, path=None, load_method=None):
+      self.counts = {}    # table: rows added
+      self.tables = set()
+      self.lastid = 0
+
+   def close(self):
+      for table in sorted(self.counts):
+         logger.info("{}: {} records counted".format(table, self.counts[table]))
+
+   def table_names(self, schemas):
+      return set(self.tables)
+
+   def create_partition(self, table, tname, suffix, template, columns):
+      self.tables.add(table)
+
+   def get_records(self, table, fields, cnd):
+      return []
+
+   def add_record(self, table, record):
+      self.lastid += 1
+      self.counts[table] = self.counts.get(table, 0) + 1
+
+      return self.lastid
+
+   def update_record(self, table, record, cnd):
+      return 1
+
+   def add_records(self, table, records):
+      count = len(records) if isinstance(records, TableBuffer) else len(next(iter(records.values()), []))
+      self.counts[table] = self.counts.get(table, 0) + count
+
+      return count
+
+   def upsert_records(self, table, fields, rows, keys, updates):
+      self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+      return len(rows)
+
+   def delete_records(self, table, cnd):
+      return 0
+
+class FileSink(NullSink):
+   """
+   Sink writing to directory path: the rows of each table partition in COPY text format to
+   <table>.tsv, and the table creations, inventory records, control table upserts and the
+   \\copy commands of the partition files to load.sql, to be run later with psql; the rows
+   deleted before dates are reloaded go to delete.sql, to be run before load.sql.  The keys
+   of the records start over with each fill, so a directory holding a load.sql is refused
+   """
+
+   name = 'file'
+
+   def __init__(self, path=None, load_method=None):
+      NullSink.__init__(self)
+      self.path = path or 'ispddb_load'
+      self.files = {}    # table: open partition file
+      self.script = None
+      self.deletes = None
+
+   def connect(self):
+      # didx, iidx and tidx start over with each fill, so the rows of two fills would collide
+      script = os.path.join(self.path, 'load.sql')
+      if os.path.exists(script) and os.path.getsize(script):
+         logger.error("{}: output of an earlier fill, load it and remove it, or write to another directory".format(script))
+         raise FileExistsError(script)
+      os.makedirs(self.path, exist_ok=True)
+      self.script = open(script, 'w')
+
+   def close(self):
+      NullSink.close(self)
+      for fh in self.files.values(): fh.close()
+      self.files = {}
+      if self.script:
+         self.script.close()
+         self.script = None
+      if self.deletes:
+         self.deletes.close()
+         self.deletes = None
+
+   def end_transaction(self):
+      for fh in self.files.values(): fh.flush()
+      self.script.flush()
+      if self.deletes: self.deletes.flush()
+
+   def write_sql(self, sqlstr):
+      self.script.write(sqlstr + ";\n")
+
+   def create_partition(self, table, tname, suffix, template, columns):
+      NullSink.create_partition(self, table, tname, suffix, template, columns)
+      if template:
+         self.write_sql("CREATE TABLE IF NOT EXISTS {} (LIKE {} INCLUDING ALL)".format(table, template))
+      elif columns:
+         self.write_sql("CREATE TABLE IF NOT EXISTS {} ({})".format(table, columns))
+      else:
+         self.script.write("-- create {} with: pgddl {} -x {}\n".format(table, tname, suffix))
+
+   def add_record(self, table, record):
+      didx = NullSink.add_record(self, table, record)
+      record = dict(record, didx=didx)
+      self.write_sql("INSERT INTO {} ({}) VALUES ({})".format(table, ', '.join(record), ', '.join(map(sql_value, record.values()))))
+
+      return didx
+
+   def update_record(self, table, record, cnd):
+      self.write_sql("UPDATE {} SET {} WHERE {}".format(table, ', '.join(["{} = {}".format(field, sql_value(record[field]))
+                                                                         for field in record]), cnd))
+      return 1
+
+   def add_records(self, table, records):
+      stream = CopyStream(records)
+      fh = self.files.get(table)
+      if fh is None:
+         fname = table + '.tsv'
+         fh = self.files[table] = open(os.path.join(self.path, fname), 'w', encoding='utf-8')
+         self.script.write("\\copy {} ({}) FROM '{}'\n".format(table, ','.join(stream.fields), fname))
+      while True:
+         data = stream.read(COPY_SIZE)
+         if not data: break
+         fh.write(data)
+      self.counts[table] = self.counts.get(table, 0) + stream.count
+
+      return stream.count
+
+   def upsert_records(self, table, fields, rows, keys, updates):
+      for sqlstr in upsert_statements(table, fields, rows, keys, updates):
+         self.write_sql(sqlstr)
+      self.counts[table] = self.counts.get(table, 0) + len(rows)
+
+      return len(rows)
+
+   def delete_records(self, table, cnd):
+      # a partition file is copied whole by the \copy written to load.sql with its first rows,
+      # so a deletion after it in load.sql would also remove the rows written since
+      if self.deletes is None: self.deletes = open(os.path.join(self.path, 'delete.sql'), 'w')
+      self.deletes.write("DELETE FROM {} WHERE {};\n".format(table, cnd))
+
+      return 0
+
+SINKS = {'postgres': PgSink, 'sqlite': SQLiteSink, 'null': NullSink, 'file': FileSink}
+
+def open_sink(name=None, path=None, load_method=None):
+   """ Create and connect the sink of a name in SINKS, postgres by default; path is its database or directory """
+
+   sink = SINKS[name or 'postgres'](path, load_method)
+   sink.connect()
+
+   return sink
@@ -0,0 +1,48 @@
+"""
+On-disk segments for dates whose parsed records do not fit in the memory
+budget.  Each segment is a pickled DayBuffer, so its columns are written as
+the raw bytes of their typed arrays and read back one segment at a time.
+"""
+
+import pickle
+import tempfile
+
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+class SpilledDay:
+   """ Records of one date spilled to a temporary file as a series of DayBuffer segments """
+
+   def __init__(self, spilldir=None):
+      self.fh = tempfile.TemporaryFile(prefix='ispd-spill-', dir=spilldir)
+      self.offsets = []
+      self.rcnts = [0]*TABLECOUNT
+
+   def add(self, records):
+      """ Write a DayBuffer as the next segment; the caller drops it from memory """
+
+      self.offsets.append(self.fh.tell())
+      pickle.dump(records, self.fh, pickle.HIGHEST_PROTOCOL)
+      for i, cnt in enumerate(records.counts()): self.rcnts[i] += cnt
+
+   def parts(self):
+      """ Read the segments back one DayBuffer at a time """
+
+      self.fh.flush()
+      for offset in self.offsets:
+         self.fh.seek(offset)
+         yield pickle.load(self.fh)
+
+   def counts(self):
+      return list(self.rcnts)
+
+   @property
+   def nbytes(self):
+      """ bytes of the spilled segments on disk """
+      self.fh.seek(0, 2)
+      return self.fh.tell()
+
+   def close(self):
+      self.fh.close()
@@ -0,0 +1,103 @@
+"""
+Parallel parsing of one large plain ISPD file.  The file is split into byte
+ranges of about SPLITBYTES that end where the date changes, the ranges are
+parsed into day buffers by a pool of worker processes, and the dates are
+handed back strictly in file order, so the writer assigns the record indices
+and inventory records exactly as in a serial run.
+"""
+
+import collections
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from .ispd_common import *
+from .ispd_io import MappedFile
+
+import logging
+logger = logging.getLogger(__name__)
+
+def parse_range(task):
+   """ Parse the dates in bytes start to end of a file; return their (date, DayBuffer, end offset) """
+
+   fname, start, end, vectorize = task
+   days = []
+   fh = MappedFile(fname)
+   try:
+      fh.seek(start)
+      for cdate, lines, dend in get_mapped_blocks(fh, start):
+         days.append((cdate, parse_ispd_lines(lines, cdate, vectorize), dend))
+         if dend >= end: break
+   finally:
+      fh.close()
+
+   return days
+
+class SplitFile:
+   """ Plain ISPD file parsed by jobs worker processes, a range of dates at a time; positions are byte offsets """
+
+   def __init__(self, fname, jobs, vectorize=0):
+      self.fname = fname
+      self.jobs = jobs
+      self.vectorize = vectorize
+      self.pos = 0
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+
+   def seek(self, offset):
+      self.pos = offset
+      return offset
+
+   def tell(self):
+      return self.pos
+
+   def get_ranges(self):
+      """ Return the (start, end) byte ranges of whole dates from the current position """
+
+      ranges = []
+      if not os.path.getsize(self.fname): return ranges
+      with open(self.fname, 'rb') as fh:
+         mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+         start = self.pos
+         while start < len(mm):
+            end = find_date_boundary(mm, start + SPLITBYTES) if start + SPLITBYTES < len(mm) else len(mm)
+            ranges.append((start, end))
+            start = end
+      finally:
+         mm.close()
+
+      return ranges
+
+   def get_blocks(self, offset=None):
+      """
+      Yield (date, DayBuffer) for each date from the current position, in file order;
+      given the byte offset, yield (date, DayBuffer, offset at the end of the date)
+      """
+
+      ranges = self.get_ranges()
+      logger.info("{}: {} ranges parsed by {} processes".format(self.fname, len(ranges), self.jobs))
+      tasks = iter([(self.fname, start, end, self.vectorize) for start, end in ranges])
+      pool = ProcessPoolExecutor(self.jobs)
+      futures = collections.deque()
+      try:
+         for task in tasks:
+            futures.append(pool.submit(parse_range, task))
+            if len(futures) >= self.jobs*SPLITAHEAD: break
+         while futures:
+            days = futures.popleft().result()
+            task = next(tasks, None)
+            if task: futures.append(pool.submit(parse_range, task))
+            for cdate, records, end in days:
+               self.pos = end
+               yield (cdate, records) if offset is None else (cdate, records, end)
+      finally:
+         for future in futures: future.cancel()    # the writer stopped early
+         pool.shutdown()
+
+   def close(self):
+      pass
@@ -0,0 +1,204 @@
+"""
+Counters and timers of the stages of a fill: reading the input, splitting it
+into dates, parsing, buffering, inventory and index queries, partition DDL,
+inserts, control table writes and commits, with the loads of each table and
+the lines, rows and stage times of each file.  Stage timers nest per thread:
+time spent in a stage entered from another is not counted in the outer one,
+so the stage times of a thread add up to at most its wall time.  The summary
+is written as JSON and, optionally, as a Prometheus node exporter textfile.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from .ispddb_config import *
+
+import logging
+logger = logging.getLogger(__name__)
+
+STAGES = ['read', 'dates', 'parse', 'buffer', 'inventory', 'index', 'ddl', 'insert', 'control', 'commit']
+ROUNDTRIPS = {'table_names', 'create_partition', 'get_records', 'add_record', 'update_record',
+              'add_records', 'upsert_records', 'delete_records', 'start_transaction', 'end_transaction'}
+
+class IngestStats:
+   """ Stage times, table loads, database round trips and counts of a fill, shared by its threads """
+
+   def __init__(self, jsonfile=None, promfile=None):
+      self.jsonfile = jsonfile
+      self.promfile = promfile
+      self.lock = threading.Lock()
+      self.local = threading.local()
+      self.started = time.time()
+      self.start = time.perf_counter()
+      self.stages = {}    # stage: [times entered, seconds]
+      self.tables = {}    # table: [loads, rows, seconds]
+      self.calls = {}     # sink method: database round trips
+      self.counts = {'files': 0, 'dates': 0, 'lines': 0, 'rows': 0, 'duplicates': 0}
+      self.files = {}     # file name: summary of the file, see file_summary()
+
+   def charge(self, stage, seconds, entered):
+      with self.lock:
+         entry = self.stages.setdefault(stage, [0, 0.0])
+         entry[0] += entered
+         entry[1] += seconds
+
+   @contextmanager
+   def timer(self, stage):
+      """ Time a stage, pausing the stage it is entered from on the same thread """
+
+      local = self.local
+      if not hasattr(local, 'stack'): local.stack = []
+      now = time.perf_counter()
+      if local.stack: self.charge(local.stack[-1], now - local.mark, 0)
+      local.stack.append(stage)
+      local.mark = now
+      try:
+         yield
+      finally:
+         now = time.perf_counter()
+         self.charge(local.stack.pop(), now - local.mark, 1)
+         local.mark = now
+
+   def add_load(self, table, rows, seconds):
+      with self.lock:
+         entry = self.tables.setdefault(table, [0, 0, 0.0])
+         entry[0] += 1
+         entry[1] += rows
+         entry[2] += seconds
+
+   def add_call(self, method, count=1):
+      with self.lock:
+         self.calls[method] = self.calls.get(method, 0) + count
+
+   def add_counts(self, **counts):
+      with self.lock:
+         for key in counts: self.counts[key] += counts[key]
+
+   def snapshot(self):
+      """ Copy of the counters, to summarize what a file adds to them """
+
+      with self.lock:
+         return {'time': time.perf_counter(), 'counts': dict(self.counts), 'calls': sum(self.calls.values()),
+                 'stages': {stage: entry[1] for stage, entry in self.stages.items()},
+                 'tables': {table: list(entry) for table, entry in self.tables.items()}}
+
+   def file_summary(self, fname, snapshot):
+      """ Record and return the lines, rows, stage times and table loads of a file since snapshot """
+
+      now = self.snapshot()
+      seconds = now['time'] - snapshot['time']
+      summary = {key: now['counts'][key] - snapshot['counts'][key] for key in ('dates', 'lines', 'rows', 'duplicates')}
+      summary.update({'seconds': seconds, 'roundtrips': now['calls'] - snapshot['calls'],
+                      'lines_per_sec': rate(summary['lines'], seconds), 'rows_per_sec': rate(summary['rows'], seconds)})
+      summary['stages'] = {stage: secs - snapshot['stages'].get(stage, 0.0) for stage, secs in now['stages'].items()}
+      summary['tables'] = {}
+      for table, (loads, rows, secs) in now['tables'].items():
+         ploads, prows, psecs = snapshot['tables'].get(table, (0, 0, 0.0))
+         if loads > ploads: summary['tables'][table] = {'loads': loads - ploads, 'rows': rows - prows, 'seconds': secs - psecs}
+      with self.lock:
+         self.files[fname] = summary
+         self.counts['files'] += 1
+
+      return summary
+
+   def merge_file(self, fname, summary):
+      """ Add the summary of a file filled by a worker process """
+
+      with self.lock:
+         self.files[fname] = summary
+         self.counts['files'] += 1
+         for key in ('dates', 'lines', 'rows', 'duplicates'): self.counts[key] += summary[key]
+         self.calls['worker'] = self.calls.get('worker', 0) + summary['roundtrips']
+         for stage, secs in summary['stages'].items():
+            self.stages.setdefault(stage, [0, 0.0])[1] += secs
+         for table, load in summary['tables'].items():
+            entry = self.tables.setdefault(table, [0, 0, 0.0])
+            entry[0] += load['loads']
+            entry[1] += load['rows']
+            entry[2] += load['seconds']
+
+   def summary(self):
+      """ Return the summary of the fill as a dict """
+
+      seconds = time.perf_counter() - self.start
+      with self.lock:
+         summary = dict(self.counts)
+         summary.update({'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                         'seconds': seconds, 'lines_per_sec': rate(self.counts['lines'], seconds),
+                         'rows_per_sec': rate(self.counts['rows'], seconds), 'roundtrips': sum(self.calls.values()),
+                         'calls': dict(self.calls)})
+         summary['stages'] = {stage: {'entered': entered, 'seconds': secs}
+                              for stage, (entered, secs) in sorted(self.stages.items(), key=lambda item: stage_order(item[0]))}
+         summary['tables'] = {table: {'loads': loads, 'rows': rows, 'seconds': secs, 'rows_per_sec': rate(rows, secs)}
+                              for table, (loads, rows, secs) in sorted(self.tables.items())}
+         summary['files'] = dict(self.files)
+
+      return summary
+
+   def write(self):
+      """ Write the summary to the JSON file and the Prometheus textfile, if set; return the summary """
+
+      summary = self.summary()
+      if self.jsonfile:
+         with open(self.jsonfile, 'w') as fh:
+            json.dump(summary, fh, indent=2)
+      if self.promfile:
+         # write aside and rename, so the node exporter never reads a partial file
+         with open(self.promfile + '.tmp', 'w') as fh:
+            fh.write(prometheus_text(summary))
+         os.replace(self.promfile + '.tmp', self.promfile)
+
+      return summary
+
+def rate(count, seconds):
+   return count/seconds if seconds > 0 else 0.0
+
+def stage_order(stage):
+   return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+def prometheus_text(summary):
+   """ Return the summary of a fill in the Prometheus text exposition format """
+
+   lines = []
+   def metric(name, mtype, help, values):
+      lines.append("# HELP ispd_fill_{} {}".format(name, help))
+      lines.append("# TYPE ispd_fill_{} {}".format(name, mtype))
+      for labels, value in values:
+         lines.append("ispd_fill_{}{} {}".format(name, labels, value))
+
+   metric('seconds', 'gauge', "Wall time of the fill in seconds.", [('', summary['seconds'])])
+   metric('lines', 'gauge', "Input lines parsed.", [('', summary['lines'])])
+   metric('rows', 'gauge', "Rows added to the ISPD tables.", [('', summary['rows'])])
+   metric('duplicates', 'gauge', "Records already loaded that were skipped.", [('', summary['duplicates'])])
+   metric('lines_per_second', 'gauge', "Input lines parsed per second.", [('', summary['lines_per_sec'])])
+   metric('rows_per_second', 'gauge', "Rows added per second.", [('', summary['rows_per_sec'])])
+   metric('db_roundtrips', 'gauge', "Database round trips.", [('', summary['roundtrips'])])
+   metric('stage_seconds', 'gauge', "Time spent in each stage of the fill.",
+          [('{{stage="{}"}}'.format(stage), entry['seconds']) for stage, entry in summary['stages'].items()])
+   metric('table_rows', 'gauge', "Rows added to each table.",
+          [('{{table="{}"}}'.format(table), entry['rows']) for table, entry in summary['tables'].items()])
+   metric('table_seconds', 'gauge', "Time spent loading each table.",
+          [('{{table="{}"}}'.format(table), entry['seconds']) for table, entry in summary['tables'].items()])
+
+   return '\n'.join(lines) + '\n'
+
+class CountingSink:
+   """ Sink wrapper counting the calls of its methods that make a database round trip """
+
+   def __init__(self, sink, stats):
+      self.sink = sink
+      self.stats = stats
+
+   def __getattr__(self, name):
+      attr = getattr(self.sink, name)
+      if name not in ROUNDTRIPS: return attr
+
+      def call(*args, **kwargs):
+         # an upsert sends one statement per CNTLBATCH rows
+         self.stats.add_call(name, (-(-len(args[2])//CNTLBATCH) if name == 'upsert_records' else 1))
+         return attr(*args, **kwargs)
+
+      return call
@@ -4,29 +4,101 @@ the ISPD database (ISPDDB)
 """
 
 import os
-from PgLOG import pgexit
-from PgDBI import ispddb_dbname
 from .ispd_common import *
+from .ispd_io import open_ispd_file, detect_compression, is_hdf5_file
+from .ispd_cache import CachedFile, CacheWriter
+from .ispd_split import SplitFile
+from .ispd_dayindex import DateSelection, IndexedDays, open_selected_days, select_date_blocks, selection_end
+from .ispd_manifest import LoadManifest
 import logging
 
 logger = logging.getLogger(__name__)
 
 class FillISPD:
-   def __init__(self, add_inventory=None, lead_uid=None, check_existing=None):
+   def __init__(self, add_inventory=None, lead_uid=None, check_existing=None, vectorize=None, load_method=None,
+                update_control=None, jobs=None, pipeline=None, writers=None, two_phase=None, batch_rows=None, batch_bytes=None,
+                memory_budget=None, journal=None, resume=None, read_thread=None, mmap=None, parse_cache=None,
+                cache_size=None, sink=None, sink_path=None, stats=None, stats_prom=None, bloom_rows=None,
+                parse_jobs=None, dates=None, date_range=None, manifest=None):
       self.add_inventory = add_inventory
       self.lead_uid = lead_uid
       self.check_existing = check_existing
+      self.vectorize = vectorize
+      self.load_method = load_method
+      self.update_control = update_control
+      self.jobs = jobs
+      self.pipeline = pipeline
+      self.writers = writers
+      self.two_phase = two_phase
+      self.batch_rows = batch_rows
+      self.batch_bytes = batch_bytes
+      self.memory_budget = memory_budget
+      self.journal = journal
+      self.resume = resume
+      self.read_thread = read_thread
+      self.mmap = mmap
+      self.parse_cache = parse_cache
+      self.cache_size = cache_size
+      self.cache_writer = None
+      self.block_end = 0    # end offset of the last date block read of the file being filled
+      self.skipped = set()  # dates of the file being filled with records skipped as already loaded
+      self.sink = sink
+      self.sink_path = sink_path
+      self.stats = stats
+      self.stats_prom = stats_prom
+      self.bloom_rows = bloom_rows
+      self.parse_jobs = parse_jobs
+      self.dates = dates
+      self.date_range = date_range
+      self.selection = DateSelection(dates, date_range)
+      self.selections = {}    # file name: DateSelection of the changed dates of a file reloaded in part
+      self.manifest = manifest
+      self.load_manifest = None
+      self.file_stats = None
       self.pvals = {'names': None, 'files': [], 'uatti': ''}
       self.pvals['names'] = '/'.join(ISPD_NAMES)
 
    def initialize_db(self):
-      ispddb_dbname()
+      set_stats(self.stats, self.stats_prom)
+      set_load_method(self.load_method)
+      set_sink(self.sink, self.sink_path)
+      load_partitions()
+      set_batch_size(self.batch_rows, self.batch_bytes)
+      set_memory_budget(self.memory_budget)
+      set_journal(self.journal or (JOURNALFILE if self.resume else None))
+      set_pool_writer(self.writers, self.two_phase)
+      set_parse_cache(self.parse_cache, self.cache_size)
+      set_duplicate_filter(self.bloom_rows)
+      if self.manifest and self.selection:
+         logger.warning("{}: load manifest not used for a fill of selected dates".format(self.manifest))
+      elif self.manifest:
+         self.load_manifest = LoadManifest(self.manifest)
 
    def close_db(self):
-      pgexit()
+      close_pool_writer()
+      close_journal()
+      close_sink()
+      close_stats()
+      if self.load_manifest:
+         self.load_manifest.close()
+         self.load_manifest = None
+
+   def get_options(self):
+      """ Return the options this object was created with, for worker processes """
+
+      # worker processes cannot start processes of their own, so they parse their files serially;
+      # the load manifest is planned and recorded by the parent process
+      return {'add_inventory': self.add_inventory, 'lead_uid': self.lead_uid, 'check_existing': self.check_existing,
+              'vectorize': self.vectorize, 'load_method': self.load_method, 'update_control': self.update_control,
+              'pipeline': self.pipeline, 'writers': self.writers, 'two_phase': self.two_phase, 'batch_rows': self.batch_rows,
+              'batch_bytes': self.batch_bytes, 'memory_budget': self.memory_budget, 'journal': self.journal,
+              'resume': self.resume, 'read_thread': self.read_thread, 'mmap': self.mmap,
+              'parse_cache': self.parse_cache, 'cache_size': self.cache_size, 'sink': self.sink,
+              'sink_path': self.sink_path, 'stats': self.stats, 'stats_prom': self.stats_prom, 'bloom_rows': self.bloom_rows,
+              'dates': self.dates, 'date_range': self.date_range}
 
    def initialize_indices(self):
-      init_current_indices(self.lead_uid, self.check_existing)
+      init_current_indices(self.lead_uid, self.check_existing, self.update_control)
 
    def get_input_files(self, files):
       if files is None:
@@ -37,59 +109,259 @@ class FillISPD:
    def fill_ispd_data(self):
       """ Insert ISPD data into ISPDDB """
 
-      fcnt = 0
-      tcounts = [0]*TABLECOUNT
-      for file in self.pvals['files']:
-         fcnt += 1
-         logger.debug("Processing input file {}".format(file))
-         acnts = self.process_ispd_file(file)
-         for i in range(TABLECOUNT): tcounts[i] += acnts[i]
+      files = self.pvals['files']
+      if self.load_manifest: files = self.plan_manifest_files(files)
+      fcnt = len(files)
+      if self.jobs and self.jobs > 1 and fcnt > 1 and not get_sink().concurrent:
+         logger.warning("the {} sink is written by one process, files filled one at a time".format(get_sink().name))
+      elif self.jobs and self.jobs > 1 and fcnt > 1 and self.check_existing:
+         # records already loaded change the counts of the inventory records reserved up front
+         logger.warning("existing records are checked while filling, files filled one at a time")
+      if self.jobs and self.jobs > 1 and fcnt > 1 and get_sink().concurrent and not self.check_existing:
+         from .ispd_parallel import fill_files_parallel
+         tcounts = [0]*TABLECOUNT
+         # files checkpointed within are resumed serially, files not started in parallel;
+         # files reloaded in part are filled serially with their duplicate filters
+         serial = [file for file in files if file in self.selections or self.resume and self.resume_status(file) == 'partial']
+         for file in serial:
+            acnts = self.process_ispd_file(file)
+            for i in range(TABLECOUNT): tcounts[i] += acnts[i]
+         files = [file for file in files if file not in serial and not (self.resume and self.resume_status(file))]
+         if files:
+            acnts = fill_files_parallel(self, files, min(self.jobs, len(files)))
+            for i in range(TABLECOUNT): tcounts[i] += acnts[i]
+      else:
+         tcounts = [0]*TABLECOUNT
+         for file in files:
+            logger.debug("Processing input file {}".format(file))
+            acnts = self.process_ispd_file(file)
+            for i in range(TABLECOUNT): tcounts[i] += acnts[i]
 
       if fcnt > 1: 
          logger.info("{} ({}) filled for {} files".format('/'.join(map(str, tcounts)), self.pvals['names'], fcnt))
 
       return
 
-   def process_ispd_file(self, fname):
-      """ Read ISPD record from given file name and save into ISPDDB """
+   def plan_manifest_files(self, files):
+      """
+      Return the files to fill, those new or changed since they were loaded according to the
+      load manifest; the changed dates of a changed file are selected for it, to be reloaded
+      """
 
-      iname = fname if self.add_inventory else None
+      fills = []
+      unchanged = changed = dcnt = 0
+      for file in files:
+         plan = self.load_manifest.plan(file)
+         if plan['removed']:
+            logger.warning("{}: records of the dates {} loaded before, no longer in the file, are kept".format(
+                           file, ', '.join(plan['removed'])))
+         if plan['status'] == 'unchanged':
+            logger.info("{}: unchanged since it was loaded, skipped".format(file))
+            unchanged += 1
+         elif plan['status'] == 'new':
+            fills.append(file)
+         elif plan['dates'] is None:
+            logger.info("{}: changed since it was loaded, reloaded".format(file))
+            self.selections[file] = None
+            fills.append(file)
+            changed += 1
+         elif plan['dates']:
+            logger.info("{}: dates {} changed since it was loaded, reloaded".format(file, ', '.join(plan['dates'])))
+            self.selections[file] = DateSelection(plan['dates'])
+            fills.append(file)
+            changed += 1
+            dcnt += len(plan['dates'])
+         else:
+            logger.info("{}: no date changed since it was loaded, skipped".format(file))
+            self.load_manifest.commit(file)
+            unchanged += 1
+      logger.info("{}: {} files unchanged and skipped, {} changed files reloaded ({} changed dates), {} new files".format(
+                  self.manifest, unchanged, changed, dcnt, len(fills) - changed))
 
-      logger.info("Recording ISPD records from file '{}' into ISPDDB".format(fname))
+      return fills
+
+   def file_selection(self, fname):
+      """ Return the DateSelection of a file: its changed dates if reloaded in part, else the dates selected for all files """
+
+      return self.selections.get(fname) or self.selection
+
+   def process_ispd_file(self, fname, reserved=None):
+      """
+      Read ISPD record from given file name and save into ISPDDB; reserved is the list
+      of inventory records added ahead of time for the date blocks of the file, if any
+      """
 
-      ISPD = open(fname, 'r', encoding = 'latin_1')
       acounts = [0]*TABLECOUNT
-      records = {}
-
-      # get the first valid date and do initialization
-      line = ISPD.readline()
-      while line:
-         idate = cdate = get_ispd_date(line)
-         if cdate:
-            init_indices_for_date(cdate, iname)
-            records = get_ispd_records(line, cdate, records)
-            break
-         line = ISPD.readline()
-
-      line = ISPD.readline()
-      while line:
-         idate = get_ispd_date(line)
-         if idate:
-            if idate != cdate:
-               acnts = add_ispd_records(cdate, records)
+      self.file_stats = None
+      status = self.resume_status(fname) if self.resume and not reserved else None
+      if status == 'done':
+         logger.info("{}: loaded completely already, skipped".format(fname))
+         if self.load_manifest: self.load_manifest.commit(fname)
+         return acounts
+      if status == 'reserved':
+         logger.error("{}: partly loaded by a parallel fill that cannot be resumed, reload it with --checkexisting".format(fname))
+         return acounts
+
+      logger.info("Recording ISPD records from file '{}' into ISPDDB".format(fname))
+      reset_memory_stats()
+      snapshot = get_stats_snapshot()
+      start_duplicate_filter()
+      self.skipped = set()
+
+      cache = open_parse_cache(fname)
+      if isinstance(cache, CacheWriter) and (status == 'partial' or self.file_selection(fname)):
+         cache.abort()    # only whole files are cached, from their start
+         cache = None
+      self.cache_writer = cache if isinstance(cache, CacheWriter) else None
+      ISPD = cache if isinstance(cache, CachedFile) else self.open_input_file(fname)
+      # reading and date detection are interleaved on a stream, so its reads are timed apart;
+      # HDF5 and cached dates are read and decoded together, split dates are parsed by other processes
+      stage = 'parse' if isinstance(ISPD, SplitFile) else 'read' if hasattr(ISPD, 'get_blocks') and \
+              not isinstance(ISPD, IndexedDays) else 'dates'
+      self.block_end = 0
+      blocks = time_blocks(self.get_file_blocks(ISPD, fname, status == 'partial'), stage)
+
+      try:
+         if self.pipeline:
+            from .ispd_pipeline import fill_file_pipelined
+            acounts = fill_file_pipelined(self, blocks, fname, reserved)
+         else:
+            for bidx, (cdate, lines, end) in blocks:
+               records = self.get_date_records(cdate, lines)
+               acnts = self.add_date_records(cdate, records, fname, (reserved[bidx] if reserved else None), (bidx, end))
                for i in range(TABLECOUNT): acounts[i] += acnts[i]
-               records = {}
-               cdate = idate
-               init_indices_for_date(cdate, iname)
-            records = get_ispd_records(line, idate, records)
-         line = ISPD.readline()
+      except BaseException:
+         if self.cache_writer: self.cache_writer.abort()
+         raise
 
       ISPD.close()
-
-      acnts = add_ispd_records(cdate, records)
-      for i in range(TABLECOUNT): acounts[i] += acnts[i]
+      flush_ispd_records()
+      wait_pool_writer()
+      if self.update_control:
+         flush_control_tables()
+      if self.cache_writer:
+         self.cache_writer.commit()
+         self.cache_writer = None
+      finish_checkpoint(fname)
+      if self.load_manifest: self.load_manifest.commit(fname, self.skipped)
+      end_duplicate_filter(os.path.basename(fname))
+      count_stats(rows=sum(acounts))
+      self.file_stats = get_file_stats(fname, snapshot)
 
       logger.info("{} ({}) filled from {}".format(' '.join(map(str, acounts)), self.pvals['names'], os.path.basename(fname)))
+      log_memory_stats(os.path.basename(fname))
    
       return acounts
 
+   def open_input_file(self, fname):
+      """
+      Open an input file; with selected dates, a plain file is read from its day index if it has
+      a current one; otherwise, with parse_jobs, a plain file is parsed by that many processes
+      """
+
+      selection = self.file_selection(fname)
+      if selection:
+         ISPD = open_selected_days(fname, selection)
+         if ISPD: return ISPD
+      elif self.parse_jobs and self.parse_jobs > 1 and not is_hdf5_file(fname) and not detect_compression(fname):
+         if not self.memory_budget:
+            return SplitFile(fname, self.parse_jobs, self.vectorize)
+         logger.warning("{}: dates parsed by other processes are not spilled to disk, parsed serially "
+                        "within the memory budget".format(fname))
+
+      return open_ispd_file(fname, self.read_thread, self.mmap, get_read_timer())
+
+   def resume_status(self, fname):
+      """ Return the journal status of a file: None if not started, 'partial', 'reserved' or 'done' """
+
+      entry = get_checkpoint_entry(fname)
+      return entry['status'] if entry else None
+
+   def get_file_blocks(self, fh, fname, resume=False):
+      """
+      Return the iterator of (block index, (date, lines, end offset)) of an open file; with resume,
+      restore the state of the last committed date in the journal and start after it, or at the
+      start of the date if only its first parts were committed
+      """
+
+      if not resume: return enumerate(self.select_blocks(fh, fname, get_day_blocks(fh, 0, self.vectorize)))
+
+      entry = get_checkpoint_entry(fname)
+      resume_checkpoint(entry)
+      offset = entry['offset']
+      part = 'partiidx' in entry
+      where = ("{} from offset {}" if part else "after {} at offset {}").format(entry['date'], offset)
+      if hasattr(fh, 'get_blocks'):    # HDF5 rows or cached dates, always positioned on a date boundary
+         fh.seek(offset)
+         logger.info("{}: resume {}".format(fname, where))
+         self.block_end = offset
+         return enumerate(self.select_blocks(fh, fname, get_day_blocks(fh, offset, self.vectorize)), entry['bidx'])
+      fh.seek(max(offset - 1, 0))
+      head = fh.read(1) if offset else '\n'
+      line = fh.readline()
+      if head != '\n' or line and not (line[0:8].isdigit() and
+                                       (get_ispd_date(line) <= entry['date'] if part else get_ispd_date(line) > entry['date'])):
+         # the offset does not fall on a date boundary, e.g. for a file with CRLF line ends
+         logger.warning("{}: journal offset {} of {} is not on a date boundary, skip {} dates from the start".format(
+                        fname, offset, entry['date'], entry['bidx']))
+         fh.seek(0)
+         blocks = enumerate(self.select_blocks(fh, fname, get_day_blocks(fh, 0, self.vectorize)))
+         for i in range(entry['bidx']): self.block_end = next(blocks)[1][2]
+         return blocks
+
+      fh.seek(offset)
+      logger.info("{}: resume {}".format(fname, where))
+      self.block_end = offset
+      return enumerate(self.select_blocks(fh, fname, get_day_blocks(fh, offset, self.vectorize)), entry['bidx'])
+
+   def select_blocks(self, fh, fname, blocks):
+      """ Return the date blocks of the selected dates; all of them without a selection or when read from the day index """
+
+      selection = self.file_selection(fname)
+      if not selection or isinstance(fh, IndexedDays): return blocks
+
+      end = selection_end(fname, selection) if detect_compression(fname) else None
+      return select_date_blocks(blocks, selection, end)
+
+   def get_date_records(self, cdate, lines):
+      """ Parse the block of lines for one date into ispd records """
+
+      with stage_timer('parse'):
+         records = parse_ispd_day(lines, cdate, self.vectorize)
+      count_stats(dates=1, lines=records.counts()[UIDIDX])
+
+      return records
+
+   def add_date_records(self, cdate, records, fname, reserved=None, position=None):
+      """
+      Assign the record indices of one date and load its records into ISPDDB; reserved
+      is the inventory record added ahead of time for the date, if any, and position
+      the (block index, end offset) of the date in the file, for the checkpoint journal;
+      the date starts at the end offset of the date before it.  The rows of a date of a
+      changed file loaded before are deleted first
+      """
+
+      if self.cache_writer and position:
+         self.cache_writer.add(cdate, records, position[1])
+      start_batch(records)
+      if position and not reserved:
+         set_checkpoint(fname, position[0] + 1, position[1], self.block_end)
+      else:
+         set_checkpoint()
+      if position: self.block_end = position[1]
+      acnts = load_resumed_records(cdate, records)
+      if acnts is not None: return acnts
+
+      if fname in self.selections: delete_date_records(cdate, fname, records)
+      count = records.counts()[UIDIDX]
+      records = filter_existing_records(cdate, records)
+      if records.counts()[UIDIDX] < count: self.skipped.add(cdate)
+      count = records.counts()[UIDIDX]
+      if reserved:
+         init_indices_for_record(cdate, count, reserved)
+         advance_indices(count)
+         return load_ispd_records(cdate, records, reserved['tidx'])
+
+      init_indices_for_date(cdate, (fname if self.add_inventory else None))
+      advance_indices(count)
+      return add_ispd_records(cdate, records)
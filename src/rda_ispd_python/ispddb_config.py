@@ -548,20 +548,28 @@ ISPDS = {
    }
 }
 
+# SQL column types of the numeric fields
+SQLTYPES = {int: 'integer', float: 'double precision'}
+
 TABLECOUNT = len(ISPDS)
 ISPD_NAMES = list(ISPDS.keys())
 FIELD_COUNT = 41
 
 DBCNTL = "ispddb"
+CNTLSCHEMA = "cntldb"     # schema of the itidx and iattm control tables
 
 # field delimiter in ASCII input records
 ISPD_DELIM = '<:>'
 
+# string fields with few distinct values, dictionary-encoded in the day buffers
+ENCODED_VARS = ['ispdbcid', 'sname', 'id', 'rtc', 'slib']
+
 MULTI_NAMES = []
 ATTI2NAME = {}
 ATTCPOS = INVENTORY = CURTIDX = CURIIDX = 0
 CURIUID = ''
-ISPD_COUNTS = []
+ISPD_FIELDS = []          # compiled field specs shared by all tables
+ISPD_COLUMNS = {}         # compiled (var, field spec index) lists per table
 UIDIDX = 0
 AUTHREFS = {}
 NUM2NAME = {}             # cache field names from component/field numbers
@@ -576,4 +584,50 @@ LEADUID = 0
 CHKEXIST = 0
 UIDLENGTH = 0  # uid record len
 UIDOFFSET = 0  # uid value offset
-ATTMNAME = None      # standalone attm section name to fill
\ No newline at end of file
+ATTMNAME = None      # standalone attm section name to fill
+MUNIQUE = {}         # attm name: unique fields, besides iidx, of a standalone attm record
+ITIDXCACHE = {}      # uid prefix: {'records': {suid: itidx record}, 'checked': suids queried, 'preloaded': bool}
+ITIDXEXIST = set()   # keys of the ATTMNAME records already loaded, for the itidx records fetched
+ITIDXBATCH = 1000    # uids per set-based query
+ITIDXPRELOAD = 0     # 1 to read whole itidx_<xx> tables instead of batches of uids
+DUPFILTER = None     # ispd_dedup.DuplicateFilter of the uids already loaded, for the file being filled
+DEDUPBLOOMROWS = 2000000    # partitions of over this many rows are checked with a Bloom filter, 0 for never
+DEDUPFPRATE = 0.01   # false positive rate of the Bloom filters, hits are confirmed by queries
+DEDUPPAGE = 1000000  # uids read per query while loading the keys of a partition
+CNTLUPDATE = 0       # 1 to maintain the itidx and iattm control tables while filling
+CNTLRECORDS = {'iattm': {}, 'iattm_daily': {}, 'itidx': {}}   # pending control records
+CNTLBATCH = 1000     # rows per multi-row control table upsert
+PIPEQSIZE = 4        # date blocks held in each queue between pipeline stages
+READSIZE = 1 << 22   # bytes read from an input file at a time
+READQSIZE = 4        # blocks of bytes held between the decompression thread and the parser
+H5GROUP = '/'        # HDF5 group holding one 1-D dataset per ISPD field, named after the field's variable
+H5CHUNK = 100000     # rows read from each HDF5 dataset at a time
+DATEPREFIXES = {}    # YYYYMMDD line prefix: normalized date
+PREFIXBOUNDS = {}    # YYYYMMDD line prefix: regex finding the next line with another prefix
+SPLITBYTES = 1 << 26 # bytes of whole dates per range of a plain file parsed by a worker process
+SPLITAHEAD = 2       # ranges parsed ahead of the writer per worker process
+PARSECACHE = None    # ispd_cache.ParseCache of parsed files, see set_parse_cache()
+CACHEBYTES = 1 << 33 # bytes of parse cache entries kept before the least recently used are evicted
+CACHEVERSION = 2     # version of the parse cache layout; entries of other versions are invalid
+DAYINDEXEXT = '.days.json'   # suffix of the day index stored alongside an input file, see ispd_dayindex
+DAYINDEXVERSION = 1  # version of the day index layout; indices of other versions are rebuilt
+POOLWRITER = None    # ispd_pool.PoolWriter loading the tables of a date concurrently, see set_pool_writer()
+BATCHROWS = 0        # rows per table load: small consecutive dates are merged and large dates split to it
+BATCHBYTES = 0       # bytes of pending dates that trigger a load; BATCHROWS = BATCHBYTES = 0 loads each date on its own
+BATCHRECORDS = []    # pending (date, DayBuffer, tidx) not loaded yet
+MEMBUDGET = 0        # bytes of parsed records of a date held in memory before they spill to disk, 0 for no limit
+SPILLDIR = None      # directory of the spill files, None for the system temporary directory
+SPILLLINES = 10000   # lines parsed at a time between checks of the memory budget
+MEMSTATS = {'peak': 0, 'spilled': 0, 'spillbytes': 0}   # buffered bytes and spills of the current file
+JOURNAL = None       # ispd_journal.CheckpointJournal of the committed dates, see set_journal()
+JOURNALFILE = "fill_ispddb.journal"   # default journal file name
+CHECKPOINT = None    # file position of the date being loaded, for its journal entry
+RESUMEPART = None    # (date, record index) of the last part committed of a spilled date being resumed
+POOLTWOPHASE = 0     # 1 to commit the tables of a date with two-phase commit (needs max_prepared_transactions > 0)
+SINK = None               # ispd_sink sink of the records, inventory and control tables, see set_sink()
+LOADMETHOD = 'insert'     # 'insert' with PgDBI.pgmadd or 'copy' with COPY FROM STDIN
+LOADMETHODS = ['insert', 'copy']
+INVCACHE = None           # in-memory ispd_inventory index, loaded once by get_inventory_cache()
+PARTITIONS = None         # cached names of existing tables, loaded once by load_partitions()
+STATS = None              # ispd_stats.IngestStats of the stage times and counts of the fill, see set_stats()
+PRECREATE_RATIO = 0.9     # create next tidx partitions when tcount reaches this share of MAXICNT
\ No newline at end of file
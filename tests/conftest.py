@@ -0,0 +1,12 @@
+"""
+Test setup: the package is imported from src and the synthetic file generator
+from benchmarks.  The tests that need the RDA PgDBI/PgUtil modules, NumPy or
+h5py are skipped where those are not installed.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in ('src', 'benchmarks'):
+   if os.path.join(ROOT, path) not in sys.path: sys.path.insert(0, os.path.join(ROOT, path))
@@ -0,0 +1,70 @@
+"""
+Parity of the NumPy block parser with the scalar line parser
+"""
+
+import random
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('PgUtil')
+
+from gen_ispd import generate_day_lines, get_field_specs, make_stations
+from rda_ispd_python import ispd_common
+from rda_ispd_python.ispd_block import column_to_list, parse_ispd_block
+from rda_ispd_python.ispddb_config import ISPD_DELIM
+
+def field_index(name):
+   return [spec[0] for spec in get_field_specs()].index(name)
+
+def edit_line(line, **fields):
+   """ Return line with the text of the named fields replaced """
+
+   vals = line.rstrip('\n').split(ISPD_DELIM)
+   for name, text in fields.items(): vals[field_index(name)] = text
+   return ISPD_DELIM.join(vals) + '\n'
+
+def edge_lines():
+   """ Lines with the missing, NaN, empty, oversized and rounding cases of the field decoding """
+
+   specs = {spec[0]: spec for spec in get_field_specs()}
+   rng = random.Random(1)
+   base = generate_day_lines(rng, '1950-01-02', 12, 1, make_stations(rng, 3), 0, 0, 0)
+   floats = [name for name, spec in specs.items() if spec[1] is float]
+   ints = [name for name, spec in specs.items() if spec[1] is int]
+   strs = [name for name, spec in specs.items() if spec[1] is str and name != 'uid']
+
+   return base[0:2] + [
+      edit_line(base[2], **{name: specs[name][3] for name in floats + ints + strs}),    # missing sentinels
+      edit_line(base[3], **{name: 'nan' for name in floats + ints}),
+      edit_line(base[4], **{name: '  nan' for name in floats}),
+      edit_line(base[5], **{name: '' for name in floats + ints + strs[0:-1]}),
+      edit_line(base[6], **{name: 'X'*(specs[name][2] + 1) for name in strs + floats[0:2]}),    # oversized
+      edit_line(base[7], **{floats[0]: '1013.25', floats[1]: '-0.50', floats[2]: '7', ints[0]: '007', ints[1]: '-3'}),
+      edit_line(base[8], **{floats[0]: '0.1', floats[1]: '1e2', floats[2]: '2.675', ints[0]: '12 '}),
+      edit_line(base[9], **{strs[0]: 'AB  ', strs[1]: ' A'}),
+   ]
+
+@pytest.mark.parametrize('seed', [0, 5])
+def test_block_parser_matches_line_parser(seed):
+   rng = random.Random(seed)
+   lines = generate_day_lines(rng, '1950-01-01', 300, 1, make_stations(rng, 20), 0.2, 0.2, 0.2) + edge_lines()
+
+   columns = parse_ispd_block(lines)
+   assert len(columns) == len(ispd_common.ISPD_FIELDS)
+   values = [column_to_list(column) for column in columns]
+   for row, line in enumerate(lines):
+      expected = ispd_common.parse_ispd_line(line)
+      actual = [vals[row] for vals in values]
+      assert actual == expected, line
+      assert [type(val) for val in actual] == [type(val) for val in expected], line
+
+def test_block_records_match_line_records():
+   rng = random.Random(2)
+   lines = generate_day_lines(rng, '1950-01-01', 200, 1, make_stations(rng, 10), 0.1, 0.1, 0.1) + edge_lines()
+
+   scalar = ispd_common.parse_ispd_lines(lines, '1950-01-01')
+   block = ispd_common.parse_ispd_lines(lines, '1950-01-01', 1)
+   assert block.counts() == scalar.counts()
+   for aname in scalar:
+      assert block[aname].to_records() == scalar[aname].to_records()
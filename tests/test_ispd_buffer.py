@@ -0,0 +1,38 @@
+"""
+Columnar buffers of the parsed ISPD records
+"""
+
+from rda_ispd_python.ispd_buffer import ColumnBuffer, DayBuffer, iter_record_batches
+from rda_ispd_python.ispddb_config import ENCODED_VARS, ISPDS
+
+def test_encoded_column_all_null():
+   column = ColumnBuffer(str, True)
+   column.extend([None]*10)
+
+   assert column.dictionary == []
+   assert column.tolist() == [None]*10
+   assert column.tolist(3, 7) == [None]*4
+   assert column.take([1, 2]).tolist() == [None, None]
+
+def test_encoded_column_mixed_nulls():
+   column = ColumnBuffer(str, True)
+   column.extend(['A', None, 'B', 'A', None])
+
+   assert column.tolist() == ['A', None, 'B', 'A', None]
+   assert column.tolist(1, 4) == [None, 'B', 'A']
+   assert len(column.dictionary) == 2
+
+def test_day_buffer_blank_encoded_fields():
+   # fields: one spec per variable of the uid table, the encoded ones blank on every record
+   attm = ISPDS['ispdmeta']['attm']
+   names = list(attm)
+   fields = [(i, None, attm[var]['size'], attm[var]['type'], str(attm[var]['missing'])) for i, var in enumerate(names)]
+   day = DayBuffer(fields, {'ispdmeta': [(var, i) for i, var in enumerate(names)]})
+   for row in range(20):
+      day.append_values([None if var in ENCODED_VARS else attm[var]['type'](row) for var in names], '1950-01-01')
+
+   records = day['ispdmeta'].to_records()
+   for var in names:
+      if var in ENCODED_VARS: assert records[var] == [None]*20
+   batches = list(iter_record_batches([day['ispdmeta']], 8))
+   assert [len(batch['uid']) for batch in batches] == [8, 8, 4]
@@ -0,0 +1,81 @@
+"""
+Keys and content checks of the parse cache entries
+"""
+
+import os
+import random
+
+import pytest
+
+pytest.importorskip('PgUtil')
+
+from gen_ispd import generate_day_lines, make_stations
+from rda_ispd_python import ispd_cache, ispd_common
+from rda_ispd_python.ispd_cache import CachedFile, CacheWriter, ParseCache
+
+CDATE = '1950-01-01'
+
+def write_file(fname, seed):
+   rng = random.Random(seed)
+   lines = generate_day_lines(rng, CDATE, 50, 1, make_stations(rng, 5), 0, 0, 0)
+   with open(fname, 'w') as fh:
+      fh.writelines(lines)
+
+   return lines
+
+def cache_file(cache, fname, lines):
+   writer = cache.open(fname)
+   assert isinstance(writer, CacheWriter)
+   writer.add(CDATE, ispd_common.parse_ispd_lines(lines, CDATE), os.path.getsize(fname))
+   writer.commit()
+
+@pytest.fixture
+def cache(tmp_path):
+   return ParseCache(str(tmp_path/'cache'), 1 << 30, ispd_common.ISPD_FIELDS, ispd_common.ISPD_COLUMNS)
+
+def test_miss_does_not_hash_before_parsing(tmp_path, cache, monkeypatch):
+   fname = str(tmp_path/'ispd.txt')
+   lines = write_file(fname, 1)
+   hashed = []
+   file_hash = ispd_cache.file_hash
+   def counted_file_hash(*args):
+      hashed.append(args)
+      return file_hash(*args)
+   monkeypatch.setattr(ispd_cache, 'file_hash', counted_file_hash)
+
+   writer = cache.open(fname)
+   writer.hasher.join()
+   assert len(hashed) == 1 and hashed[0][1] is writer.stop    # hashed on the writer's thread only
+   writer.add(CDATE, ispd_common.parse_ispd_lines(lines, CDATE), os.path.getsize(fname))
+   writer.commit()
+
+   cached = cache.open(fname)
+   assert isinstance(cached, CachedFile)
+   assert len(hashed) == 2
+   blocks = list(cached.get_blocks(0))
+   assert [block[0] for block in blocks] == [CDATE]
+   assert blocks[0][1]['ispdmeta'].to_records() == ispd_common.parse_ispd_lines(lines, CDATE)['ispdmeta'].to_records()
+   cached.close()
+
+def test_changed_file_is_parsed_again(tmp_path, cache):
+   fname = str(tmp_path/'ispd.txt')
+   cache_file(cache, fname, write_file(fname, 1))
+   stat = os.stat(fname)
+
+   # other contents of the same size with the same modification time
+   with open(fname, 'r+b') as fh:
+      fh.seek(4)
+      digit = fh.read(1)
+      fh.seek(4)
+      fh.write(b'1' if digit != b'1' else b'2')
+   os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+   writer = cache.open(fname)
+   assert isinstance(writer, CacheWriter)
+   writer.abort()
+
+   # a new modification time is a miss
+   cache_file(cache, fname, write_file(fname, 2))
+   os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+   writer = cache.open(fname)
+   assert isinstance(writer, CacheWriter)
+   writer.abort()
@@ -0,0 +1,85 @@
+"""
+Records of ispd_hdf5.HDF5Reader against the same rows parsed from ASCII lines
+"""
+
+import math
+import random
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('PgUtil')
+
+from gen_ispd import generate_day_lines, get_field_specs, make_stations
+from rda_ispd_python import ispd_common, ispd_hdf5
+from rda_ispd_python.ispddb_config import ISPD_DELIM
+
+DATES = ['1950-01-01', '1950-01-02', '1950-01-03']
+
+def day_lines(seed):
+   rng = random.Random(seed)
+   stations = make_stations(rng, 20)
+   start = 1
+   days = []
+   for cdate in DATES:
+      lines = generate_day_lines(rng, cdate, 150 + 40*len(days), start, stations, 0.1, 0.1, 0.1)
+      days.append(lines)
+      start += len(lines)
+
+   return days
+
+def numeric_value(text):
+   """ Return the float of the text of a numeric field, NaN for an empty or NaN field """
+
+   try:
+      return float(text)
+   except ValueError:
+      return math.nan
+
+def numeric_line(line):
+   """
+   Return line with the text of its int and float fields as held by a float dataset: the
+   shortest text of the float, without a fraction for an int, and NaN if empty
+   """
+
+   vals = line.rstrip('\n').split(ISPD_DELIM)
+   for i, (name, ftype, size, missing) in enumerate(get_field_specs()):
+      if ftype is str: continue
+      val = numeric_value(vals[i])
+      vals[i] = 'nan' if math.isnan(val) else str(int(val)) if ftype is int and val == int(val) else repr(val)
+
+   return ISPD_DELIM.join(vals) + '\n'
+
+def write_hdf5(fname, lines, numeric):
+   """
+   Write the fields of lines as one dataset per field under '/'; with numeric, the int and
+   float fields are float datasets, else all fields are byte strings of the ASCII text
+   """
+
+   specs = get_field_specs()
+   fields = list(zip(*[line.rstrip('\n').split(ISPD_DELIM) for line in lines]))
+   with h5py.File(fname, 'w') as h5:
+      for (name, ftype, size, missing), texts in zip(specs, fields):
+         if numeric and ftype is not str:
+            h5[name] = numpy.array([numeric_value(text) for text in texts], dtype='f8')
+         else:
+            h5[name] = numpy.array([text.encode('latin_1') for text in texts], dtype='S{}'.format(size + 1))
+
+@pytest.mark.parametrize('numeric', [False, True])
+def test_hdf5_records_match_ascii_records(tmp_path, monkeypatch, numeric):
+   monkeypatch.setattr(ispd_hdf5, 'H5CHUNK', 128)    # dates across chunks
+   days = day_lines(3)
+   fname = str(tmp_path/'ispd.h5')
+   write_hdf5(fname, [line for lines in days for line in lines], numeric)
+
+   with ispd_hdf5.HDF5Reader(fname) as reader:
+      blocks = list(reader.get_blocks(0))
+   assert [cdate for cdate, records, end in blocks] == DATES
+   assert blocks[-1][2] == sum(len(lines) for lines in days)
+
+   for (cdate, records, end), lines in zip(blocks, days):
+      expected = ispd_common.parse_ispd_lines([numeric_line(line) for line in lines] if numeric else lines, cdate)
+      assert records.counts() == expected.counts()
+      for aname in expected:
+         assert records[aname].to_records() == expected[aname].to_records(), aname
@@ -0,0 +1,40 @@
+"""
+Lookups of ispd_inventory.InventoryCache
+"""
+
+from rda_ispd_python.ispd_inventory import InventoryCache
+
+class RecordSink:
+   def __init__(self, records):
+      self.records = records
+
+   def get_records(self, table, fields, cnd):
+      return [dict(record) for record in self.records]
+
+def inventory_cache():
+   return InventoryCache('ispddb.ispd_inventory', RecordSink([
+      {'didx': 1, 'date': '1950-01-01', 'fname': 'a.txt', 'count': 10, 'miniidx': 1, 'maxiidx': 10, 'tidx': 1, 'tcount': 10},
+      {'didx': 2, 'date': '1950-01-02', 'fname': 'a.txt', 'count': 10, 'miniidx': 11, 'maxiidx': 20, 'tidx': 2, 'tcount': 10},
+      {'didx': 3, 'date': '1950-01-02', 'fname': 'b.txt', 'count': 5, 'miniidx': 21, 'maxiidx': 25, 'tidx': 2, 'tcount': 15}])).load()
+
+def test_lookups_return_copies():
+   cache = inventory_cache()
+   cache.get_date_record('1950-01-02')['count'] = 0
+   for pgrec in cache.get_date_records('1950-01-02'): pgrec['tidx'] = 9
+   cache.get_record(1)['date'] = '1950-02-01'
+
+   assert [pgrec['count'] for pgrec in cache.get_date_records('1950-01-02')] == [10, 5]
+   assert cache.max_tidx() == 2
+   assert cache.get_date_record('1950-01-01')['didx'] == 1
+
+def test_remove_updates_max_tidx():
+   cache = inventory_cache()
+   cache.remove(2)
+   assert cache.max_tidx() == 2
+   assert [pgrec['didx'] for pgrec in cache.get_date_records('1950-01-02')] == [3]
+   cache.remove(3)
+   assert cache.max_tidx() == 1
+   assert cache.get_date_record('1950-01-02') is None
+   assert cache.iidx2date(22) is None
+   cache.remove(1)
+   assert cache.max_tidx() is None and cache.max_didx() == 0
@@ -0,0 +1,78 @@
+"""
+Batched itidx lookups of leading-UID attachment records
+"""
+
+import re
+
+import pytest
+
+pytest.importorskip('PgUtil')
+
+from rda_ispd_python import ispd_common
+
+class TableSink:
+   """ Sink answering the 'field IN (...)' queries of the lookups from in-memory tables, counting them """
+
+   schema = None
+
+   def __init__(self, tables):
+      self.tables = tables
+      self.queries = []
+
+   def get_records(self, table, fields, cnd):
+      self.queries.append(table)
+      rows = self.tables.get(table, [])
+      if cnd:
+         field, vals = re.match(r"(\w+) IN \((.*)\)$", cnd).groups()
+         keys = {val.strip().strip("'") for val in vals.split(',')}
+         rows = [row for row in rows if str(row[field]) in keys]
+      return [dict(row) for row in rows]
+
+UIDS = ["{}{:04d}".format(prefix, i) for prefix in ('AB', 'CD') for i in range(50)]
+
+def itidx_records(tidx):
+   return [{'suid': "{:04d}".format(i), 'iidx': 100*tidx + i, 'tidx': tidx, 'date': '1950-01-0{}'.format(tidx)}
+           for i in range(0, 50, 2)]    # the odd uids are not in itidx
+
+@pytest.fixture
+def sink(monkeypatch):
+   sink = TableSink({'cntldb.itidx_ab': itidx_records(1), 'cntldb.itidx_cd': itidx_records(2),
+                     'ispdtrack_1': [{'iidx': 100}, {'iidx': 102}]})
+   monkeypatch.setattr(ispd_common, 'SINK', sink)
+   monkeypatch.setattr(ispd_common, 'PARTITIONS', {'ispdtrack_1'})
+   monkeypatch.setattr(ispd_common, 'ATTMNAME', 'ispdtrack')
+   ispd_common.init_current_indices()
+   yield sink
+   ispd_common.init_current_indices()
+
+@pytest.mark.parametrize('check', [0, 1])
+def test_batch_is_resolved_with_one_query_per_table(sink, monkeypatch, check):
+   monkeypatch.setattr(ispd_common, 'CHKEXIST', check)
+   monkeypatch.setattr(ispd_common, 'ITIDXBATCH', 10)
+
+   assert ispd_common.prefetch_itidx(UIDS) == 50
+   # 50 suids of each prefix in slices of 10; the loaded keys of the 25 iidxs of the one existing partition
+   expected = ['cntldb.itidx_ab']*5 + ['cntldb.itidx_cd']*5 + (['ispdtrack_1']*3 if check else [])
+   assert sorted(sink.queries) == sorted(expected)
+
+   dates = [ispd_common.get_itidx_date(uid) for uid in UIDS]
+   assert len(sink.queries) == len(expected)    # nothing queried per uid
+   loaded = {'AB0000', 'AB0002'} if check else set()
+   assert dates == [None if int(uid[2:]) % 2 or uid in loaded else '1950-01-0{}'.format(1 if uid[0] == 'A' else 2)
+                    for uid in UIDS]
+   assert ispd_common.CURIIDX == 248 and ispd_common.CURTIDX == 2
+
+   # a uid repeated in the file is loaded once with the check
+   assert ispd_common.get_itidx_date('AB0004') == (None if check else '1950-01-01')
+
+def test_uid_not_read_ahead_is_fetched_alone(sink):
+   assert ispd_common.get_itidx_date('cd0010') == '1950-01-02'
+   assert sink.queries == ['cntldb.itidx_cd']
+   assert ispd_common.get_itidx_date('CD0011') is None
+   assert sink.queries == ['cntldb.itidx_cd']*2
+
+def test_preloaded_prefix_table_is_read_once(sink, monkeypatch):
+   monkeypatch.setattr(ispd_common, 'ITIDXPRELOAD', 1)
+   ispd_common.prefetch_itidx(UIDS[:3])
+   for uid in UIDS[:50]: ispd_common.get_itidx_date(uid)
+   assert sink.queries == ['cntldb.itidx_ab']
@@ -0,0 +1,103 @@
+"""
+Reload of the changed dates of a file recorded in a load manifest
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('PgUtil')
+
+from gen_ispd import generate_ispd_file
+from rda_ispd_python.ispddb_config import DBCNTL, ISPD_DELIM, ISPD_NAMES
+
+FILL = '''
+import sys
+from rda_ispd_python.ispddb import FillISPD
+
+fname, db, manifest, check = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+fill = FillISPD(add_inventory=True, check_existing=check, manifest=manifest, sink='sqlite', sink_path=db)
+fill.initialize_db()
+fill.get_input_files([fname])
+fill.initialize_indices()
+fill.fill_ispd_data()
+fill.close_db()
+'''
+
+def run_fill(tmp_path, fname, check=0):
+   env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+   result = subprocess.run([sys.executable, '-c', FILL, fname, str(tmp_path/'ispd.db'), str(tmp_path/'ispd.manifest'), str(check)],
+                           cwd=tmp_path, env=env, capture_output=True, text=True)
+   assert result.returncode == 0, result.stderr
+
+def loaded_rows(tmp_path):
+   """ Return the rows of each table, the ispdobs rows of ncep_type 999 and the inventory {date: count} """
+
+   conn = sqlite3.connect(str(tmp_path/'ispd.db'))
+   conn.execute("ATTACH DATABASE ? AS cntl", (str(tmp_path/"ispd.{}.sqlite".format(DBCNTL)),))
+   names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+   counts = {}
+   for aname in ISPD_NAMES:
+      counts[aname] = sum(conn.execute("SELECT count(*) FROM {}".format(name)).fetchone()[0]
+                          for name in names if name.startswith(aname + '_'))
+   changed = sum(conn.execute("SELECT count(*) FROM {} WHERE ncep_type = 999".format(name)).fetchone()[0]
+                 for name in names if name.startswith('ispdobs_'))
+   inventory = dict(conn.execute("SELECT date, sum(count) FROM cntl.ispd_inventory GROUP BY date").fetchall())
+   conn.close()
+
+   return counts, changed, inventory
+
+def manifest_days(tmp_path):
+   conn = sqlite3.connect(str(tmp_path/'ispd.manifest'))
+   days = dict(conn.execute("SELECT date, checksum FROM days").fetchall())
+   conn.close()
+
+   return days
+
+def change_date(fname, cdate):
+   """ Drop the first line of a date and change the ncep_type of its second; return the lines left """
+
+   prefix = cdate.replace('-', '')
+   with open(fname) as fh:
+      lines = fh.readlines()
+   first = [i for i, line in enumerate(lines) if line.startswith(prefix)][0]
+   vals = lines[first + 1].rstrip('\n').split(ISPD_DELIM)
+   vals[1] = '999'
+   lines[first + 1] = ISPD_DELIM.join(vals) + '\n'
+   del lines[first]
+   stat = os.stat(fname)
+   with open(fname, 'w') as fh:
+      fh.writelines(lines)
+   os.utime(fname, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+   return len(lines)
+
+def test_changed_date_is_replaced(tmp_path):
+   fname = str(tmp_path/'ispd.txt')
+   count = generate_ispd_file(fname, days=3, rows_per_day=200, seed=4)
+   run_fill(tmp_path, fname)
+   counts, changed, inventory = loaded_rows(tmp_path)
+   assert counts[ISPD_NAMES[0]] == count and changed == 0
+
+   count = change_date(fname, '1950-01-02')
+   run_fill(tmp_path, fname)
+   counts, changed, inventory = loaded_rows(tmp_path)
+   assert counts == {aname: count for aname in ISPD_NAMES}
+   assert changed == 1
+   assert sum(inventory.values()) == count
+   assert None not in manifest_days(tmp_path).values()
+
+def test_skipped_date_is_not_recorded(tmp_path):
+   fname = str(tmp_path/'ispd.txt')
+   count = generate_ispd_file(fname, days=2, rows_per_day=100, seed=5)
+   run_fill(tmp_path, fname)
+   os.remove(str(tmp_path/'ispd.manifest'))
+
+   # loaded again as a new file, every record is skipped as already loaded
+   run_fill(tmp_path, fname, 1)
+   counts, changed, inventory = loaded_rows(tmp_path)
+   assert counts == {aname: count for aname in ISPD_NAMES}
+   assert set(manifest_days(tmp_path).values()) == {None}
@@ -0,0 +1,90 @@
+"""
+Concurrent table loads of ispd_pool.PoolWriter, over stand-in connections
+"""
+
+import threading
+
+import pytest
+
+pytest.importorskip('PgDBI')
+
+from rda_ispd_python import ispd_pool
+from rda_ispd_python.ispddb_config import ISPD_NAMES, TABLECOUNT
+
+class CopyCursor:
+   def __init__(self, conn):
+      self.conn = conn
+
+   def execute(self, sqlstr):
+      self.conn.executed.append(sqlstr)
+
+   def copy_expert(self, sqlstr, stream, size):
+      while stream.read(size): pass
+      self.conn.copied.append((sqlstr, stream.count))
+
+   def close(self):
+      pass
+
+class CopyConnection:
+   """ Connection that only records the statements, COPY statements and commits it gets """
+
+   def __init__(self):
+      self.executed = []
+      self.copied = []
+      self.commits = 0
+
+   def cursor(self):
+      return CopyCursor(self)
+
+   def commit(self):
+      self.commits += 1
+
+   def rollback(self):
+      pass
+
+   def close(self):
+      pass
+
+@pytest.fixture
+def conns(monkeypatch):
+   opened = []
+   def pool_connect():
+      opened.append(CopyConnection())
+      return opened[-1]
+   monkeypatch.setattr(ispd_pool, 'pool_connect', pool_connect)
+   return opened
+
+@pytest.mark.parametrize('size', [2, 3])
+def test_small_pool_loads_all_tables(conns, size):
+   writer = ispd_pool.PoolWriter(size, 'copy', False)
+   assert writer.size == TABLECOUNT
+   tables = [(aname, "{}_1".format(aname), [{'uid': ['u1', 'u2', 'u3']}]) for aname in ISPD_NAMES]
+
+   def fill():
+      for cdate in ('1950-01-01', '1950-01-02'):
+         writer.submit_day(cdate, tables)
+      writer.wait()
+   thread = threading.Thread(target=fill, daemon=True)
+   thread.start()
+   thread.join(30)
+   assert not thread.is_alive(), "pool writer deadlocked"
+   writer.close()
+
+   assert len(conns) == TABLECOUNT
+   copied = [entry for conn in conns for entry in conn.copied]
+   assert len(copied) == 2*TABLECOUNT
+   assert sum(count for sqlstr, count in copied) == 2*TABLECOUNT*3
+   assert sum(conn.commits for conn in conns) == 2*TABLECOUNT
+
+def test_partition_is_committed_before_pooled_loads(conns, monkeypatch):
+   from rda_ispd_python import ispd_common, ispd_sink
+
+   monkeypatch.setattr(ispd_common, 'SINK', ispd_sink.NullSink())
+   monkeypatch.setattr(ispd_common, 'PARTITIONS', {'ispdmeta_1'})
+   writer = ispd_pool.PoolWriter(TABLECOUNT, 'copy', False)
+   monkeypatch.setattr(ispd_common, 'POOLWRITER', writer)
+
+   assert ispd_common.check_partition('ispdmeta', '2') == 'ispdmeta_2'
+   writer.close()
+   assert [sqlstr for conn in conns for sqlstr in conn.executed] == ["CREATE TABLE IF NOT EXISTS ispdmeta_2 (LIKE ispdmeta_1 INCLUDING ALL)"]
+   assert sum(conn.commits for conn in conns) == 1
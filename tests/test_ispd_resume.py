@@ -0,0 +1,84 @@
+"""
+Resume of a journaled fill killed part way through a spilled date
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip('PgUtil')
+
+from gen_ispd import generate_ispd_file
+from rda_ispd_python.ispddb_config import DBCNTL, ISPD_NAMES
+
+# fill a file into a SQLite sink, spilling each date in parts of 2000 lines committed one at a
+# time; with kill, the process exits without cleanup at that call of SQLiteSink.add_records,
+# without kill, the fill resumes from the journal
+FILL = '''
+import os, sys
+from rda_ispd_python import ispd_common, ispd_sink
+from rda_ispd_python.ispddb import FillISPD
+
+fname, db, journal, kill = sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4])
+ispd_common.SPILLLINES = 2000
+calls = [0]
+add_records = ispd_sink.SQLiteSink.add_records
+def killed_add_records(self, table, records):
+   calls[0] += 1
+   if calls[0] == kill: os._exit(3)
+   return add_records(self, table, records)
+if kill: ispd_sink.SQLiteSink.add_records = killed_add_records
+
+fill = FillISPD(add_inventory=True, memory_budget=1 << 20, journal=journal, resume=not kill,
+                sink='sqlite', sink_path=db)
+fill.initialize_db()
+fill.get_input_files([fname])
+fill.initialize_indices()
+fill.fill_ispd_data()
+fill.close_db()
+'''
+
+def run_fill(tmp_path, fname, kill):
+   env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+   return subprocess.run([sys.executable, '-c', FILL, fname, str(tmp_path/'ispd.db'), str(tmp_path/'fill.journal'), str(kill)],
+                         cwd=tmp_path, env=env, capture_output=True, text=True)
+
+def table_counts(tmp_path):
+   """ Return the rows and distinct uids of each table, and the records counted in the inventory """
+
+   conn = sqlite3.connect(str(tmp_path/'ispd.db'))
+   conn.execute("ATTACH DATABASE ? AS cntl", (str(tmp_path/"ispd.{}.sqlite".format(DBCNTL)),))
+   names = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+   counts = {}
+   for aname in ISPD_NAMES:
+      rows = uids = 0
+      for table in [name for name in names if name.startswith(aname + '_')]:
+         cnt, ucnt = conn.execute("SELECT count(*), count(DISTINCT uid) FROM {}".format(table)).fetchone()
+         rows += cnt
+         uids += ucnt
+      counts[aname] = (rows, uids)
+   inventory = conn.execute("SELECT sum(count) FROM cntl.ispd_inventory").fetchone()[0] or 0
+   conn.close()
+
+   return counts, inventory
+
+# killed in the first date, in the second date and between dates
+@pytest.mark.parametrize('kill', [6, 14, 23])
+def test_killed_fill_resumes_without_duplicates(tmp_path, kill):
+   fname = str(tmp_path/'ispd.txt')
+   lines = generate_ispd_file(fname, days=3, rows_per_day=5000, seed=10)
+
+   killed = run_fill(tmp_path, fname, kill)
+   assert killed.returncode == 3, killed.stderr
+   counts, inventory = table_counts(tmp_path)
+   assert counts[ISPD_NAMES[0]][0] < lines
+
+   resumed = run_fill(tmp_path, fname, 0)
+   assert resumed.returncode == 0, resumed.stderr
+   counts, inventory = table_counts(tmp_path)
+   for aname in ISPD_NAMES:
+      assert counts[aname] == (lines, lines), aname
+   assert inventory == lines
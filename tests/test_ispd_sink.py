@@ -0,0 +1,29 @@
+"""
+Sink base class and output directories of ispd_sink.FileSink
+"""
+
+import pytest
+
+pytest.importorskip('PgDBI')
+
+from rda_ispd_python import ispd_sink
+
+def test_sink_base_is_abstract():
+   with pytest.raises(TypeError):
+      ispd_sink.ISPDSink()
+
+def test_file_sink_refuses_earlier_output(tmp_path):
+   path = str(tmp_path/'out')
+   sink = ispd_sink.open_sink('file', path)
+   sink.add_record('ispddb.ispd_inventory', {'date': '1950-01-01', 'count': 1})
+   sink.close()
+
+   with pytest.raises(FileExistsError):
+      ispd_sink.open_sink('file', path)
+
+   # an empty load.sql, from a fill that wrote nothing, is reused
+   empty = str(tmp_path/'empty')
+   ispd_sink.open_sink('file', empty).close()
+   sink = ispd_sink.open_sink('file', empty)
+   assert sink.add_record('ispddb.ispd_inventory', {'date': '1950-01-01', 'count': 1}) == 1
+   sink.close()